@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Compares the named cursor and COPY ... TO STDOUT extraction engines.
+
+Needs the same TAP_POSTGRES_HOST/USER/PASSWORD/PORT environment as the tests:
+
+    python benchmarks/bench_copy_extraction.py --rows 200000
+"""
+import argparse
+import os
+import time
+import psycopg2
+import psycopg2.extras
+import singer
+import tap_postgres.db as post_db
+import tap_postgres.sync_strategies.copy_extraction as copy_extraction
+
+TABLE_NAME = 'bench_copy_extraction'
+
+COLUMNS = [('id', 'integer', 'i'),
+           ('our_bigint', 'bigint', 'i * 1000003'),
+           ('our_text', 'text', "md5(i::text) || E'\\t' || repeat('x', i % 50)"),
+           ('our_varchar', 'character varying', "'row ' || i"),
+           ('our_boolean', 'boolean', 'i % 2 = 0'),
+           ('our_double', 'double precision', 'i / 7.0'),
+           ('our_numeric', 'numeric', '(i / 3.0)::numeric(12,2)'),
+           ('our_ts', 'timestamp without time zone', "timestamp '2020-01-01' + i * interval '1 second'"),
+           ('our_date', 'date', "date '2020-01-01' + i % 1000"),
+           ('our_json', 'jsonb', "jsonb_build_object('i', i, 'tags', jsonb_build_array('a', 'b'))"),
+           ('our_uuid', 'uuid', 'md5(i::text)::uuid')]
+
+def conn_config():
+    return {'host': os.environ['TAP_POSTGRES_HOST'],
+            'user': os.environ['TAP_POSTGRES_USER'],
+            'password': os.environ['TAP_POSTGRES_PASSWORD'],
+            'port': os.environ['TAP_POSTGRES_PORT'],
+            'dbname': os.environ.get('TAP_POSTGRES_DBNAME', 'postgres')}
+
+def create_table(config, rows):
+    with post_db.open_connection(config) as conn:
+        with conn.cursor() as cur:
+            cur.execute('DROP TABLE IF EXISTS {}'.format(TABLE_NAME))
+            cur.execute('CREATE TABLE {} ({})'.format(TABLE_NAME, ', '.join('{} {}'.format(n, t) for n, t, _ in COLUMNS)))
+            cur.execute('INSERT INTO {} SELECT {} FROM generate_series(1, %s) AS i'.format(TABLE_NAME, ', '.join(e for _, _, e in COLUMNS)),
+                        (rows,))
+
+def stream_and_md_map():
+    md_map = {(): {'schema-name': 'public'}}
+    for name, sql_datatype, _ in COLUMNS:
+        md_map[('properties', name)] = {'sql-datatype': sql_datatype}
+    return {'stream': TABLE_NAME, 'tap_stream_id': TABLE_NAME, 'table_name': TABLE_NAME}, md_map
+
+def run(config, engine, copy_format=None):
+    psycopg2.extras.register_default_jsonb(loads=lambda x: str(x))
+    stream, md_map = stream_and_md_map()
+    columns = [name for name, _, _ in COLUMNS]
+    select_sql = 'SELECT {} FROM {}'.format(','.join(map(post_db.prepare_columns_sql, columns)),
+                                            post_db.fully_qualified_table_name('public', TABLE_NAME))
+    time_extracted = singer.utils.now()
+    convert_row = post_db.row_converter(columns, md_map)
+    count = 0
+    start = time.perf_counter()
+    with post_db.open_connection(config) as conn:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor, name='stitch_cursor') as cur:
+            cur.itersize = post_db.cursor_iter_size
+            if engine == 'copy':
+                rows = copy_extraction.copy_rows(conn, select_sql, copy_format)
+            else:
+                cur.execute(select_sql)
+                rows = cur
+            for rec in rows:
+                message = post_db.selected_row_to_singer_message(stream, rec, 1, columns, time_extracted, md_map, convert_row)
+                singer.format_message(message)
+                count = count + 1
+    return count, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--skip-setup', action='store_true')
+    args = parser.parse_args()
+
+    config = conn_config()
+    if not args.skip_setup:
+        create_table(config, args.rows)
+
+    for label, engine, copy_format in [('cursor', 'cursor', None),
+                                       ('copy text', 'copy', 'text'),
+                                       ('copy binary', 'copy', 'binary')]:
+        count, elapsed = run(config, engine, copy_format)
+        print('{:<12} {:>9} rows {:>8.2f}s {:>10.0f} rows/s'.format(label, count, elapsed, count / elapsed))
+
+if __name__ == '__main__':
+    main()
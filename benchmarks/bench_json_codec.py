@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Times parsing wal2json format-version 2 payloads with the stdlib json, simplejson
+and json_codec (orjson, when it is installed), and decoding them into records.
+The payloads are changes to the table of tests/test_postgres_logical_replication_v2_messages.py.
+Needs no database:
+
+    python benchmarks/bench_json_codec.py --count 100000
+"""
+import argparse
+import json
+import time
+import simplejson
+from singer import metadata
+import singer.utils
+import tap_postgres.sync_strategies.json_codec as json_codec
+import tap_postgres.sync_strategies.logical_replication as logical_replication
+
+COLUMNS = [('id', 'integer', 1),
+           ('our_varchar', 'character varying', 'our_varchar'),
+           ('our_varchar_10', 'character varying', 'varchar_10'),
+           ('our_text', 'text', 'some text'),
+           ('our_text_2', 'text', 'NOT SELECTED'),
+           ('our_integer', 'integer', 44100),
+           ('our_smallint', 'smallint', 1),
+           ('our_bigint', 'bigint', 1000000),
+           ('our_decimal', 'numeric', 1234567890.01),
+           ('OUR TS', 'timestamp without time zone', '1997-02-02 02:02:02.722184'),
+           ('OUR TS TZ', 'timestamp with time zone', '1997-02-02 07:02:02.722184+00'),
+           ('OUR TIME', 'time without time zone', '12:11:10'),
+           ('OUR TIME TZ', 'time with time zone', '12:11:10-04'),
+           ('OUR DATE', 'date', '1998-03-04'),
+           ('our_double', 'double precision', 1.1),
+           ('our_real', 'real', 1.2),
+           ('our_boolean', 'boolean', True),
+           ('our_bit', 'bit', '0'),
+           ('our_json', 'json', '{"secret": 55}'),
+           ('our_jsonb', 'jsonb', '{"burgers": "good"}'),
+           ('our_uuid', 'uuid', '8d3c5fe2-9c8b-11e8-a27a-0242ac110002'),
+           ('our_store', 'hstore', '"name"=>"betty", "size"=>"small"'),
+           ('our_citext', 'citext', 'maGICKal 4'),
+           ('our_cidr', 'cidr', '192.168.100.128/25'),
+           ('our_inet', 'inet', '192.168.100.128/24'),
+           ('our_mac', 'macaddr', '08:00:2b:01:02:03'),
+           ('our_alignment_enum', 'alignment', 'good'),
+           ('our_money', 'money', '$100.11')]
+
+def corpus(count):
+    payloads = []
+    for idx in range(count):
+        action = 'IUD'[idx % 3]
+        payload = {'action': action, 'schema': 'public', 'table': 'postgres_logical_replication_test',
+                   'timestamp': '2019-01-02 03:04:05.123456+00'}
+        columns = [{'name': name, 'type': sql_datatype, 'value': idx if name == 'id' else value} for name, sql_datatype, value in COLUMNS]
+        if action == 'D':
+            payload['identity'] = columns[:1]
+        else:
+            payload['columns'] = columns
+        payloads.append(json.dumps(payload).encode('utf-8'))
+    return payloads
+
+def stream():
+    md = {(): {'schema-name': 'public'}}
+    for name, sql_datatype, _ in COLUMNS:
+        md[('properties', name)] = {'sql-datatype': sql_datatype, 'selected': name != 'our_text_2'}
+    return {'tap_stream_id': 'postgres-public-postgres_logical_replication_test', 'table_name': 'postgres_logical_replication_test',
+            'stream': 'postgres_logical_replication_test', 'metadata': metadata.to_list(md),
+            'schema': {'properties': {name: {} for name, _, _ in COLUMNS + [('_sdc_deleted_at', None, None)]}}}
+
+def timed(label, count, function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print('{:<36} {:>9} payloads {:>8.2f}s {:>10.0f} payloads/s'.format(label, count, elapsed, count / elapsed))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+
+    payloads = corpus(args.count)
+    texts = [p.decode('utf-8') for p in payloads]
+    codec = 'orjson' if json_codec.orjson is not None else 'json'
+
+    timed('json.loads (str)', len(payloads), lambda: [json.loads(p) for p in texts])
+    timed('simplejson.loads (str)', len(payloads), lambda: [simplejson.loads(p) for p in texts])
+    timed('json_codec.loads (bytes, {})'.format(codec), len(payloads), lambda: [json_codec.loads(p) for p in payloads])
+
+    s = stream()
+    state = {'bookmarks': {s['tap_stream_id']: {'version': 1}}}
+    conn_info = {'dbname': 'postgres'}
+    decoders = {s['tap_stream_id']: logical_replication.stream_decoder(s, state, conn_info)}
+    time_extracted = singer.utils.now()
+
+    def decode(loads, corpus_payloads):
+        for lsn, payload in enumerate(corpus_payloads):
+            for record_message in logical_replication.consume_message_format_2(loads(payload), conn_info, decoders, time_extracted, lsn):
+                singer.format_message(record_message)
+
+    timed('records via json.loads', len(payloads), lambda: decode(json.loads, texts))
+    timed('records via json_codec.loads', len(payloads), lambda: decode(json_codec.loads, payloads))
+
+if __name__ == '__main__':
+    main()
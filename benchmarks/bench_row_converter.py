@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Times turning selected rows of a 300 column table into singer records, per
+cell through selected_value_to_singer_value and through the row converter plan.
+Needs no database:
+
+    python benchmarks/bench_row_converter.py --rows 20000
+"""
+import argparse
+import datetime
+import decimal
+import time
+import tap_postgres.db as post_db
+
+COLUMN_TYPES = [('integer', 44100),
+                ('character varying', 'some text'),
+                ('timestamp without time zone', datetime.datetime(1997, 2, 2, 2, 2, 2, 722184)),
+                ('numeric', decimal.Decimal('12.34')),
+                ('boolean', True),
+                ('double precision', 1.5),
+                ('date', datetime.date(1998, 3, 4)),
+                ('jsonb', '{"a": 1}'),
+                ('integer[]', [1, 2, 3]),
+                ('text[]', [['a', 'b'], ['c', None]])]
+
+def table(column_count):
+    columns = []
+    md_map = {}
+    row = []
+    for idx in range(column_count):
+        sql_datatype, value = COLUMN_TYPES[idx % len(COLUMN_TYPES)]
+        name = 'col_{}'.format(idx)
+        columns.append(name)
+        md_map[('properties', name)] = {'sql-datatype': sql_datatype}
+        row.append(value)
+    return columns, md_map, tuple(row)
+
+def per_cell(row, columns, md_map):
+    #the conversion as it was done before the converter plan
+    row_to_persist = ()
+    for idx, elem in enumerate(row):
+        sql_datatype = md_map.get(('properties', columns[idx]))['sql-datatype']
+        row_to_persist += (post_db.selected_value_to_singer_value(elem, sql_datatype),)
+    return dict(zip(columns, row_to_persist))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--columns', type=int, default=300)
+    args = parser.parse_args()
+
+    columns, md_map, row = table(args.columns)
+    convert_row = post_db.row_converter(columns, md_map)
+    assert per_cell(row, columns, md_map) == convert_row(row)
+
+    for label, convert in [('per cell', lambda r: per_cell(r, columns, md_map)),
+                           ('plan', convert_row)]:
+        start = time.perf_counter()
+        for _ in range(args.rows):
+            convert(row)
+        elapsed = time.perf_counter() - start
+        print('{:<10} {:>9} rows {:>8.2f}s {:>10.0f} rows/s'.format(label, args.rows, elapsed, args.rows / elapsed))
+
+if __name__ == '__main__':
+    main()
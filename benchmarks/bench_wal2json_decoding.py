@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Times decoding a recorded wal2json change stream into singer records, and parsing
+its dates and timestamps with dateutil and with pg_literals. Needs no database.
+
+A change stream can be recorded with
+
+    pg_recvlogical -d postgres --slot stitch --start -o include-timestamp=1 -f changes.jsonl
+
+and decoded with
+
+    python benchmarks/bench_wal2json_decoding.py --changes changes.jsonl
+
+Without --changes a stream of inserts into an orders table is made up.
+"""
+import argparse
+import datetime
+import json
+import random
+import re
+import time
+from dateutil.parser import parse
+from singer import metadata
+import singer.utils
+import tap_postgres.sync_strategies.logical_replication as logical_replication
+import tap_postgres.sync_strategies.pg_literals as pg_literals
+
+DATETIME_TYPES = {'timestamp without time zone', 'timestamp with time zone', 'date'}
+
+def made_up_changes(count):
+    rnd = random.Random(0)
+    start = datetime.datetime(2019, 1, 1)
+    payloads = []
+    for idx in range(count):
+        created_at = start + datetime.timedelta(seconds=idx * 7, microseconds=rnd.randint(0, 999999))
+        payloads.append(json.dumps({'change': [{
+            'kind': 'insert', 'schema': 'public', 'table': 'orders',
+            'columnnames': ['id', 'customer', 'placed_on', 'created_at', 'updated_at', 'amount'],
+            'columntypes': ['integer', 'text', 'date', 'timestamp without time zone', 'timestamp with time zone', 'numeric(12,2)'],
+            'columnvalues': [idx, 'customer {}'.format(rnd.randint(0, 500)), str(created_at.date()), str(created_at),
+                             str(created_at) + '-05', '{:.2f}'.format(rnd.uniform(0, 1000))]}]}))
+    return payloads
+
+def streams_of(payloads):
+    """A selected stream for every table of the change stream, typed by its columntypes."""
+    streams = {}
+    for payload in payloads:
+        for change in json.loads(payload)['change']:
+            tap_stream_id = 'postgres-{}-{}'.format(change['schema'], change['table'])
+            if tap_stream_id in streams or 'columntypes' not in change:
+                continue
+            md = {(): {'schema-name': change['schema']}}
+            for name, sql_datatype in zip(change['columnnames'], change['columntypes']):
+                md[('properties', name)] = {'sql-datatype': re.sub(r'\(.*\)', '', sql_datatype), 'selected': True}
+            streams[tap_stream_id] = {'tap_stream_id': tap_stream_id, 'table_name': change['table'], 'stream': change['table'],
+                                      'metadata': metadata.to_list(md),
+                                      'schema': {'properties': {name: {} for name in change['columnnames'] + ['_sdc_deleted_at']}}}
+    return list(streams.values())
+
+def datetime_values(payloads):
+    values = []
+    for payload in payloads:
+        for change in json.loads(payload)['change']:
+            for value, sql_datatype in zip(change.get('columnvalues', []), change.get('columntypes', [])):
+                if value is not None and sql_datatype in DATETIME_TYPES:
+                    values.append(value)
+    return values
+
+def timed(label, count, unit, function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print('{:<32} {:>9} {} {:>8.2f}s {:>10.0f} {}/s'.format(label, count, unit, elapsed, count / elapsed, unit))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--changes', help='wal2json format-version 1 messages, one per line')
+    parser.add_argument('--count', type=int, default=50000, help='number of made up changes without --changes')
+    args = parser.parse_args()
+
+    if args.changes:
+        with open(args.changes) as f:
+            payloads = [line for line in f if line.strip()]
+    else:
+        payloads = made_up_changes(args.count)
+
+    streams = streams_of(payloads)
+    state = {'bookmarks': {s['tap_stream_id']: {'version': 1} for s in streams}}
+    conn_info = {'dbname': 'postgres'}
+    decoders = {s['tap_stream_id']: logical_replication.stream_decoder(s, state, conn_info) for s in streams}
+    time_extracted = singer.utils.now()
+
+    def decode():
+        for lsn, payload in enumerate(payloads):
+            for _ in logical_replication.consume_message_format_1(json.loads(payload), conn_info, decoders, time_extracted, lsn):
+                pass
+
+    values = datetime_values(payloads)
+    timed('dateutil', len(values), 'values', lambda: [parse(v) for v in values])
+    timed('pg_literals', len(values), 'values', lambda: [pg_literals.parse_timestamp(v) for v in values])
+    timed('decoding', len(payloads), 'messages', decode)
+    print('timestamp cache: {}'.format(logical_replication.timestamp_to_singer.cache_info()))
+    print('date cache:      {}'.format(logical_replication.date_to_singer.cache_info()))
+
+if __name__ == '__main__':
+    main()
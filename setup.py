@@ -14,6 +14,9 @@ setup(name='tap-postgres',
           'strict-rfc3339==0.7',
       ],
       extras_require={
+          'orjson': [
+              'orjson',
+          ],
           'dev': [
               'ipdb',
               'pylint==2.6.0',
@@ -458,7 +458,8 @@ def do_sync_incremental(conn_config, stream, state, desired_columns, md_map):
     LOGGER.info("Stream %s is using incremental replication with replication key %s", stream['tap_stream_id'], replication_key)
 
     stream_state = state.get('bookmarks', {}).get(stream['tap_stream_id'])
-    illegal_bk_keys = set(stream_state.keys()).difference(set(['replication_key', 'replication_key_value', 'version', 'last_replication_method']))
+    illegal_bk_keys = set(stream_state.keys()).difference(set(['replication_key', 'replication_key_value', 'version', 'last_replication_method',
+                                                               'partition_replication_key_values', 'finished_partitions']))
     if len(illegal_bk_keys) != 0:
         raise Exception("invalid keys found in state: {}".format(illegal_bk_keys))
 
@@ -516,16 +517,16 @@ def sync_method_for_streams(streams, state, default_replication_method):
             lookup[stream['tap_stream_id']] = 'incremental'
             traditional_steams.append(stream)
 
-        elif get_bookmark(state, stream['tap_stream_id'], 'xmin') and get_bookmark(state, stream['tap_stream_id'], 'lsn'):
+        elif full_table.is_interrupted(state, stream['tap_stream_id']) and get_bookmark(state, stream['tap_stream_id'], 'lsn'):
             #finishing previously interrupted full-table (first stage of logical replication)
             lookup[stream['tap_stream_id']] = 'logical_initial_interrupted'
             traditional_steams.append(stream)
 
         #inconsistent state
-        elif get_bookmark(state, stream['tap_stream_id'], 'xmin') and not get_bookmark(state, stream['tap_stream_id'], 'lsn'):
+        elif full_table.is_interrupted(state, stream['tap_stream_id']) and not get_bookmark(state, stream['tap_stream_id'], 'lsn'):
             raise Exception("Xmin found(%s) in state implying full-table replication but no lsn is present")
 
-        elif not get_bookmark(state, stream['tap_stream_id'], 'xmin') and not get_bookmark(state, stream['tap_stream_id'], 'lsn'):
+        elif not full_table.is_interrupted(state, stream['tap_stream_id']) and not get_bookmark(state, stream['tap_stream_id'], 'lsn'):
             #initial full-table phase of logical replication
             lookup[stream['tap_stream_id']] = 'logical_initial'
             traditional_steams.append(stream)
@@ -550,6 +551,25 @@ def sync_traditional_stream(conn_config, stream, state, sync_method, end_lsn):
 
     register_type_adapters(conn_config)
 
+    #a snapshot only ever belongs to the stream that exported it
+    conn_config.pop('snapshot_id', None)
+    #connections reading one table in parallel must all see it as of the same snapshot, or
+    #rows a concurrent update moves between their ranges are missed or read twice
+    parallel_read = sync_method != 'incremental' and full_table.full_table_workers(conn_config, md_map) > 1
+    if not conn_config.get('use_exported_snapshot') and not parallel_read:
+        return sync_stream_method(conn_config, stream, state, sync_method, end_lsn, desired_columns, md_map, None)
+
+    lsn = logical_replication.fetch_current_lsn(conn_config) if sync_method.startswith('logical') else None
+    snapshot = post_db.export_snapshot(conn_config, lsn)
+    conn_config['snapshot_id'] = snapshot['snapshot_id']
+    try:
+        return sync_stream_method(conn_config, stream, state, sync_method, end_lsn, desired_columns, md_map, snapshot['lsn'])
+    finally:
+        #released as soon as the stream's connections are done with it, so vacuum is not held back for the run
+        post_db.release_snapshot(conn_config['dbname'])
+        conn_config.pop('snapshot_id', None)
+
+def sync_stream_method(conn_config, stream, state, sync_method, end_lsn, desired_columns, md_map, snapshot_lsn):
     if sync_method == 'full':
         state = singer.set_currently_syncing(state, stream['tap_stream_id'])
         state = do_sync_full_table(conn_config, stream, state, desired_columns, md_map)
@@ -559,7 +579,8 @@ def sync_traditional_stream(conn_config, stream, state, sync_method, end_lsn):
     elif sync_method == 'logical_initial':
         state = singer.set_currently_syncing(state, stream['tap_stream_id'])
         LOGGER.info("Performing initial full table sync")
-        state = singer.write_bookmark(state, stream['tap_stream_id'], 'lsn', end_lsn)
+        #with an exported snapshot the table is read as of snapshot_lsn, so replication picks up from there
+        state = singer.write_bookmark(state, stream['tap_stream_id'], 'lsn', snapshot_lsn or end_lsn)
 
         sync_common.send_schema_message(stream, [])
         state = full_table.sync_table(conn_config, stream, state, desired_columns, md_map)
@@ -576,15 +597,38 @@ def sync_traditional_stream(conn_config, stream, state, sync_method, end_lsn):
     singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
     return state
 
+def prepare_logical_streams(conn_config, logical_streams):
+    logical_streams = list(map(lambda s: logical_replication.add_automatic_properties(s, conn_config), logical_streams))
+    for s in logical_streams:
+        sync_common.send_schema_message(s, ['lsn'])
+    return logical_streams
+
 def sync_logical_streams(conn_config, logical_streams, state, end_lsn):
     if logical_streams:
         LOGGER.info("Pure Logical Replication upto lsn %s for (%s)", end_lsn, list(map(lambda s: s['tap_stream_id'], logical_streams)))
-        logical_streams = list(map(lambda s: logical_replication.add_automatic_properties(s, conn_config), logical_streams))
+        logical_streams = prepare_logical_streams(conn_config, logical_streams)
 
         state = logical_replication.sync_tables(conn_config, logical_streams, state, end_lsn)
 
     return state
 
+def sync_logical_databases(conn_config, logical_streams, state, end_lsn):
+    databases = [(dbname, list(streams)) for dbname, streams in
+                 itertools.groupby(logical_streams, lambda s: metadata.to_map(s['metadata']).get(()).get('database-name'))]
+    logical_workers = conn_config.get('logical_workers') or 1
+    if conn_config.get('logical_streaming'):
+        #a streaming database never finishes, so every database gets its own thread
+        logical_workers = len(databases)
+    if logical_workers <= 1 or len(databases) <= 1:
+        for dbname, streams in databases:
+            conn_config['dbname'] = dbname
+            state = sync_logical_streams(conn_config, streams, state, end_lsn)
+        return state
+
+    LOGGER.info("Pure Logical Replication upto lsn %s for %s databases, %s at a time", end_lsn, len(databases), logical_workers)
+    databases = [(dbname, prepare_logical_streams(conn_config, streams)) for dbname, streams in databases]
+    return logical_replication.sync_databases(conn_config, databases, state, end_lsn, logical_workers)
+
 
 def register_type_adapters(conn_config):
     with post_db.open_connection(conn_config) as conn:
@@ -655,6 +699,11 @@ def do_sync(conn_config, catalog, default_replication_method, state):
 
     sync_method_lookup, traditional_streams, logical_streams = sync_method_for_streams(streams, state, default_replication_method)
 
+    if logical_streams and (conn_config.get('logical_max_slot_lag_bytes') or conn_config.get('logical_max_table_changes')):
+        #streams quicker to copy again than to replay go back to logical_initial
+        state = logical_replication.reset_lagging_streams(conn_config, logical_streams, state, end_lsn)
+        sync_method_lookup, traditional_streams, logical_streams = sync_method_for_streams(streams, state, default_replication_method)
+
     if currently_syncing:
         LOGGER.info("found currently_syncing: %s", currently_syncing)
         currently_syncing_stream = list(filter(lambda s: s['tap_stream_id'] == currently_syncing, traditional_streams))
@@ -669,10 +718,10 @@ def do_sync(conn_config, catalog, default_replication_method, state):
         state = sync_traditional_stream(conn_config, stream, state, sync_method_lookup[stream['tap_stream_id']], end_lsn)
 
     logical_streams.sort(key=lambda s: metadata.to_map(s['metadata']).get(()).get('database-name'))
-    for dbname, streams in itertools.groupby(logical_streams, lambda s: metadata.to_map(s['metadata']).get(()).get('database-name')):
-        conn_config['dbname'] = dbname
-        state = sync_logical_streams(conn_config, list(streams), state, end_lsn)
-    return state
+    if conn_config.get('logical_streaming') and logical_streams:
+        #only streaming is stopped by SIGTERM, the traditional streams above end as they always have
+        logical_replication.stop_on_signals()
+    return sync_logical_databases(conn_config, logical_streams, state, end_lsn)
 
 def main_impl():
     args = utils.parse_args(REQUIRED_CONFIG_KEYS)
@@ -684,12 +733,32 @@ def main_impl():
                    'filter_dbs' : args.config.get('filter_dbs'),
                    'debug_lsn' : args.config.get('debug_lsn') == 'true',
                    'logical_poll_total_seconds': float(args.config.get('logical_poll_total_seconds', 0)),
-                   'wal2json_message_format': args.config.get('wal2json_message_format')}
+                   'logical_feedback_seconds': float(args.config.get('logical_feedback_seconds', 0)),
+                   'logical_feedback_messages': int(args.config.get('logical_feedback_messages', 0)),
+                   'logical_streaming': args.config.get('logical_streaming') == 'true',
+                   'logical_checkpoint_seconds': float(args.config.get('logical_checkpoint_seconds', 0)),
+                   'logical_checkpoint_rows': int(args.config.get('logical_checkpoint_rows', 0)),
+                   'logical_max_slot_lag_bytes': int(args.config.get('logical_max_slot_lag_bytes', 0)),
+                   'logical_max_table_changes': int(args.config.get('logical_max_table_changes', 0)),
+                   'logical_metrics_seconds': float(args.config.get('logical_metrics_seconds', 0)),
+                   'wal2json_message_format': args.config.get('wal2json_message_format'),
+                   'logical_decoder': args.config.get('logical_decoder'),
+                   'publication_name': args.config.get('publication_name'),
+                   'full_table_workers': int(args.config.get('full_table_workers', 1)),
+                   'logical_workers': int(args.config.get('logical_workers', 1)),
+                   'use_exported_snapshot': args.config.get('use_exported_snapshot') == 'true'}
 
     if args.config.get('ssl') == 'true':
         conn_config['sslmode'] = 'require'
 
+    wal2json_options = args.config.get('wal2json_options')
+    if isinstance(wal2json_options, str):
+        wal2json_options = json.loads(wal2json_options)
+    conn_config['wal2json_options'] = wal2json_options
+
     post_db.cursor_iter_size = int(args.config.get('itersize', '20000'))
+    if args.config.get('fetch_target_bytes'):
+        post_db.fetch_target_bytes = int(args.config['fetch_target_bytes'])
 
     post_db.include_schemas_in_destination_stream_name = (args.config.get('include_schemas_in_destination_stream_name') == 'true')
 
@@ -1,14 +1,25 @@
 import datetime
 import decimal
 import math
+import re
 import psycopg2
 import psycopg2.extras
 import singer
 LOGGER = singer.get_logger()
 
 cursor_iter_size = 20000
+#bytes a single fetch of a named cursor should hold, None to always fetch cursor_iter_size rows
+fetch_target_bytes = None
+MIN_ITERSIZE = 1
+MAX_ITERSIZE = 200000
+#per row and per column overhead of the wire protocol on top of the column widths
+ROW_OVERHEAD_BYTES = 24
+COLUMN_OVERHEAD_BYTES = 4
 include_schemas_in_destination_stream_name = False
 
+#dbname -> {'conn', 'snapshot_id', 'lsn'} for the coordinator transactions holding exported snapshots
+exported_snapshots = {}
+
 def get_ssl_status(conn_config):
     try:
         matching_rows = []
@@ -64,6 +75,52 @@ def open_connection(conn_config, logical_replication=False):
 
     return conn
 
+def get_pg_version(cur):
+    cur.execute("SELECT version()")
+    res = cur.fetchone()[0]
+    version_match = re.match(r'PostgreSQL (\d+)', res)
+    if not version_match:
+        raise Exception('unable to determine PostgreSQL version from {}'.format(res))
+
+    version = int(version_match.group(1))
+    LOGGER.info("Detected PostgresSQL version: %s", version)
+    return version
+
+def export_snapshot(conn_config, lsn):
+    """Opens a coordinator transaction whose snapshot every full table connection to
+    conn_config['dbname'] imports until release_snapshot. lsn must have been fetched
+    before the snapshot is taken so that replication from it replays, rather than
+    misses, anything committed in between. It is None when the snapshot was exported
+    for parallel reads only."""
+    conn = open_connection(conn_config)
+    conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_export_snapshot()")
+        snapshot_id = cur.fetchone()[0]
+
+    LOGGER.info("exported snapshot %s for %s at lsn %s", snapshot_id, conn_config['dbname'], lsn)
+    exported_snapshots[conn_config['dbname']] = {'conn': conn, 'snapshot_id': snapshot_id, 'lsn': lsn}
+    return exported_snapshots[conn_config['dbname']]
+
+def import_snapshot(conn, conn_config):
+    """Must run before any other statement of a transaction."""
+    snapshot_id = conn_config.get('snapshot_id')
+    if snapshot_id is None:
+        return
+
+    if conn.isolation_level != psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ:
+        conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+
+def release_snapshot(dbname):
+    #the coordinator transaction holds back vacuum of the whole database while it is open
+    snapshot = exported_snapshots.pop(dbname, None)
+    if snapshot is not None:
+        LOGGER.info("releasing exported snapshot %s for %s", snapshot['snapshot_id'], dbname)
+        snapshot['conn'].close()
+
 def prepare_columns_sql(c):
     column_name = """ "{}" """.format(canonicalize_identifier(c))
     return column_name
@@ -133,19 +190,101 @@ def selected_value_to_singer_value(elem, sql_datatype):
 
     return selected_value_to_singer_value_impl(elem, sql_datatype)
 
-#pylint: disable=too-many-arguments
-def selected_row_to_singer_message(stream, row, version, columns, time_extracted, md_map):
-    row_to_persist = ()
-    for idx, elem in enumerate(row):
-        sql_datatype = md_map.get(('properties', columns[idx]))['sql-datatype']
-        cleaned_elem = selected_value_to_singer_value(elem, sql_datatype)
-        row_to_persist += (cleaned_elem,)
+def _timestamptz_to_singer(elem):
+    return elem.isoformat()
+
+def _timestamp_to_singer(elem):
+    return elem.isoformat() + '+00:00'
+
+def _date_to_singer(elem):
+    return elem.isoformat() + 'T00:00:00+00:00'
+
+def _bit_to_singer(elem):
+    return elem == '1'
+
+def _numeric_to_singer(elem):
+    #NB> We cast NaN's to NULL as wal2json does not support them and now we are at least consistent(ly wrong)
+    return None if elem.is_nan() else elem
+
+def _float_to_singer(elem):
+    #NB> We cast NaN's, +Inf, -Inf to NULL as wal2json does not support them and now we are at least consistent(ly wrong)
+    return None if math.isnan(elem) or math.isinf(elem) else elem
+
+#the values psycopg2 returns for these types are sent as they are
+IDENTITY_DATATYPES = {'money', 'boolean', 'integer', 'smallint', 'bigint', 'text', 'character varying', 'character',
+                      'citext', 'uuid', 'inet', 'cidr', 'macaddr', 'json', 'jsonb', 'hstore'}
+
+SCALAR_CONVERTERS = {'timestamp with time zone': _timestamptz_to_singer,
+                     'timestamp without time zone': _timestamp_to_singer,
+                     'date': _date_to_singer,
+                     'bit': _bit_to_singer,
+                     'time without time zone': str,
+                     'time with time zone': str,
+                     'numeric': _numeric_to_singer,
+                     'real': _float_to_singer,
+                     'double precision': _float_to_singer}
+
+def _skip_nulls(convert):
+    def convert_value(elem):
+        return None if elem is None else convert(elem)
+    return convert_value
+
+def _array_converter(convert):
+    def convert_array(elem):
+        result = []
+        pending = [(elem or [], result)]
+        #nested lists are walked with an explicit stack rather than by recursion
+        while pending:
+            source, target = pending.pop()
+            for item in source:
+                if isinstance(item, list):
+                    nested = []
+                    target.append(nested)
+                    pending.append((item, nested))
+                elif item is None or convert is None:
+                    target.append(item)
+                else:
+                    target.append(convert(item))
+        return result
+    return convert_array
+
+def value_converter(sql_datatype):
+    """A function turning a value of sql_datatype into its singer value, or None when
+    the value is sent as it is. Behaves as selected_value_to_singer_value."""
+    element_datatype = sql_datatype.replace('[]', '')
+    def convert_any(elem):
+        return selected_value_to_singer_value_impl(elem, element_datatype)
+
+    if element_datatype in IDENTITY_DATATYPES:
+        convert = None
+    else:
+        convert = SCALAR_CONVERTERS.get(element_datatype, convert_any)
+
+    if sql_datatype.find('[]') > 0:
+        return _array_converter(convert)
+    if convert is None:
+        return None
+    return _skip_nulls(convert)
 
-    rec = dict(zip(columns, row_to_persist))
+def row_converter(columns, md_map):
+    """Builds the conversion of a selected row of columns into a record once, so that
+    converting a row only applies one function per column that needs converting."""
+    converters = [value_converter(md_map.get(('properties', c))['sql-datatype']) for c in columns]
+    plan = list(zip(columns, converters))
+
+    def convert_row(row):
+        return {c: (value if convert is None else convert(value)) for (c, convert), value in zip(plan, row)}
+
+    return convert_row
+
+#pylint: disable=too-many-arguments
+def selected_row_to_singer_message(stream, row, version, columns, time_extracted, md_map, convert_row=None):
+    if convert_row is None:
+        convert_row = row_converter(columns, md_map)
 
     return singer.RecordMessage(
         stream=calculate_destination_stream_name(stream, md_map),
-        record=rec,
+        record=convert_row(row),
         version=version,
         time_extracted=time_extracted)
 
@@ -159,6 +298,55 @@ def hstore_available(conn_info):
             return False
 
 
+def estimate_row_width(conn_info, schema_name, table_name, columns):
+    """Average width in bytes of the selected columns of a row, from pg_stats or
+    failing that from the size of the table itself. None when the table has never
+    been analyzed."""
+    with open_connection(conn_info) as conn:
+        with conn.cursor() as cur:
+            #inheritance parents carry a second set of statistics covering their children
+            cur.execute("""SELECT sum(avg_width), count(*)
+                             FROM (SELECT max(avg_width) AS avg_width
+                                     FROM pg_stats
+                                    WHERE schemaname = %s
+                                      AND tablename = %s
+                                      AND attname = ANY(%s)
+                                    GROUP BY attname) AS column_widths""",
+                        (schema_name, table_name, list(columns)))
+            width, analyzed_columns = cur.fetchone()
+            if analyzed_columns == len(columns) and width:
+                return int(width)
+
+            cur.execute("""SELECT relpages::float8 * current_setting('block_size')::int / reltuples
+                             FROM pg_class
+                            WHERE oid = %s::regclass
+                              AND reltuples > 0""",
+                        (fully_qualified_table_name(schema_name, table_name),))
+            row = cur.fetchone()
+            return int(row[0]) if row else None
+
+def stream_itersize(conn_info, stream, md_map, columns):
+    """The number of rows to fetch per round trip for stream. The itersize metadata
+    of the stream wins, then enough rows to fill fetch_target_bytes when one is
+    configured, otherwise cursor_iter_size."""
+    override = md_map.get((), {}).get('itersize')
+    if override:
+        LOGGER.info("using itersize %s from the metadata of %s", override, stream['tap_stream_id'])
+        return int(override)
+
+    if not fetch_target_bytes:
+        return cursor_iter_size
+
+    width = estimate_row_width(conn_info, md_map.get((), {}).get('schema-name'), stream['table_name'], columns)
+    if not width:
+        LOGGER.info("no statistics for %s, using itersize %s", stream['tap_stream_id'], cursor_iter_size)
+        return cursor_iter_size
+
+    width = width + ROW_OVERHEAD_BYTES + COLUMN_OVERHEAD_BYTES * len(columns)
+    itersize = max(MIN_ITERSIZE, min(MAX_ITERSIZE, fetch_target_bytes // width))
+    LOGGER.info("using itersize %s for %s, estimated %s bytes per row", itersize, stream['tap_stream_id'], width)
+    return itersize
+
 def compute_tap_stream_id(database_name, schema_name, table_name):
     return database_name + '-' + schema_name + '-' + table_name
 
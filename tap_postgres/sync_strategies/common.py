@@ -10,6 +10,30 @@ def should_sync_column(md_map, field_name):
                                     field_metadata.get('selected'),
                                     True)
 
+def leaf_partitions(conn_info, schema_name, table_name):
+    """[schema, table] of every leaf partition under a partitioned table, or an
+    empty list when the table is not partitioned."""
+    with post_db.open_connection(conn_info) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""WITH RECURSIVE tree AS (
+                               SELECT inhrelid AS relid
+                                 FROM pg_inherits
+                                 JOIN pg_class p ON p.oid = inhparent
+                                WHERE inhparent = %s::regclass
+                                  AND p.relkind = 'p'
+                               UNION ALL
+                               SELECT i.inhrelid
+                                 FROM pg_inherits i
+                                 JOIN tree t ON i.inhparent = t.relid)
+                           SELECT n.nspname, c.relname
+                             FROM tree
+                             JOIN pg_class c ON c.oid = tree.relid
+                             JOIN pg_namespace n ON n.oid = c.relnamespace
+                            WHERE c.relkind <> 'p'
+                            ORDER BY n.nspname, c.relname""",
+                        (post_db.fully_qualified_table_name(schema_name, table_name),))
+            return [list(row) for row in cur.fetchall()]
+
 def write_schema_message(schema_message):
     sys.stdout.write(json.dumps(schema_message, use_decimal=True) + '\n')
     sys.stdout.flush()
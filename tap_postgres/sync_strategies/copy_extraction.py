@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# pylint: disable=missing-docstring,too-many-arguments,invalid-name,too-many-return-statements,broad-except
+
+import datetime
+import decimal
+import functools
+import queue
+import re
+import struct
+import threading
+import uuid
+import psycopg2.extensions
+import singer
+
+LOGGER = singer.get_logger()
+
+#rows are parsed and handed over to the reading thread in blocks of roughly this many bytes
+BLOCK_SIZE = 1024 * 1024
+QUEUE_BLOCKS = 8
+
+BINARY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+TEXT_OIDS = {25, 1042, 1043, 19}
+INTEGER_OIDS = {20, 21, 23}
+BOOLEAN_OID = 16
+TIMESTAMPTZ_OID = 1184
+
+POSTGRES_EPOCH_DATE = datetime.date(2000, 1, 1)
+POSTGRES_EPOCH_DATETIME = datetime.datetime(2000, 1, 1)
+INT32_MAX = 2 ** 31 - 1
+INT32_MIN = -2 ** 31
+INT64_MAX = 2 ** 63 - 1
+INT64_MIN = -2 ** 63
+UTC_TIME_ZONES = {'UTC', 'Etc/UTC', 'GMT', 'Etc/GMT', 'UCT', 'Etc/UCT', 'Zulu', 'Etc/Zulu'}
+
+TEXT_ESCAPE = re.compile(r'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))')
+TEXT_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+
+def _unescape_match(match):
+    octal, hexadecimal, char = match.groups()
+    if octal is not None:
+        return chr(int(octal, 8))
+    if hexadecimal is not None:
+        return chr(int(hexadecimal, 16))
+    return TEXT_ESCAPES.get(char, char)
+
+def unescape_text_field(field):
+    if '\\' not in field:
+        return field
+    return TEXT_ESCAPE.sub(_unescape_match, field)
+
+def _parse_bool(value):
+    return value == 't'
+
+def text_casters(cur, oids):
+    """One callable per column turning a COPY text field into the value a
+    cursor fetch of the same column would have produced."""
+    casters = []
+    for oid in oids:
+        if oid in TEXT_OIDS:
+            casters.append(None)
+        elif oid in INTEGER_OIDS:
+            casters.append(int)
+        elif oid == BOOLEAN_OID:
+            casters.append(_parse_bool)
+        else:
+            casters.append(functools.partial(cur.cast, oid))
+    return casters
+
+def parse_text_rows(text, casters):
+    rows = []
+    for line in text.split('\n'):
+        if not line:
+            continue
+        row = []
+        for field, caster in zip(line.split('\t'), casters):
+            if field == '\\N':
+                row.append(None)
+                continue
+            field = unescape_text_field(field)
+            row.append(caster(field) if caster else field)
+        rows.append(tuple(row))
+    return rows
+
+def _binary_numeric(buf):
+    ndigits, weight, sign, dscale = struct.unpack_from('>hhHh', buf)
+    if sign == 0xC000:
+        return decimal.Decimal('NaN')
+    if sign == 0xD000:
+        return decimal.Decimal('Infinity')
+    if sign == 0xF000:
+        return decimal.Decimal('-Infinity')
+
+    digits = ''.join('{:04d}'.format(d) for d in struct.unpack_from('>{}H'.format(ndigits), buf, 8))
+    if weight < 0:
+        int_part = '0'
+        frac_part = '0000' * (-weight - 1) + digits
+    else:
+        int_width = (weight + 1) * 4
+        digits = digits.ljust(int_width, '0')
+        int_part = digits[:int_width].lstrip('0') or '0'
+        frac_part = digits[int_width:]
+
+    text = ('-' if sign == 0x4000 else '') + int_part
+    if dscale > 0:
+        text += '.' + frac_part.ljust(dscale, '0')[:dscale]
+    return decimal.Decimal(text)
+
+def binary_decoders(cur, oids, encoding):
+    """Decoders for the binary COPY format, or None when a column type has no
+    binary decoder here and the text format has to be used instead."""
+    cur.execute("SHOW TimeZone")
+    utc_session = cur.fetchone()[0] in UTC_TIME_ZONES
+
+    def text(buf):
+        return bytes(buf).decode(encoding)
+
+    def jsonb(buf):
+        return bytes(buf[1:]).decode(encoding)
+
+    def date(buf):
+        days = struct.unpack('>i', buf)[0]
+        if days == INT32_MAX:
+            return cur.cast(1082, 'infinity')
+        if days == INT32_MIN:
+            return cur.cast(1082, '-infinity')
+        return POSTGRES_EPOCH_DATE + datetime.timedelta(days=days)
+
+    def timestamp(buf):
+        micros = struct.unpack('>q', buf)[0]
+        if micros == INT64_MAX:
+            return cur.cast(1114, 'infinity')
+        if micros == INT64_MIN:
+            return cur.cast(1114, '-infinity')
+        return POSTGRES_EPOCH_DATETIME + datetime.timedelta(microseconds=micros)
+
+    def timestamptz(buf):
+        micros = struct.unpack('>q', buf)[0]
+        if micros == INT64_MAX:
+            return cur.cast(TIMESTAMPTZ_OID, 'infinity')
+        if micros == INT64_MIN:
+            return cur.cast(TIMESTAMPTZ_OID, '-infinity')
+        value = POSTGRES_EPOCH_DATETIME + datetime.timedelta(microseconds=micros)
+        return value.replace(tzinfo=datetime.timezone.utc)
+
+    decoders_by_oid = {16: lambda buf: buf[0] == 1,
+                       20: lambda buf: struct.unpack('>q', buf)[0],
+                       21: lambda buf: struct.unpack('>h', buf)[0],
+                       23: lambda buf: struct.unpack('>i', buf)[0],
+                       701: lambda buf: struct.unpack('>d', buf)[0],
+                       1700: _binary_numeric,
+                       2950: lambda buf: str(uuid.UUID(bytes=bytes(buf))),
+                       25: text, 1042: text, 1043: text, 19: text, 114: text,
+                       3802: jsonb,
+                       1082: date,
+                       1114: timestamp}
+
+    #binary timestamptz values are always UTC, the text path renders them in the session time zone
+    if utc_session:
+        decoders_by_oid[TIMESTAMPTZ_OID] = timestamptz
+
+    if not all(oid in decoders_by_oid for oid in oids):
+        return None
+    return [decoders_by_oid[oid] for oid in oids]
+
+def parse_binary_rows(buf, offset, decoders):
+    """Parses every complete tuple in buf from offset. Returns the rows, the
+    offset of the first incomplete tuple and whether the trailer was seen."""
+    rows = []
+    size = len(buf)
+    while offset + 2 <= size:
+        field_count = struct.unpack_from('>h', buf, offset)[0]
+        if field_count == -1:
+            return rows, offset + 2, True
+
+        position = offset + 2
+        row = []
+        for decoder in decoders[:field_count]:
+            if position + 4 > size:
+                return rows, offset, False
+            length = struct.unpack_from('>i', buf, position)[0]
+            position += 4
+            if length == -1:
+                row.append(None)
+                continue
+            if position + length > size:
+                return rows, offset, False
+            row.append(decoder(buf[position:position + length]))
+            position += length
+
+        rows.append(tuple(row))
+        offset = position
+
+    return rows, offset, False
+
+class TextSink():
+    def __init__(self, encoding, casters, emit):
+        self.encoding = encoding
+        self.casters = casters
+        self.emit = emit
+        self.chunks = []
+        self.buffered = 0
+
+    def write(self, data):
+        #psycopg2 hands COPY TO output over one whole row at a time
+        self.chunks.append(data)
+        self.buffered += len(data)
+        if self.buffered >= BLOCK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            block = b''.join(self.chunks).decode(self.encoding)
+            self.chunks = []
+            self.buffered = 0
+            self.emit(parse_text_rows(block, self.casters))
+
+class BinarySink():
+    def __init__(self, decoders, emit):
+        self.decoders = decoders
+        self.emit = emit
+        self.buf = bytearray()
+        self.offset = None
+        self.finished = False
+
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) >= BLOCK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.offset is None:
+            if len(self.buf) < len(BINARY_SIGNATURE) + 8:
+                return
+            if bytes(self.buf[:len(BINARY_SIGNATURE)]) != BINARY_SIGNATURE:
+                raise Exception("unexpected binary COPY signature")
+            extension_length = struct.unpack_from('>i', self.buf, len(BINARY_SIGNATURE) + 4)[0]
+            self.offset = len(BINARY_SIGNATURE) + 8 + extension_length
+
+        rows, self.offset, self.finished = parse_binary_rows(self.buf, self.offset, self.decoders)
+        del self.buf[:self.offset]
+        self.offset = 0
+        if rows:
+            self.emit(rows)
+
+class CopyAborted(Exception):
+    pass
+
+def _put(blocks, item, stop):
+    while not stop.is_set():
+        try:
+            blocks.put(item, timeout=1.0)
+            return
+        except queue.Full:
+            continue
+    raise CopyAborted()
+
+def _copy_worker(conn, copy_sql, sink, blocks, stop):
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(copy_sql, sink)
+        sink.flush()
+        _put(blocks, None, stop)
+    except CopyAborted:
+        pass
+    except Exception as ex:
+        try:
+            _put(blocks, ex, stop)
+        except CopyAborted:
+            pass
+
+def copy_rows(conn, select_sql, copy_format='text'):
+    """Runs select_sql through COPY ... TO STDOUT and yields one tuple per row,
+    holding the same values a DictCursor over select_sql would return."""
+    encoding = psycopg2.extensions.encodings[conn.encoding]
+    cast_cur = conn.cursor()
+    cast_cur.execute("SELECT * FROM ({}) AS stitch_copy LIMIT 0".format(select_sql))
+    oids = [column.type_code for column in cast_cur.description]
+
+    blocks = queue.Queue(maxsize=QUEUE_BLOCKS)
+    stop = threading.Event()
+
+    def emit(rows):
+        _put(blocks, rows, stop)
+
+    decoders = binary_decoders(cast_cur, oids, encoding) if copy_format == 'binary' else None
+    if copy_format == 'binary' and decoders is None:
+        LOGGER.info("not every column type can be decoded from binary COPY, using the text format")
+
+    if decoders is not None:
+        copy_sql = "COPY ({}) TO STDOUT WITH (FORMAT binary)".format(select_sql)
+        sink = BinarySink(decoders, emit)
+    else:
+        copy_sql = "COPY ({}) TO STDOUT".format(select_sql)
+        sink = TextSink(encoding, text_casters(cast_cur, oids), emit)
+
+    LOGGER.info("copy %s", copy_sql)
+    thread = threading.Thread(target=_copy_worker, args=(conn, copy_sql, sink, blocks, stop),
+                              name='tap-postgres-copy', daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            if isinstance(block, Exception):
+                raise block
+            for row in block:
+                yield row
+    finally:
+        stop.set()
+        thread.join()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
-# pylint: disable=missing-docstring,not-an-iterable,too-many-locals,too-many-arguments,invalid-name,too-many-return-statements,too-many-branches,len-as-condition,too-many-nested-blocks,wrong-import-order,duplicate-code
+# pylint: disable=missing-docstring,not-an-iterable,too-many-locals,too-many-arguments,invalid-name,too-many-return-statements,too-many-branches,len-as-condition,too-many-nested-blocks,wrong-import-order,duplicate-code,too-many-statements
 
 import copy
+import math
 import time
 import psycopg2
 import psycopg2.extras
@@ -9,12 +10,62 @@ import singer
 from singer import utils
 import singer.metrics as metrics
 import tap_postgres.db as post_db
+import tap_postgres.sync_strategies.parallel as parallel
+import tap_postgres.sync_strategies.copy_extraction as copy_extraction
+import tap_postgres.sync_strategies.common as sync_common
+import tap_postgres.sync_strategies.server_json as server_json
 
 LOGGER = singer.get_logger()
 
 UPDATE_BOOKMARK_PERIOD = 1000
 
+#ctid range scans (TID Range Scan) are only planned as such from PostgreSQL 14
+MIN_CTID_RANGE_SCAN_VERSION = 14
+#split a table into this many page ranges per worker so fast workers pick up the slack
+CTID_RANGES_PER_WORKER = 8
+KEY_RANGES_PER_WORKER = 8
+
+#bookmarks that are only present while a full table sync is in flight
+RESUME_BOOKMARK_KEYS = ['xmin', 'ctid', 'ctid_ranges', 'last_pk_fetched', 'key_ranges', 'pending_partitions']
+
+def is_interrupted(state, tap_stream_id):
+    return any(singer.get_bookmark(state, tap_stream_id, k) is not None for k in RESUME_BOOKMARK_KEYS)
+
+def clear_resume_bookmarks(state, tap_stream_id):
+    for k in RESUME_BOOKMARK_KEYS:
+        state = singer.write_bookmark(state, tap_stream_id, k, None)
+    return state
+
+def full_table_strategy(md_map):
+    return md_map.get((), {}).get('full-table-strategy', 'xmin')
+
+def extraction_engine(md_map):
+    return md_map.get((), {}).get('extraction-engine', 'cursor')
+
+def select_rows(conn, cur, select_sql, md_map, params=None):
+    """Runs select_sql with params either on the named cursor or through COPY ... TO
+    STDOUT, depending on the stream's extraction-engine metadata."""
+    engine = extraction_engine(md_map)
+    if engine == 'copy':
+        if params:
+            #COPY takes no parameters, so they are bound into the query here
+            select_sql = cur.mogrify(select_sql, params).decode(psycopg2.extensions.encodings[conn.encoding])
+        return copy_extraction.copy_rows(conn, select_sql, md_map.get((), {}).get('copy-format', 'text'))
+    if engine != 'cursor':
+        raise Exception("Unrecognized extraction-engine {}".format(engine))
+
+    LOGGER.info("select %s with %s and itersize %s", select_sql, params, cur.itersize)
+    cur.execute(select_sql, params)
+    return cur
+
+def full_table_workers(conn_info, md_map):
+    return int(md_map.get((), {}).get('full-table-workers') or conn_info.get('full_table_workers') or 1)
+
 def sync_view(conn_info, stream, state, desired_columns, md_map):
+    view_key_properties = md_map.get((), {}).get('view-key-properties')
+    if view_key_properties:
+        return sync_keyset(conn_info, stream, state, desired_columns, md_map, view_key_properties)
+
     time_extracted = utils.now()
 
     #before writing the table version to state, check if we had one to begin with
@@ -29,7 +80,8 @@ def sync_view(conn_info, stream, state, desired_columns, md_map):
 
     schema_name = md_map.get(()).get('schema-name')
 
-    escaped_columns = map(post_db.prepare_columns_sql, desired_columns)
+    columns_sql, _ = server_json.select_list(desired_columns, md_map)
+    escaped_columns = [columns_sql]
 
     activate_version_message = singer.ActivateVersionMessage(
         stream=post_db.calculate_destination_stream_name(stream, md_map),
@@ -38,20 +90,19 @@ def sync_view(conn_info, stream, state, desired_columns, md_map):
     if first_run:
         singer.write_message(activate_version_message)
 
+    itersize = post_db.stream_itersize(conn_info, stream, md_map, desired_columns)
+    write_record = server_json.record_writer(stream, nascent_stream_version, time_extracted, desired_columns, md_map)
     with metrics.record_counter(None) as counter:
         with post_db.open_connection(conn_info) as conn:
+            post_db.import_snapshot(conn, conn_info)
             with conn.cursor(cursor_factory=psycopg2.extras.DictCursor, name='stitch_cursor') as cur:
-                cur.itersize = post_db.cursor_iter_size
+                cur.itersize = itersize
                 select_sql = 'SELECT {} FROM {}'.format(','.join(escaped_columns),
                                                         post_db.fully_qualified_table_name(schema_name, stream['table_name']))
 
-                LOGGER.info("select %s with itersize %s", select_sql, cur.itersize)
-                cur.execute(select_sql)
-
                 rows_saved = 0
-                for rec in cur:
-                    record_message = post_db.selected_row_to_singer_message(stream, rec, nascent_stream_version, desired_columns, time_extracted, md_map)
-                    singer.write_message(record_message)
+                for rec in select_rows(conn, cur, select_sql, md_map):
+                    write_record(rec)
                     rows_saved = rows_saved + 1
                     if rows_saved % UPDATE_BOOKMARK_PERIOD == 0:
                         singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
@@ -65,6 +116,40 @@ def sync_view(conn_info, stream, state, desired_columns, md_map):
 
 
 def sync_table(conn_info, stream, state, desired_columns, md_map):
+    strategy = full_table_strategy(md_map)
+    if strategy == 'ctid':
+        return sync_table_ctid(conn_info, stream, state, desired_columns, md_map)
+    if strategy == 'keyset':
+        return sync_table_keyset(conn_info, stream, state, desired_columns, md_map)
+    if strategy == 'partition':
+        return sync_table_partitions(conn_info, stream, state, desired_columns, md_map)
+    if strategy != 'xmin':
+        raise Exception("Unrecognized full-table-strategy {} for stream {}".format(strategy, stream['tap_stream_id']))
+
+    return sync_table_xmin(conn_info, stream, state, desired_columns, md_map)
+
+def xmin_ctid_resume_sql(escaped_columns, schema_name, table_name, xmin, ctid):
+    #rows sharing the bookmarked xmin (e.g. a whole bulk load) are picked up after the
+    #bookmarked ctid, which a TID Range Scan can serve without sorting the whole table.
+    #only rows with younger xmins go through the xmin sort
+    columns_sql = ','.join(escaped_columns)
+    table_sql = post_db.fully_qualified_table_name(schema_name, table_name)
+    return """(SELECT {0}, ctid::text, xmin::text::bigint
+                 FROM {1}
+                WHERE ctid > '{3}'::tid AND xmin = '{2}'::xid
+                ORDER BY ctid ASC)
+              UNION ALL
+              (SELECT {0}, ctid::text, xmin::text::bigint
+                 FROM {1}
+                WHERE age(xmin::xid) < age('{2}'::xid)
+                ORDER BY xmin::text::bigint ASC, ctid ASC)""".format(columns_sql, table_sql, int(xmin), ctid_literal(ctid))
+
+def ctid_literal(ctid):
+    #ctids come back out of state, make sure they are nothing but a (page,tuple) pair
+    page, tuple_index = ctid.strip('()').split(',')
+    return '({},{})'.format(int(page), int(tuple_index))
+
+def sync_table_xmin(conn_info, stream, state, desired_columns, md_map):
     time_extracted = utils.now()
 
     #before writing the table version to state, check if we had one to begin with
@@ -85,7 +170,8 @@ def sync_table(conn_info, stream, state, desired_columns, md_map):
 
     schema_name = md_map.get(()).get('schema-name')
 
-    escaped_columns = map(post_db.prepare_columns_sql, desired_columns)
+    columns_sql, _ = server_json.select_list(desired_columns, md_map)
+    escaped_columns = [columns_sql]
 
     activate_version_message = singer.ActivateVersionMessage(
         stream=post_db.calculate_destination_stream_name(stream, md_map),
@@ -94,9 +180,12 @@ def sync_table(conn_info, stream, state, desired_columns, md_map):
     if first_run:
         singer.write_message(activate_version_message)
 
+    itersize = post_db.stream_itersize(conn_info, stream, md_map, desired_columns)
     hstore_available = post_db.hstore_available(conn_info)
+    write_record = server_json.record_writer(stream, nascent_stream_version, time_extracted, desired_columns, md_map)
     with metrics.record_counter(None) as counter:
         with post_db.open_connection(conn_info) as conn:
+            post_db.import_snapshot(conn, conn_info)
 
             # Client side character encoding defaults to the value in postgresql.conf under client_encoding.
             # The server / db can also have its own configred encoding.
@@ -113,43 +202,488 @@ def sync_table(conn_info, stream, state, desired_columns, md_map):
                 LOGGER.info("hstore is UNavailable")
 
             with conn.cursor(cursor_factory=psycopg2.extras.DictCursor, name='stitch_cursor') as cur:
-                cur.itersize = post_db.cursor_iter_size
+                cur.itersize = itersize
 
                 xmin = singer.get_bookmark(state, stream['tap_stream_id'], 'xmin')
-                if xmin:
+                ctid = singer.get_bookmark(state, stream['tap_stream_id'], 'ctid')
+                if xmin and ctid:
+                    LOGGER.info("Resuming Full Table replication %s from xmin %s, ctid %s", nascent_stream_version, xmin, ctid)
+                    select_sql = xmin_ctid_resume_sql(escaped_columns, schema_name, stream['table_name'], xmin, ctid)
+                elif xmin:
                     LOGGER.info("Resuming Full Table replication %s from xmin %s", nascent_stream_version, xmin)
-                    select_sql = """SELECT {}, xmin::text::bigint
+                    select_sql = """SELECT {}, ctid::text, xmin::text::bigint
                                       FROM {} where age(xmin::xid) <= age('{}'::xid)
-                                     ORDER BY xmin::text::bigint ASC""".format(','.join(escaped_columns),
-                                                                               post_db.fully_qualified_table_name(schema_name, stream['table_name']),
-                                                                               xmin)
+                                     ORDER BY xmin::text::bigint ASC, ctid ASC""".format(','.join(escaped_columns),
+                                                                                         post_db.fully_qualified_table_name(schema_name, stream['table_name']),
+                                                                                         xmin)
                 else:
                     LOGGER.info("Beginning new Full Table replication %s", nascent_stream_version)
-                    select_sql = """SELECT {}, xmin::text::bigint
+                    select_sql = """SELECT {}, ctid::text, xmin::text::bigint
                                       FROM {}
-                                     ORDER BY xmin::text::bigint ASC""".format(','.join(escaped_columns),
-                                                                               post_db.fully_qualified_table_name(schema_name, stream['table_name']))
-
-
-                LOGGER.info("select %s with itersize %s", select_sql, cur.itersize)
-                cur.execute(select_sql)
+                                     ORDER BY xmin::text::bigint ASC, ctid ASC""".format(','.join(escaped_columns),
+                                                                                         post_db.fully_qualified_table_name(schema_name, stream['table_name']))
 
                 rows_saved = 0
-                for rec in cur:
-                    xmin = rec['xmin']
-                    rec = rec[:-1]
-                    record_message = post_db.selected_row_to_singer_message(stream, rec, nascent_stream_version, desired_columns, time_extracted, md_map)
-                    singer.write_message(record_message)
+                for rec in select_rows(conn, cur, select_sql, md_map):
+                    ctid, xmin = rec[-2:]
+                    rec = rec[:-2]
+                    write_record(rec)
                     state = singer.write_bookmark(state, stream['tap_stream_id'], 'xmin', xmin)
+                    state = singer.write_bookmark(state, stream['tap_stream_id'], 'ctid', ctid)
                     rows_saved = rows_saved + 1
                     if rows_saved % UPDATE_BOOKMARK_PERIOD == 0:
                         singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
 
                     counter.increment()
 
-    #once we have completed the full table replication, discard the xmin bookmark.
-    #the xmin bookmark only comes into play when a full table replication is interrupted
+    #once we have completed the full table replication, discard the xmin and ctid bookmarks.
+    #they only come into play when a full table replication is interrupted
     state = singer.write_bookmark(state, stream['tap_stream_id'], 'xmin', None)
+    state = singer.write_bookmark(state, stream['tap_stream_id'], 'ctid', None)
+
+    #always send the activate version whether first run or subsequent
+    singer.write_message(activate_version_message)
+
+    return state
+
+
+def ctid_ranges(conn_info, schema_name, table_name, workers):
+    with post_db.open_connection(conn_info) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""SELECT relpages, pg_relation_size(oid) / current_setting('block_size')::bigint
+                             FROM pg_class
+                            WHERE oid = %s::regclass""", (post_db.fully_qualified_table_name(schema_name, table_name),))
+            relpages, current_pages = cur.fetchone()
+
+    #relpages is only as fresh as the last VACUUM/ANALYZE. the final range is left open
+    #so pages appended since then are still read
+    pages = relpages if relpages > 0 else current_pages
+    range_pages = max(1, int(math.ceil(pages / float(workers * CTID_RANGES_PER_WORKER))))
+    ranges = [[start, start + range_pages] for start in range(0, pages, range_pages)] or [[0, None]]
+    ranges[-1][1] = None
+
+    LOGGER.info("split %s pages (relpages %s) of %s into %s ctid ranges of %s pages",
+                pages, relpages, table_name, len(ranges), range_pages)
+    return ranges
+
+def ctid_range_sql(escaped_columns, schema_name, table_name, ctid_range):
+    #a range is [start_page, end_page] plus, once rows of it have been written, the last ctid written
+    start_page, end_page = ctid_range[:2]
+    last_ctid = ctid_range[2] if len(ctid_range) > 2 else None
+    if last_ctid:
+        lower_sql = "ctid > '{}'::tid".format(ctid_literal(last_ctid))
+    else:
+        lower_sql = "ctid >= '({},0)'::tid".format(int(start_page))
+
+    select_sql = """SELECT {}, ctid::text
+                      FROM {}
+                     WHERE {}""".format(','.join(escaped_columns),
+                                        post_db.fully_qualified_table_name(schema_name, table_name),
+                                        lower_sql)
+    if end_page is not None:
+        select_sql += " AND ctid < '({},0)'::tid".format(int(end_page))
+
+    #the sort only ever covers the pages of one range
+    return select_sql + " ORDER BY ctid ASC"
+
+def sync_table_ctid(conn_info, stream, state, desired_columns, md_map):
+    workers = full_table_workers(conn_info, md_map)
+    with post_db.open_connection(conn_info) as conn:
+        with conn.cursor() as cur:
+            version = post_db.get_pg_version(cur)
+
+    if version < MIN_CTID_RANGE_SCAN_VERSION:
+        LOGGER.warning("ctid range scans require PostgreSQL %s+, falling back to xmin full table replication for %s",
+                       MIN_CTID_RANGE_SCAN_VERSION, stream['tap_stream_id'])
+        return sync_table_xmin(conn_info, stream, state, desired_columns, md_map)
+
+    time_extracted = utils.now()
+
+    #before writing the table version to state, check if we had one to begin with
+    first_run = singer.get_bookmark(state, stream['tap_stream_id'], 'version') is None
+
+    schema_name = md_map.get(()).get('schema-name')
+
+    #pick a new table version IFF we have no pending ctid ranges in our state
+    #pending ranges indicate that we were interrupted last time through
+    pending_ranges = singer.get_bookmark(state, stream['tap_stream_id'], 'ctid_ranges')
+    if pending_ranges is None:
+        nascent_stream_version = int(time.time() * 1000)
+        pending_ranges = ctid_ranges(conn_info, schema_name, stream['table_name'], workers)
+        LOGGER.info("Beginning new parallel Full Table replication %s", nascent_stream_version)
+    else:
+        nascent_stream_version = singer.get_bookmark(state, stream['tap_stream_id'], 'version')
+        LOGGER.info("Resuming parallel Full Table replication %s with %s unfinished ctid ranges", nascent_stream_version, len(pending_ranges))
+
+    state = singer.write_bookmark(state, stream['tap_stream_id'], 'version', nascent_stream_version)
+    state = singer.write_bookmark(state, stream['tap_stream_id'], 'ctid_ranges', pending_ranges)
+    singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+
+    columns_sql, _ = server_json.select_list(desired_columns, md_map)
+    escaped_columns = [columns_sql]
+
+    activate_version_message = singer.ActivateVersionMessage(
+        stream=post_db.calculate_destination_stream_name(stream, md_map),
+        version=nascent_stream_version)
+
+    if first_run:
+        singer.write_message(activate_version_message)
+
+    itersize = post_db.stream_itersize(conn_info, stream, md_map, desired_columns)
+    hstore_available = post_db.hstore_available(conn_info)
+
+    def prepare_connection(conn):
+        if hstore_available:
+            psycopg2.extras.register_hstore(conn)
+
+    def fetch_range(conn, ctid_range):
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor, name='stitch_cursor') as cur:
+            cur.itersize = itersize
+            select_sql = ctid_range_sql(escaped_columns, schema_name, stream['table_name'], ctid_range)
+            for rec in select_rows(conn, cur, select_sql, md_map):
+                yield rec
+
+    write_record = server_json.record_writer(stream, nascent_stream_version, time_extracted, desired_columns, md_map)
+    with metrics.record_counter(None) as counter:
+        rows_saved = 0
+        chunks = [tuple(r) for r in pending_ranges]
+        ranges_by_start = {r[0]: r for r in pending_ranges}
+        for ctid_range, rec in parallel.iterate_chunks(conn_info, chunks, fetch_range, workers, prepare_connection):
+            if rec is parallel.CHUNK_DONE:
+                #a range is only dropped from state once every one of its rows has been written
+                pending_ranges = [r for r in pending_ranges if r[0] != ctid_range[0]]
+                state = singer.write_bookmark(state, stream['tap_stream_id'], 'ctid_ranges', pending_ranges)
+                singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+                continue
+
+            write_record(rec[:-1])
+            #the range lists are shared with the ctid_ranges bookmark
+            ranges_by_start[ctid_range[0]][2:] = [rec[-1]]
+            rows_saved = rows_saved + 1
+            if rows_saved % UPDATE_BOOKMARK_PERIOD == 0:
+                singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+
+            counter.increment()
+
+    #once every range has been read, discard the ctid_ranges bookmark.
+    state = clear_resume_bookmarks(state, stream['tap_stream_id'])
+
+    #always send the activate version whether first run or subsequent
+    singer.write_message(activate_version_message)
+
+    return state
+
+
+def primary_key_columns(conn_info, schema_name, table_name, md_map):
+    #order the keys as the primary key index does so the keyset predicate can walk that index
+    with post_db.open_connection(conn_info) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""SELECT a.attname
+                             FROM pg_index i
+                             JOIN pg_attribute a
+                               ON a.attrelid = i.indrelid
+                              AND a.attnum = ANY(i.indkey)
+                            WHERE i.indrelid = %s::regclass
+                              AND i.indisprimary
+                            ORDER BY array_position(i.indkey::int2[], a.attnum)""",
+                        (post_db.fully_qualified_table_name(schema_name, table_name),))
+            key_columns = [row[0] for row in cur.fetchall()]
+
+    return key_columns or md_map.get((), {}).get('table-key-properties', [])
+
+def keyset_sql(escaped_columns, schema_name, table_name, key_columns, resuming, chunk_size, bounded=False):
+    escaped_keys = [post_db.prepare_columns_sql(k) for k in key_columns]
+    select_sql = """SELECT {}, {}
+                      FROM {}""".format(','.join(escaped_columns),
+                                        ','.join('{}::text'.format(k) for k in escaped_keys),
+                                        post_db.fully_qualified_table_name(schema_name, table_name))
+    predicates = []
+    if resuming:
+        predicates.append('({}) > ({})'.format(','.join(escaped_keys), ','.join(['%s'] * len(escaped_keys))))
+    if bounded:
+        predicates.append('({}) <= ({})'.format(','.join(escaped_keys), ','.join(['%s'] * len(escaped_keys))))
+    if predicates:
+        select_sql += """
+                     WHERE {}""".format(' AND '.join(predicates))
+
+    select_sql += """
+                     ORDER BY {}""".format(','.join('{} ASC'.format(k) for k in escaped_keys))
+    if chunk_size:
+        select_sql += """
+                     LIMIT {}""".format(int(chunk_size))
+    return select_sql
+
+def key_ranges(conn_info, schema_name, table_name, key_columns, workers):
+    """Splits the key space into [lower, upper] ranges of about the same number of
+    rows. The first range has no lower and the last range no upper bound."""
+    escaped_keys = [post_db.prepare_columns_sql(k) for k in key_columns]
+    with post_db.open_connection(conn_info) as conn:
+        post_db.import_snapshot(conn, conn_info)
+        with conn.cursor() as cur:
+            #only the key columns are asked for, so a view can skip computing everything else
+            cur.execute("""SELECT DISTINCT ON (bucket) {}
+                             FROM (SELECT {}, ntile(%s) OVER (ORDER BY {}) AS bucket
+                                     FROM {}) AS buckets
+                            ORDER BY bucket, {}""".format(','.join('{}::text'.format(k) for k in escaped_keys),
+                                                          ','.join(escaped_keys),
+                                                          ','.join(escaped_keys),
+                                                          post_db.fully_qualified_table_name(schema_name, table_name),
+                                                          ','.join('{} DESC'.format(k) for k in escaped_keys)),
+                        (workers * KEY_RANGES_PER_WORKER,))
+            upper_bounds = [dict(zip(key_columns, row)) for row in cur.fetchall()]
+
+    lower_bounds = [None] + upper_bounds[:-1]
+    return [[lower, upper] for lower, upper in zip(lower_bounds, upper_bounds[:-1] + [None])]
+
+def sync_table_keyset(conn_info, stream, state, desired_columns, md_map):
+    schema_name = md_map.get(()).get('schema-name')
+    key_columns = primary_key_columns(conn_info, schema_name, stream['table_name'], md_map)
+    if not key_columns:
+        LOGGER.info("%s has no primary key, falling back to xmin full table replication", stream['tap_stream_id'])
+        return sync_table_xmin(conn_info, stream, state, desired_columns, md_map)
+
+    return sync_keyset(conn_info, stream, state, desired_columns, md_map, key_columns)
+
+def sync_keyset(conn_info, stream, state, desired_columns, md_map, key_columns):
+    """Pages through a table or view in the order of key_columns. With a single worker
+    the last key written is kept in last_pk_fetched, with several the key space is
+    split into key_ranges that are read on their own connections. A table is read a
+    chunk per transaction, a view by a single query, as every query computes it again."""
+    schema_name = md_map.get(()).get('schema-name')
+    time_extracted = utils.now()
+    workers = full_table_workers(conn_info, md_map)
+
+    #before writing the table version to state, check if we had one to begin with
+    first_run = singer.get_bookmark(state, stream['tap_stream_id'], 'version') is None
+
+    #pick a new table version IFF we have neither a last_pk_fetched nor key_ranges in our state
+    #the presence of either indicates that we were interrupted last time through
+    last_pk_fetched = singer.get_bookmark(state, stream['tap_stream_id'], 'last_pk_fetched')
+    pending_ranges = singer.get_bookmark(state, stream['tap_stream_id'], 'key_ranges')
+    if last_pk_fetched is None and pending_ranges is None:
+        nascent_stream_version = int(time.time() * 1000)
+        LOGGER.info("Beginning new keyset Full Table replication %s", nascent_stream_version)
+        if workers > 1:
+            pending_ranges = key_ranges(conn_info, schema_name, stream['table_name'], key_columns, workers)
+    else:
+        nascent_stream_version = singer.get_bookmark(state, stream['tap_stream_id'], 'version')
+        LOGGER.info("Resuming keyset Full Table replication %s from %s", nascent_stream_version, last_pk_fetched or pending_ranges)
+
+    state = singer.write_bookmark(state, stream['tap_stream_id'], 'version', nascent_stream_version)
+    if pending_ranges is not None:
+        state = singer.write_bookmark(state, stream['tap_stream_id'], 'key_ranges', pending_ranges)
+    singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+
+    activate_version_message = singer.ActivateVersionMessage(
+        stream=post_db.calculate_destination_stream_name(stream, md_map),
+        version=nascent_stream_version)
+
+    if first_run:
+        singer.write_message(activate_version_message)
+
+    chunk_size = post_db.stream_itersize(conn_info, stream, md_map, desired_columns)
+    hstore_available = post_db.hstore_available(conn_info)
+    with metrics.record_counter(None) as counter:
+        if pending_ranges is not None:
+            state = sync_key_ranges(conn_info, stream, state, desired_columns, md_map, key_columns,
+                                    pending_ranges, nascent_stream_version, time_extracted, counter,
+                                    workers, chunk_size, hstore_available)
+        else:
+            state = sync_key_pages(conn_info, stream, state, desired_columns, md_map, key_columns,
+                                   last_pk_fetched, nascent_stream_version, time_extracted, counter,
+                                   chunk_size, hstore_available)
+
+    #once we have completed the full table replication, discard the last_pk_fetched and key_ranges bookmarks.
+    state = clear_resume_bookmarks(state, stream['tap_stream_id'])
+
+    #always send the activate version whether first run or subsequent
+    singer.write_message(activate_version_message)
+
+    return state
+
+def sync_key_pages(conn_info, stream, state, desired_columns, md_map, key_columns, last_pk_fetched,
+                   nascent_stream_version, time_extracted, counter, chunk_size, hstore_available):
+    schema_name = md_map.get(()).get('schema-name')
+    columns_sql, column_count = server_json.select_list(desired_columns, md_map)
+    escaped_columns = [columns_sql]
+    write_record = server_json.record_writer(stream, nascent_stream_version, time_extracted, desired_columns, md_map)
+    with post_db.open_connection(conn_info) as conn:
+        if hstore_available:
+            psycopg2.extras.register_hstore(conn)
+
+        if md_map.get((), {}).get('is-view'):
+            #a view is computed again by every query, so it is read by a single ordered query
+            return sync_view_pages(conn, conn_info, stream, state, md_map, key_columns, last_pk_fetched,
+                                   escaped_columns, column_count, write_record, counter, chunk_size)
+
+        rows_saved = 0
+        while True:
+            select_sql = keyset_sql(escaped_columns, schema_name, stream['table_name'], key_columns,
+                                    last_pk_fetched is not None, chunk_size)
+            key_values = [last_pk_fetched[k] for k in key_columns] if last_pk_fetched is not None else None
+
+            #every chunk is read in its own short transaction so vacuum is never held back for long
+            post_db.import_snapshot(conn, conn_info)
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                rows = list(select_rows(conn, cur, select_sql, md_map, key_values))
+            conn.commit()
+
+            for rec in rows:
+                last_pk_fetched = dict(zip(key_columns, rec[column_count:]))
+                write_record(rec[:column_count])
+                state = singer.write_bookmark(state, stream['tap_stream_id'], 'last_pk_fetched', last_pk_fetched)
+                rows_saved = rows_saved + 1
+                if rows_saved % UPDATE_BOOKMARK_PERIOD == 0:
+                    singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+
+                counter.increment()
+
+            if len(rows) < chunk_size:
+                break
+
+    return state
+
+def sync_view_pages(conn, conn_info, stream, state, md_map, key_columns, last_pk_fetched,
+                    escaped_columns, column_count, write_record, counter, itersize):
+    schema_name = md_map.get(()).get('schema-name')
+    select_sql = keyset_sql(escaped_columns, schema_name, stream['table_name'], key_columns,
+                            last_pk_fetched is not None, None)
+    key_values = [last_pk_fetched[k] for k in key_columns] if last_pk_fetched is not None else None
+
+    post_db.import_snapshot(conn, conn_info)
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor, name='stitch_cursor') as cur:
+        cur.itersize = itersize
+        rows_saved = 0
+        for rec in select_rows(conn, cur, select_sql, md_map, key_values):
+            last_pk_fetched = dict(zip(key_columns, rec[column_count:]))
+            write_record(rec[:column_count])
+            state = singer.write_bookmark(state, stream['tap_stream_id'], 'last_pk_fetched', last_pk_fetched)
+            rows_saved = rows_saved + 1
+            if rows_saved % UPDATE_BOOKMARK_PERIOD == 0:
+                singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+
+            counter.increment()
+
+    return state
+
+def sync_key_ranges(conn_info, stream, state, desired_columns, md_map, key_columns, pending_ranges,
+                    nascent_stream_version, time_extracted, counter, workers, itersize, hstore_available):
+    schema_name = md_map.get(()).get('schema-name')
+    columns_sql, column_count = server_json.select_list(desired_columns, md_map)
+    escaped_columns = [columns_sql]
+    write_record = server_json.record_writer(stream, nascent_stream_version, time_extracted, desired_columns, md_map)
+
+    def prepare_connection(conn):
+        if hstore_available:
+            psycopg2.extras.register_hstore(conn)
+
+    def fetch_range(conn, range_idx):
+        lower, upper = pending_ranges[range_idx]
+        select_sql = keyset_sql(escaped_columns, schema_name, stream['table_name'], key_columns,
+                                lower is not None, None, upper is not None)
+        key_values = [lower[k] for k in key_columns] if lower is not None else []
+        key_values += [upper[k] for k in key_columns] if upper is not None else []
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor, name='stitch_cursor') as cur:
+            cur.itersize = itersize
+            for rec in select_rows(conn, cur, select_sql, md_map, key_values):
+                yield rec
+
+    rows_saved = 0
+    finished = set()
+    for range_idx, rec in parallel.iterate_chunks(conn_info, list(range(len(pending_ranges))), fetch_range, workers, prepare_connection):
+        if rec is parallel.CHUNK_DONE:
+            #a range is only dropped from state once every one of its rows has been written
+            finished.add(range_idx)
+            state = singer.write_bookmark(state, stream['tap_stream_id'], 'key_ranges',
+                                          [r for idx, r in enumerate(pending_ranges) if idx not in finished])
+            singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+            continue
+
+        write_record(rec[:column_count])
+        #the range lists are shared with the key_ranges bookmark, so the lower bound tracks the last key written
+        pending_ranges[range_idx][0] = dict(zip(key_columns, rec[column_count:]))
+        rows_saved = rows_saved + 1
+        if rows_saved % UPDATE_BOOKMARK_PERIOD == 0:
+            singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+
+        counter.increment()
+
+    return state
+
+def sync_table_partitions(conn_info, stream, state, desired_columns, md_map):
+    schema_name = md_map.get(()).get('schema-name')
+    time_extracted = utils.now()
+
+    #before writing the table version to state, check if we had one to begin with
+    first_run = singer.get_bookmark(state, stream['tap_stream_id'], 'version') is None
+
+    #pick a new table version IFF we have no pending partitions in our state
+    #pending partitions indicate that we were interrupted last time through
+    pending_partitions = singer.get_bookmark(state, stream['tap_stream_id'], 'pending_partitions')
+    if pending_partitions is None:
+        pending_partitions = sync_common.leaf_partitions(conn_info, schema_name, stream['table_name'])
+        if not pending_partitions:
+            LOGGER.info("%s is not partitioned, falling back to xmin full table replication", stream['tap_stream_id'])
+            return sync_table_xmin(conn_info, stream, state, desired_columns, md_map)
+
+        nascent_stream_version = int(time.time() * 1000)
+        LOGGER.info("Beginning new Full Table replication %s of %s partitions", nascent_stream_version, len(pending_partitions))
+    else:
+        nascent_stream_version = singer.get_bookmark(state, stream['tap_stream_id'], 'version')
+        LOGGER.info("Resuming Full Table replication %s with %s unfinished partitions", nascent_stream_version, len(pending_partitions))
+
+    state = singer.write_bookmark(state, stream['tap_stream_id'], 'version', nascent_stream_version)
+    state = singer.write_bookmark(state, stream['tap_stream_id'], 'pending_partitions', pending_partitions)
+    singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+
+    columns_sql, _ = server_json.select_list(desired_columns, md_map)
+    escaped_columns = [columns_sql]
+
+    activate_version_message = singer.ActivateVersionMessage(
+        stream=post_db.calculate_destination_stream_name(stream, md_map),
+        version=nascent_stream_version)
+
+    if first_run:
+        singer.write_message(activate_version_message)
+
+    workers = full_table_workers(conn_info, md_map)
+    itersize = post_db.stream_itersize(conn_info, stream, md_map, desired_columns)
+    hstore_available = post_db.hstore_available(conn_info)
+
+    def prepare_connection(conn):
+        if hstore_available:
+            psycopg2.extras.register_hstore(conn)
+
+    def fetch_partition(conn, partition):
+        #every partition is read on its own, so no sort spans the whole partitioned table
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor, name='stitch_cursor') as cur:
+            cur.itersize = itersize
+            select_sql = 'SELECT {} FROM ONLY {}'.format(','.join(escaped_columns),
+                                                         post_db.fully_qualified_table_name(*partition))
+            for rec in select_rows(conn, cur, select_sql, md_map):
+                yield rec
+
+    write_record = server_json.record_writer(stream, nascent_stream_version, time_extracted, desired_columns, md_map)
+    with metrics.record_counter(None) as counter:
+        rows_saved = 0
+        chunks = [tuple(p) for p in pending_partitions]
+        for partition, rec in parallel.iterate_chunks(conn_info, chunks, fetch_partition, workers, prepare_connection):
+            if rec is parallel.CHUNK_DONE:
+                #an unfinished partition is read again from its start when the sync is resumed
+                pending_partitions = [p for p in pending_partitions if tuple(p) != partition]
+                state = singer.write_bookmark(state, stream['tap_stream_id'], 'pending_partitions', pending_partitions)
+                singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+                continue
+
+            write_record(rec)
+            rows_saved = rows_saved + 1
+            if rows_saved % UPDATE_BOOKMARK_PERIOD == 0:
+                singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+
+            counter.increment()
+
+    #once every partition has been read, discard the pending_partitions bookmark.
+    state = clear_resume_bookmarks(state, stream['tap_stream_id'])
 
     #always send the activate version whether first run or subsequent
     singer.write_message(activate_version_message)
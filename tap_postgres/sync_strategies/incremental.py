@@ -1,11 +1,16 @@
+# pylint: disable=too-many-statements,too-many-arguments
+
 import copy
 import time
+import simplejson as json
 import psycopg2
 import psycopg2.extras
 import singer
 from singer import utils
 import singer.metrics as metrics
 import tap_postgres.db as post_db
+import tap_postgres.sync_strategies.common as sync_common
+import tap_postgres.sync_strategies.server_json as server_json
 
 
 LOGGER = singer.get_logger()
@@ -24,7 +29,37 @@ def fetch_max_replication_key(conn_config, replication_key, schema_name, table_n
             LOGGER.info("max replication key value: %s", max_key)
             return max_key
 
+def incremental_sql(escaped_columns, relation_sql, replication_key, replication_key_value, replication_key_sql_datatype):
+    if replication_key_value:
+        return """SELECT {}
+                    FROM {}
+                   WHERE {} >= '{}'::{}
+                   ORDER BY {} ASC""".format(','.join(escaped_columns),
+                                             relation_sql,
+                                             post_db.prepare_columns_sql(replication_key), replication_key_value, replication_key_sql_datatype,
+                                             post_db.prepare_columns_sql(replication_key))
+
+    #if not replication_key_value
+    return """SELECT {}
+                FROM {}
+               ORDER BY {} ASC""".format(','.join(escaped_columns),
+                                         relation_sql,
+                                         post_db.prepare_columns_sql(replication_key))
+
+def incremental_strategy(md_map):
+    return md_map.get((), {}).get('incremental-strategy', 'table')
+
 def sync_table(conn_info, stream, state, desired_columns, md_map):
+    strategy = incremental_strategy(md_map)
+    if strategy == 'partition':
+        schema_name = md_map.get(()).get('schema-name')
+        partitions = sync_common.leaf_partitions(conn_info, schema_name, stream['table_name'])
+        if partitions:
+            return sync_table_partitions(conn_info, stream, state, desired_columns, md_map, partitions)
+        LOGGER.info("%s is not partitioned, falling back to incremental replication of the whole table", stream['tap_stream_id'])
+    elif strategy != 'table':
+        raise Exception("Unrecognized incremental-strategy {} for stream {}".format(strategy, stream['tap_stream_id']))
+
     time_extracted = utils.now()
 
     stream_version = singer.get_bookmark(state, stream['tap_stream_id'], 'version')
@@ -39,7 +74,7 @@ def sync_table(conn_info, stream, state, desired_columns, md_map):
 
     schema_name = md_map.get(()).get('schema-name')
 
-    escaped_columns = map(post_db.prepare_columns_sql, desired_columns)
+    columns_sql, column_count = server_json.select_list(desired_columns, md_map)
 
     activate_version_message = singer.ActivateVersionMessage(
         stream=post_db.calculate_destination_stream_name(stream, md_map),
@@ -52,6 +87,11 @@ def sync_table(conn_info, stream, state, desired_columns, md_map):
     replication_key_value = singer.get_bookmark(state, stream['tap_stream_id'], 'replication_key_value')
     replication_key_sql_datatype = md_map.get(('properties', replication_key)).get('sql-datatype')
 
+    #the replication key is selected once more so the bookmark does not depend on how records are rendered
+    select_columns = [columns_sql, post_db.prepare_columns_sql(replication_key)]
+    write_record = server_json.record_writer(stream, stream_version, time_extracted, desired_columns, md_map)
+    convert_replication_key = post_db.value_converter(replication_key_sql_datatype) or (lambda elem: elem)
+    itersize = post_db.stream_itersize(conn_info, stream, md_map, desired_columns)
     hstore_available = post_db.hstore_available(conn_info)
     with metrics.record_counter(None) as counter:
         with post_db.open_connection(conn_info) as conn:
@@ -71,23 +111,10 @@ def sync_table(conn_info, stream, state, desired_columns, md_map):
                 LOGGER.info("hstore is UNavailable")
 
             with conn.cursor(cursor_factory=psycopg2.extras.DictCursor, name='stitch_cursor') as cur:
-                cur.itersize = post_db.cursor_iter_size
+                cur.itersize = itersize
                 LOGGER.info("Beginning new incremental replication sync %s", stream_version)
-                if replication_key_value:
-                    select_sql = """SELECT {}
-                                    FROM {}
-                                    WHERE {} >= '{}'::{}
-                                    ORDER BY {} ASC""".format(','.join(escaped_columns),
-                                                              post_db.fully_qualified_table_name(schema_name, stream['table_name']),
-                                                              post_db.prepare_columns_sql(replication_key), replication_key_value, replication_key_sql_datatype,
-                                                              post_db.prepare_columns_sql(replication_key))
-                else:
-                    #if not replication_key_value
-                    select_sql = """SELECT {}
-                                    FROM {}
-                                    ORDER BY {} ASC""".format(','.join(escaped_columns),
-                                                              post_db.fully_qualified_table_name(schema_name, stream['table_name']),
-                                                              post_db.prepare_columns_sql(replication_key))
+                select_sql = incremental_sql(select_columns, post_db.fully_qualified_table_name(schema_name, stream['table_name']),
+                                             replication_key, replication_key_value, replication_key_sql_datatype)
 
                 LOGGER.info("select statement: %s with itersize %s", select_sql, cur.itersize)
                 cur.execute(select_sql)
@@ -95,17 +122,17 @@ def sync_table(conn_info, stream, state, desired_columns, md_map):
                 rows_saved = 0
 
                 for rec in cur:
-                    record_message = post_db.selected_row_to_singer_message(stream, rec, stream_version, desired_columns, time_extracted, md_map)
-                    singer.write_message(record_message)
+                    write_record(rec[:column_count])
                     rows_saved = rows_saved + 1
 
                     #Picking a replication_key with NULL values will result in it ALWAYS been synced which is not great
                     #event worse would be allowing the NULL value to enter into the state
-                    if record_message.record[replication_key] is not None:
+                    row_replication_key_value = convert_replication_key(rec[column_count])
+                    if row_replication_key_value is not None:
                         state = singer.write_bookmark(state,
                                                       stream['tap_stream_id'],
                                                       'replication_key_value',
-                                                      record_message.record[replication_key])
+                                                      row_replication_key_value)
 
 
                     if rows_saved % UPDATE_BOOKMARK_PERIOD == 0:
@@ -114,3 +141,132 @@ def sync_table(conn_info, stream, state, desired_columns, md_map):
                     counter.increment()
 
     return state
+
+def _plan_relations(plan_node):
+    if 'Relation Name' in plan_node:
+        yield [plan_node['Schema'], plan_node['Relation Name']]
+    for child in plan_node.get('Plans', []):
+        yield from _plan_relations(child)
+
+def partitions_to_read(conn_info, schema_name, table_name, replication_key, replication_key_value, replication_key_sql_datatype, partitions):
+    """The partitions that can hold rows at or above replication_key_value, as far as
+    partition pruning in the planner can tell."""
+    if not replication_key_value:
+        return partitions
+
+    with post_db.open_connection(conn_info) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""EXPLAIN (FORMAT JSON, VERBOSE)
+                           SELECT 1 FROM {} WHERE {} >= '{}'::{}""".format(post_db.fully_qualified_table_name(schema_name, table_name),
+                                                                          post_db.prepare_columns_sql(replication_key),
+                                                                          replication_key_value, replication_key_sql_datatype))
+            plan = cur.fetchone()[0]
+
+    #json is registered to come back as text during sync
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scanned = list(_plan_relations(plan[0]['Plan']))
+    return [p for p in partitions if p in scanned]
+
+def max_replication_key_value(conn_info, values, replication_key_sql_datatype):
+    with post_db.open_connection(conn_info) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""SELECT idx
+                             FROM unnest(%s::text[]) WITH ORDINALITY AS v(value, idx)
+                            ORDER BY value::{} DESC
+                            LIMIT 1""".format(replication_key_sql_datatype),
+                        ([str(v) for v in values],))
+            return values[cur.fetchone()[0] - 1]
+
+def partition_name(partition):
+    return '{}.{}'.format(*partition)
+
+def sync_table_partitions(conn_info, stream, state, desired_columns, md_map, partitions):
+    time_extracted = utils.now()
+
+    stream_version = singer.get_bookmark(state, stream['tap_stream_id'], 'version')
+    if stream_version is None:
+        stream_version = int(time.time() * 1000)
+
+    state = singer.write_bookmark(state,
+                                  stream['tap_stream_id'],
+                                  'version',
+                                  stream_version)
+    singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+
+    schema_name = md_map.get(()).get('schema-name')
+
+    columns_sql, column_count = server_json.select_list(desired_columns, md_map)
+
+    activate_version_message = singer.ActivateVersionMessage(
+        stream=post_db.calculate_destination_stream_name(stream, md_map),
+        version=stream_version)
+
+    singer.write_message(activate_version_message)
+
+    replication_key = md_map.get((), {}).get('replication-key')
+    replication_key_sql_datatype = md_map.get(('properties', replication_key)).get('sql-datatype')
+
+    #replication_key_value only moves once every partition has been read, until then each
+    #partition resumes from its own bookmark and finished partitions are skipped
+    replication_key_value = singer.get_bookmark(state, stream['tap_stream_id'], 'replication_key_value')
+    partition_values = singer.get_bookmark(state, stream['tap_stream_id'], 'partition_replication_key_values') or {}
+    finished_partitions = singer.get_bookmark(state, stream['tap_stream_id'], 'finished_partitions') or []
+
+    partitions = partitions_to_read(conn_info, schema_name, stream['table_name'], replication_key,
+                                    replication_key_value, replication_key_sql_datatype, partitions)
+    LOGGER.info("reading %s partitions of %s, %s already finished", len(partitions), stream['tap_stream_id'], len(finished_partitions))
+
+    #the replication key is selected once more so the bookmark does not depend on how records are rendered
+    select_columns = [columns_sql, post_db.prepare_columns_sql(replication_key)]
+    write_record = server_json.record_writer(stream, stream_version, time_extracted, desired_columns, md_map)
+    convert_replication_key = post_db.value_converter(replication_key_sql_datatype) or (lambda elem: elem)
+    itersize = post_db.stream_itersize(conn_info, stream, md_map, desired_columns)
+    hstore_available = post_db.hstore_available(conn_info)
+    with metrics.record_counter(None) as counter:
+        with post_db.open_connection(conn_info) as conn:
+            if hstore_available:
+                psycopg2.extras.register_hstore(conn)
+
+            rows_saved = 0
+            for partition in partitions:
+                if partition in finished_partitions:
+                    continue
+
+                name = partition_name(partition)
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor, name='stitch_cursor') as cur:
+                    cur.itersize = itersize
+                    select_sql = incremental_sql(select_columns, 'ONLY {}'.format(post_db.fully_qualified_table_name(*partition)),
+                                                 replication_key, partition_values.get(name, replication_key_value),
+                                                 replication_key_sql_datatype)
+                    LOGGER.info("select statement: %s with itersize %s", select_sql, cur.itersize)
+                    cur.execute(select_sql)
+
+                    for rec in cur:
+                        write_record(rec[:column_count])
+                        rows_saved = rows_saved + 1
+
+                        row_replication_key_value = convert_replication_key(rec[column_count])
+                        if row_replication_key_value is not None:
+                            partition_values[name] = row_replication_key_value
+                            state = singer.write_bookmark(state, stream['tap_stream_id'], 'partition_replication_key_values', partition_values)
+
+                        if rows_saved % UPDATE_BOOKMARK_PERIOD == 0:
+                            singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+
+                        counter.increment()
+                conn.commit()
+
+                finished_partitions.append(partition)
+                state = singer.write_bookmark(state, stream['tap_stream_id'], 'finished_partitions', finished_partitions)
+                singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+
+    values = list(partition_values.values()) + ([replication_key_value] if replication_key_value is not None else [])
+    if values:
+        state = singer.write_bookmark(state, stream['tap_stream_id'], 'replication_key_value',
+                                      max_replication_key_value(conn_info, values, replication_key_sql_datatype))
+
+    state = singer.write_bookmark(state, stream['tap_stream_id'], 'partition_replication_key_values', None)
+    state = singer.write_bookmark(state, stream['tap_stream_id'], 'finished_partitions', None)
+    return state
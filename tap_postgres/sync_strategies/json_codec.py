@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# pylint: disable=missing-docstring
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def loads(payload):
+    """Parses a replication payload, bytes or str, with orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.loads(payload) #pylint: disable=no-member
+        except orjson.JSONDecodeError: #pylint: disable=no-member
+            #orjson does not parse integers wider than 64 bits, NaN or Infinity, which
+            #wal2json writes for numeric and floating point columns
+            pass
+    return json.loads(payload)
@@ -8,34 +8,61 @@ from singer import utils, get_bookmark
 import singer.metadata as metadata
 import tap_postgres.db as post_db
 import tap_postgres.sync_strategies.common as sync_common
+import tap_postgres.sync_strategies.parallel as parallel
+import tap_postgres.sync_strategies.pg_literals as pg_literals
+import tap_postgres.sync_strategies.pgoutput as pgoutput
+import tap_postgres.sync_strategies.wal2json as wal2json
+import tap_postgres.sync_strategies.replication_metrics as replication_metrics
 from dateutil.parser import parse
 import psycopg2
 from psycopg2 import sql
+import collections
 import copy
-from select import select
-from functools import reduce
-import json
 import re
+import signal
+import threading
+import time
+import functools
+import itertools
+from select import select
 
 LOGGER = singer.get_logger()
 
 UPDATE_BOOKMARK_PERIOD = 1000
 
-def get_pg_version(cur):
-    cur.execute("SELECT version()")
-    res = cur.fetchone()[0]
-    version_match = re.match('PostgreSQL (\d+)', res)
-    if not version_match:
-        raise Exception('unable to determine PostgreSQL version from {}'.format(res))
+OUTPUT = threading.local()
+
+#characters wal2json's add-tables option needs escaped in schema and table names
+WAL2JSON_SPECIAL_CHARACTERS = re.compile(r"([ ',.*\\])")
+
+#the flush position is reported to the server after this many messages or seconds, whichever comes first
+FEEDBACK_MESSAGES = 1000
+FEEDBACK_SECONDS = 10.0
+
+#STATE is written at the first transaction end after this many seconds, or UPDATE_BOOKMARK_PERIOD messages
+CHECKPOINT_SECONDS = 10.0
+
+#with logical_streaming, STATE is written at least this often while changes arrive, and the
+#stop flag is checked at least this often while none do
+STREAMING_CHECKPOINT_SECONDS = 1.0
+STOP_POLL_SECONDS = 1.0
 
-    version = int(version_match.group(1))
-    LOGGER.info("Detected PostgresSQL version: %s", version)
-    return version
+#up to end_lsn, a keepalive with the server's position is asked for this often while no data arrives
+REPLY_REQUEST_SECONDS = 1.0
+
+#set on SIGTERM while streaming: sync_tables then stops after a final flush and STATE
+STOP = threading.Event()
+
+#replication metrics are logged this often
+METRICS_SECONDS = 60.0
+
+#recently converted dates, timestamps and times, which repeat heavily within a change stream
+DATETIME_CACHE_SIZE = 4096
 
 def fetch_current_lsn(conn_config):
     with post_db.open_connection(conn_config, False) as conn:
         with conn.cursor() as cur:
-            version = get_pg_version(cur)
+            version = post_db.get_pg_version(cur)
             if version == 9:
                 cur.execute("SELECT pg_current_xlog_location()")
             elif version > 9:
@@ -43,9 +70,98 @@ def fetch_current_lsn(conn_config):
             else:
                 raise Exception('unable to fetch current lsn for PostgresQL version {}'.format(version))
 
-            current_lsn = cur.fetchone()[0]
-            file, index = current_lsn.split('/')
-            return (int(file, 16)  << 32) + int(index, 16)
+            return parse_lsn(cur.fetchone()[0])
+
+def parse_lsn(lsn):
+    file, index = lsn.split('/')
+    return (int(file, 16)  << 32) + int(index, 16)
+
+def format_lsn(lsn):
+    return '{:X}/{:X}'.format(lsn >> 32, lsn & 0xFFFFFFFF)
+
+def fetch_confirmed_flush_lsn(conn_info, slot):
+    with post_db.open_connection(conn_info, False) as conn:
+        with conn.cursor() as cur:
+            #confirmed_flush_lsn is missing from pg_replication_slots before PostgreSQL 9.6
+            cur.execute("SELECT row_to_json(s)->>'confirmed_flush_lsn' FROM pg_replication_slots s WHERE slot_name = %s", (slot,))
+            row = cur.fetchone()
+            if row is None or row[0] is None:
+                return None
+            return parse_lsn(row[0])
+
+def fetch_table_activity(conn_info, logical_streams):
+    #the size of each stream's table, and the rows inserted, updated and deleted in it since statistics were last reset
+    activity = {}
+    with post_db.open_connection(conn_info, False) as conn:
+        with conn.cursor() as cur:
+            for s in logical_streams:
+                schema_name = metadata.to_map(s['metadata']).get(()).get('schema-name')
+                cur.execute("""SELECT pg_total_relation_size(relid), n_tup_ins + n_tup_upd + n_tup_del
+                                 FROM pg_stat_user_tables
+                                WHERE schemaname = %s AND relname = %s""", (schema_name, s['table_name']))
+                activity[s['tap_stream_id']] = cur.fetchone() or (0, None)
+    return activity
+
+def lagging_streams(conn_info, logical_streams, state, slot_lag, activity):
+    """The streams to copy again rather than replay, with the reason for each.
+
+    Past logical_max_slot_lag_bytes of WAL behind, replaying is expected to take longer
+    than copying every table of the slot. Past logical_max_table_changes rows changed in
+    a table since the last run, copying that table is. The counts are bookmarked as
+    table_changes, for the next run to compare with."""
+    max_slot_lag = conn_info.get('logical_max_slot_lag_bytes')
+    max_table_changes = conn_info.get('logical_max_table_changes')
+    lagging = []
+    for s in logical_streams:
+        _size, table_changes = activity[s['tap_stream_id']]
+        last_table_changes = get_bookmark(state, s['tap_stream_id'], 'table_changes')
+        state = singer.write_bookmark(state, s['tap_stream_id'], 'table_changes', table_changes)
+
+        if max_slot_lag and slot_lag is not None and slot_lag > max_slot_lag:
+            lagging.append((s, "the slot is {} bytes behind".format(slot_lag)))
+        #counts going down were reset with the statistics, and only set a new baseline
+        elif max_table_changes and None not in (table_changes, last_table_changes) and \
+             table_changes - last_table_changes > max_table_changes:
+            lagging.append((s, "{} rows changed since the last run".format(table_changes - last_table_changes)))
+
+    return lagging
+
+def advance_replication_slot(conn_info, slot, lsn):
+    with post_db.open_connection(conn_info, False) as conn:
+        if conn.server_version < 110000:
+            LOGGER.warning("pg_replication_slot_advance needs PostgreSQL 11. slot %s stays where it is", slot)
+            return
+
+        with conn.cursor() as cur:
+            LOGGER.info("advancing slot %s to %s", slot, format_lsn(lsn))
+            cur.execute("SELECT pg_replication_slot_advance(%s, %s::pg_lsn)", (slot, format_lsn(lsn)))
+
+def reset_lagging_streams(conn_config, logical_streams, state, end_lsn):
+    """Sends the streams that are quicker to copy again than to replay back to their
+    initial full table sync, which bookmarks them at end_lsn under a new version. A
+    slot whose streams are all copied again is advanced to end_lsn, so the server
+    neither keeps nor decodes the WAL before it."""
+    logical_streams = sorted(logical_streams, key=lambda s: metadata.to_map(s['metadata']).get(()).get('database-name'))
+    for dbname, streams in itertools.groupby(logical_streams, lambda s: metadata.to_map(s['metadata']).get(()).get('database-name')):
+        streams = list(streams)
+        conn_info = dict(conn_config, dbname=dbname)
+        slot = locate_replication_slot(conn_info)
+        confirmed_flush_lsn = fetch_confirmed_flush_lsn(conn_info, slot)
+        slot_lag = None if confirmed_flush_lsn is None else max(0, end_lsn - confirmed_flush_lsn)
+        activity = fetch_table_activity(conn_info, streams)
+
+        lagging = lagging_streams(conn_info, streams, state, slot_lag, activity)
+        for s, reason in lagging:
+            LOGGER.info("copying %s again instead of replaying it: %s. copying reads %s bytes, replaying reads %s bytes of WAL",
+                        s['tap_stream_id'], reason, activity[s['tap_stream_id']][0], slot_lag)
+            state['bookmarks'][s['tap_stream_id']].pop('lsn', None)
+
+        if lagging and len(lagging) == len(streams):
+            #the reset is recorded before the WAL it would otherwise replay is released
+            singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+            advance_replication_slot(conn_info, slot, end_lsn)
+
+    return state
 
 def add_automatic_properties(stream, conn_config):
     stream['schema']['properties']['_sdc_deleted_at'] = {'type' : ['null', 'string'], 'format' :'date-time'}
@@ -65,81 +181,50 @@ def get_stream_version(tap_stream_id, state):
 
     return stream_version
 
-def tuples_to_map(accum, t):
-    accum[t[0]] = t[1]
-    return accum
-
 def create_hstore_elem_query(elem):
     return sql.SQL("SELECT hstore_to_array({})").format(sql.Literal(elem))
 
-def create_hstore_elem(conn_info, elem):
-    with post_db.open_connection(conn_info) as conn:
-        with conn.cursor() as cur:
-            query = create_hstore_elem_query(elem)
-            cur.execute(query)
-            res = cur.fetchone()[0]
-            hstore_elem = reduce(tuples_to_map, [res[i:i + 2] for i in range(0, len(res), 2)], {})
-            return hstore_elem
+def create_hstore_elem(conn_info, elem): #pylint: disable=unused-argument
+    #parsed in process instead of by hstore_to_array on a new connection for every value
+    return pg_literals.parse_hstore(elem)
 
-def create_array_elem(elem, sql_datatype, conn_info):
+def create_array_elem(elem, sql_datatype, conn_info): #pylint: disable=unused-argument
     if elem is None:
         return None
 
-    with post_db.open_connection(conn_info) as conn:
-        with conn.cursor() as cur:
-            if sql_datatype == 'bit[]':
-                cast_datatype = 'boolean[]'
-            elif sql_datatype == 'boolean[]':
-                cast_datatype = 'boolean[]'
-            elif sql_datatype == 'character varying[]':
-                cast_datatype = 'character varying[]'
-            elif sql_datatype == 'cidr[]':
-                cast_datatype = 'cidr[]'
-            elif sql_datatype == 'citext[]':
-                cast_datatype = 'text[]'
-            elif sql_datatype == 'date[]':
-                cast_datatype = 'text[]'
-            elif sql_datatype == 'double precision[]':
-                cast_datatype = 'double precision[]'
-            elif sql_datatype == 'hstore[]':
-                cast_datatype = 'text[]'
-            elif sql_datatype == 'integer[]':
-                cast_datatype = 'integer[]'
-            elif sql_datatype == 'bigint[]':
-                cast_datatype = 'bigint[]'
-            elif sql_datatype == 'inet[]':
-                cast_datatype = 'inet[]'
-            elif sql_datatype == 'json[]':
-                cast_datatype = 'text[]'
-            elif sql_datatype == 'jsonb[]':
-                cast_datatype = 'text[]'
-            elif sql_datatype == 'macaddr[]':
-                cast_datatype = 'macaddr[]'
-            elif sql_datatype == 'money[]':
-                cast_datatype = 'text[]'
-            elif sql_datatype == 'numeric[]':
-                cast_datatype = 'text[]'
-            elif sql_datatype == 'real[]':
-                cast_datatype = 'real[]'
-            elif sql_datatype == 'smallint[]':
-                cast_datatype = 'smallint[]'
-            elif sql_datatype == 'text[]':
-                cast_datatype = 'text[]'
-            elif sql_datatype in ('time without time zone[]', 'time with time zone[]'):
-                cast_datatype = 'text[]'
-            elif sql_datatype in ('timestamp with time zone[]', 'timestamp without time zone[]'):
-                cast_datatype = 'text[]'
-            elif sql_datatype == 'uuid[]':
-                cast_datatype = 'text[]'
-
-            else:
-                #custom datatypes like enums
-                cast_datatype = 'text[]'
-
-            sql_stmt = """SELECT $stitch_quote${}$stitch_quote$::{}""".format(elem, cast_datatype)
-            cur.execute(sql_stmt)
-            res = cur.fetchone()[0]
-            return res
+    #parsed in process rather than cast by postgres on a new connection for every value. the
+    #elements come out as psycopg2 returned them for the casts that used to be made:
+    #  bit[], boolean[] => boolean[]
+    #  double precision[], real[] => floats
+    #  integer[], bigint[], smallint[] => ints
+    #  everything else, including custom datatypes like enums => text[]
+    return pg_literals.parse_array(elem, pg_literals.array_element_cast(sql_datatype))
+
+def parse_datetime(elem):
+    value = pg_literals.parse_timestamp(elem)
+    if value is None:
+        #not in the format postgres writes dates and timestamps in
+        value = parse(elem)
+    return value
+
+@functools.lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def timestamp_to_singer(elem):
+    return parse_datetime(elem).isoformat() + '+00:00'
+
+@functools.lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def timestamptz_to_singer(elem):
+    return parse_datetime(elem).isoformat()
+
+@functools.lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def date_to_singer(elem):
+    return parse_datetime(elem).date().isoformat() + 'T00:00:00+00:00'
+
+@functools.lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def timetz_to_singer(elem):
+    value = pg_literals.parse_time(elem)
+    if value is None:
+        return parse(elem).isoformat().split('T')[1]
+    return value.isoformat()
 
 #pylint: disable=too-many-branches,too-many-nested-blocks
 def selected_value_to_singer_value_impl(elem, og_sql_datatype, conn_info):
@@ -148,19 +233,19 @@ def selected_value_to_singer_value_impl(elem, og_sql_datatype, conn_info):
     if elem is None:
         return elem
     if sql_datatype == 'timestamp without time zone':
-        return parse(elem).isoformat() + '+00:00'
+        return timestamp_to_singer(elem)
     if sql_datatype == 'timestamp with time zone':
         if isinstance(elem, datetime.datetime):
             return elem.isoformat()
 
-        return parse(elem).isoformat()
+        return timestamptz_to_singer(elem)
     if sql_datatype == 'date':
         if  isinstance(elem, datetime.date):
             #logical replication gives us dates as strings UNLESS they from an array
             return elem.isoformat() + 'T00:00:00+00:00'
-        return parse(elem).isoformat() + "+00:00"
+        return date_to_singer(elem)
     if sql_datatype == 'time with time zone':
-        return parse(elem).isoformat().split('T')[1]
+        return timetz_to_singer(elem)
     if sql_datatype == 'bit':
         #for arrays, elem will == True
         #for ordinary bits, elem will == '1'
@@ -194,30 +279,106 @@ def selected_value_to_singer_value(elem, sql_datatype, conn_info):
 
     return selected_value_to_singer_value_impl(elem, sql_datatype, conn_info)
 
-def row_to_singer_message(stream, row, version, columns, time_extracted, md_map, conn_info):
-    row_to_persist = ()
-    md_map[('properties', '_sdc_deleted_at')] = {'sql-datatype' : 'timestamp with time zone'}
-    md_map[('properties', '_sdc_lsn')] = {'sql-datatype' : "character varying"}
+def _timestamptz_change_to_singer(elem):
+    if isinstance(elem, datetime.datetime):
+        return elem.isoformat()
+    return timestamptz_to_singer(elem)
 
-    for idx, elem in enumerate(row):
-        sql_datatype = md_map.get(('properties', columns[idx])).get('sql-datatype')
+def _date_change_to_singer(elem):
+    if isinstance(elem, datetime.date):
+        return elem.isoformat() + 'T00:00:00+00:00'
+    return date_to_singer(elem)
+
+def _bit_change_to_singer(elem):
+    return elem == '1' or elem == True
+
+def _numeric_change_to_singer(elem):
+    return decimal.Decimal(str(elem))
+
+def _identity(elem):
+    return elem
+
+#the json values of these types are sent as they are
+CHANGE_IDENTITY_DATATYPES = {'boolean', 'integer', 'smallint', 'bigint', 'real', 'double precision', 'money', 'text',
+                             'character varying', 'character', 'citext', 'uuid', 'inet', 'cidr', 'macaddr', 'json', 'jsonb',
+                             'time without time zone'}
+
+CHANGE_CONVERTERS = {'timestamp without time zone': timestamp_to_singer,
+                     'timestamp with time zone': _timestamptz_change_to_singer,
+                     'date': _date_change_to_singer,
+                     'time with time zone': timetz_to_singer,
+                     'bit': _bit_change_to_singer,
+                     'numeric': _numeric_change_to_singer}
+
+def change_value_converter(sql_datatype, conn_info):
+    """A function turning a value of sql_datatype in a change into its singer value.
+    Behaves as selected_value_to_singer_value, which arrays, hstore and the types
+    not listed above still go through."""
+    if sql_datatype in CHANGE_IDENTITY_DATATYPES:
+        return _identity
+
+    convert = CHANGE_CONVERTERS.get(sql_datatype)
+    if convert is None:
+        return functools.partial(selected_value_to_singer_value, sql_datatype=sql_datatype, conn_info=conn_info)
+
+    def convert_value(elem):
+        return None if elem is None else convert(elem)
+    return convert_value
+
+#everything the decoding of a change needs about its stream, built once when sync_tables starts
+StreamDecoder = collections.namedtuple('StreamDecoder', ['tap_stream_id', 'stream_name', 'version', 'selected_columns', 'converters',
+                                                         'start_lsn', 'skipped'])
 
-        if not sql_datatype:
-            LOGGER.info("No sql-datatype found for stream %s: %s", stream, columns[idx])
-            raise Exception("Unable to find sql-datatype for stream {}".format(stream))
+def stream_decoder(stream, state, conn_info):
+    md_map = metadata.to_map(stream['metadata'])
+    desired_columns = [c for c in stream['schema']['properties'].keys() if sync_common.should_sync_column(md_map, c)]
 
-        cleaned_elem = selected_value_to_singer_value(elem, sql_datatype, conn_info)
-        row_to_persist += (cleaned_elem,)
+    md_map[('properties', '_sdc_deleted_at')] = {'sql-datatype' : 'timestamp with time zone'}
+    md_map[('properties', '_sdc_lsn')] = {'sql-datatype' : "character varying"}
+    converters = {}
+    for c in stream['schema']['properties'].keys():
+        sql_datatype = md_map.get(('properties', c), {}).get('sql-datatype')
+        if sql_datatype:
+            converters[c] = change_value_converter(sql_datatype, conn_info)
+
+    return StreamDecoder(tap_stream_id=stream['tap_stream_id'],
+                         stream_name=post_db.calculate_destination_stream_name(stream, md_map),
+                         version=get_stream_version(stream['tap_stream_id'], state),
+                         selected_columns=frozenset(desired_columns),
+                         converters=converters,
+                         start_lsn=get_bookmark(state, stream['tap_stream_id'], 'lsn'),
+                         skipped=collections.Counter())
+
+def already_replicated(decoder, kind, commit_lsn):
+    """Whether a change was replicated by an earlier run, and is counted as skipped.
+
+    The slot starts at the lowest bookmark of its streams, so streams bookmarked further
+    receive the changes of the transactions in between again. commit_lsn is any position
+    within the commit record of the change's transaction. Bookmarks are transaction ends,
+    or the server's position when a stream's initial copy was taken, and never fall within
+    a commit record."""
+    if commit_lsn is None or decoder.start_lsn is None or commit_lsn >= decoder.start_lsn:
+        return False
+    decoder.skipped[kind] += 1
+    return True
+
+def row_to_singer_message(decoder, row, columns, time_extracted):
+    rec = {}
+    for idx, elem in enumerate(row):
+        convert = decoder.converters.get(columns[idx])
+        if convert is None:
+            LOGGER.info("No sql-datatype found for stream %s: %s", decoder.tap_stream_id, columns[idx])
+            raise Exception("Unable to find sql-datatype for stream {}".format(decoder.tap_stream_id))
 
-    rec = dict(zip(columns, row_to_persist))
+        rec[columns[idx]] = convert(elem)
 
     return singer.RecordMessage(
-        stream=post_db.calculate_destination_stream_name(stream, md_map),
+        stream=decoder.stream_name,
         record=rec,
-        version=version,
+        version=decoder.version,
         time_extracted=time_extracted)
 
-def consume_message_format_2(payload, conn_info, streams_lookup, state, time_extracted, lsn):
+def consume_message_format_2(payload, conn_info, decoders, time_extracted, lsn, commit_lsn=None):
     ## Action Types:
     # I = Insert
     # U = Update
@@ -232,20 +393,15 @@ def consume_message_format_2(payload, conn_info, streams_lookup, state, time_ext
         yield None
     else:
         tap_stream_id = post_db.compute_tap_stream_id(conn_info['dbname'], payload['schema'], payload['table'])
-        if streams_lookup.get(tap_stream_id) is None:
+        decoder = decoders.get(tap_stream_id)
+        if decoder is None or already_replicated(decoder, action, commit_lsn):
             yield None
         else:
-            target_stream = streams_lookup[tap_stream_id]
-            stream_version = get_stream_version(target_stream['tap_stream_id'], state)
-            stream_md_map = metadata.to_map(target_stream['metadata'])
-
-            desired_columns = [col for col in target_stream['schema']['properties'].keys() if sync_common.should_sync_column(stream_md_map, col)]
-
             col_names = []
             col_vals = []
             if payload['action'] in ['I', 'U']:
                 for column in payload['columns']:
-                    if column['name'] in set(desired_columns):
+                    if column['name'] in decoder.selected_columns:
                         col_names.append(column['name'])
                         col_vals.append(column['value'])
 
@@ -258,7 +414,7 @@ def consume_message_format_2(payload, conn_info, streams_lookup, state, time_ext
 
             elif payload['action'] == 'D':
                 for column in payload['identity']:
-                    if column['name'] in set(desired_columns):
+                    if column['name'] in decoder.selected_columns:
                         col_names.append(column['name'])
                         col_vals.append(column['value'])
 
@@ -270,32 +426,25 @@ def consume_message_format_2(payload, conn_info, streams_lookup, state, time_ext
                     col_names = col_names + ['_sdc_lsn']
 
             # Yield 1 record to match the API of V1
-            yield row_to_singer_message(target_stream, col_vals, stream_version, col_names, time_extracted, stream_md_map, conn_info)
+            yield row_to_singer_message(decoder, col_vals, col_names, time_extracted)
 
-            state = singer.write_bookmark(state,
-                                          target_stream['tap_stream_id'],
-                                          'lsn',
-                                          lsn)
 
 # message-format v1
-def consume_message_format_1(payload, conn_info, streams_lookup, state, time_extracted, lsn):
-    for c in payload['change']:
+def consume_message_format_1(payload, conn_info, decoders, time_extracted, lsn):
+    return consume_changes_format_1(payload['change'], conn_info, decoders, time_extracted, lsn)
+
+def consume_changes_format_1(changes, conn_info, decoders, time_extracted, lsn, commit_lsn=None):
+    for c in changes:
         tap_stream_id = post_db.compute_tap_stream_id(conn_info['dbname'], c['schema'], c['table'])
-        if streams_lookup.get(tap_stream_id) is None:
+        decoder = decoders.get(tap_stream_id)
+        if decoder is None or already_replicated(decoder, c['kind'], commit_lsn):
             continue
 
-        target_stream = streams_lookup[tap_stream_id]
-        stream_version = get_stream_version(target_stream['tap_stream_id'], state)
-        stream_md_map = metadata.to_map(target_stream['metadata'])
-
-
-        desired_columns = [c for c in target_stream['schema']['properties'].keys() if sync_common.should_sync_column(stream_md_map, c)]
-
         if c['kind'] == 'insert':
             col_names = []
             col_vals = []
             for idx, col in enumerate(c['columnnames']):
-                if col in set(desired_columns):
+                if col in decoder.selected_columns:
                     col_names.append(col)
                     col_vals.append(c['columnvalues'][idx])
 
@@ -304,13 +453,13 @@ def consume_message_format_1(payload, conn_info, streams_lookup, state, time_ext
             if conn_info.get('debug_lsn'):
                 col_names = col_names + ['_sdc_lsn']
                 col_vals = col_vals + [str(lsn)]
-            record_message = row_to_singer_message(target_stream, col_vals, stream_version, col_names, time_extracted, stream_md_map, conn_info)
+            record_message = row_to_singer_message(decoder, col_vals, col_names, time_extracted)
 
         elif c['kind'] == 'update':
             col_names = []
             col_vals = []
             for idx, col in enumerate(c['columnnames']):
-                if col in set(desired_columns):
+                if col in decoder.selected_columns:
                     col_names.append(col)
                     col_vals.append(c['columnvalues'][idx])
 
@@ -320,13 +469,13 @@ def consume_message_format_1(payload, conn_info, streams_lookup, state, time_ext
             if conn_info.get('debug_lsn'):
                 col_vals = col_vals + [str(lsn)]
                 col_names = col_names + ['_sdc_lsn']
-            record_message = row_to_singer_message(target_stream, col_vals, stream_version, col_names, time_extracted, stream_md_map, conn_info)
+            record_message = row_to_singer_message(decoder, col_vals, col_names, time_extracted)
 
         elif c['kind'] == 'delete':
             col_names = []
             col_vals = []
             for idx, col in enumerate(c['oldkeys']['keynames']):
-                if col in set(desired_columns):
+                if col in decoder.selected_columns:
                     col_names.append(col)
                     col_vals.append(c['oldkeys']['keyvalues'][idx])
 
@@ -336,132 +485,373 @@ def consume_message_format_1(payload, conn_info, streams_lookup, state, time_ext
             if conn_info.get('debug_lsn'):
                 col_vals = col_vals + [str(lsn)]
                 col_names = col_names + ['_sdc_lsn']
-            record_message = row_to_singer_message(target_stream, col_vals, stream_version, col_names, time_extracted, stream_md_map, conn_info)
+            record_message = row_to_singer_message(decoder, col_vals, col_names, time_extracted)
 
         else:
             raise Exception("unrecognized replication operation: {}".format(c['kind']))
 
 
         yield record_message
-        state = singer.write_bookmark(state,
-                                      target_stream['tap_stream_id'],
-                                      'lsn',
-                                      lsn)
 
 
-def consume_message(streams, state, msg, time_extracted, conn_info, end_lsn, message_format="1"):
-    payload = json.loads(msg.payload)
-    lsn = msg.data_start
+# pgoutput
+def consume_message_pgoutput(session, payload, conn_info, decoders, time_extracted, lsn):
+    for change in session.decode(payload):
+        tap_stream_id = post_db.compute_tap_stream_id(conn_info['dbname'], change.schema, change.table)
+        decoder = decoders.get(tap_stream_id)
+        if decoder is None or already_replicated(decoder, change.kind, change.final_lsn):
+            continue
 
-    streams_lookup = {s['tap_stream_id']: s for s in streams}
+        col_names = []
+        col_vals = []
+        for col, value in change.values:
+            if col in decoder.selected_columns:
+                col_names.append(col)
+                col_vals.append(value)
 
-    if message_format == "1":
-        records = consume_message_format_1(payload, conn_info, streams_lookup, state, time_extracted, lsn)
+        col_names = col_names + ['_sdc_deleted_at']
+        if change.kind == 'delete':
+            col_vals = col_vals + [singer.utils.strftime(change.commit_ts)]
+        else:
+            col_vals = col_vals + [None]
+
+        if conn_info.get('debug_lsn'):
+            col_names = col_names + ['_sdc_lsn']
+            col_vals = col_vals + [str(lsn)]
+
+        yield row_to_singer_message(decoder, col_vals, col_names, time_extracted)
+
+def consume_message(decoders, msg, time_extracted, conn_info, message_format="1", session=None, metrics=None):
+    """Writes the records of one replication message, and returns the LSN to resume
+    from once the message has ended a transaction, or None within a transaction.
+    That is the end LSN of the transaction's commit record: the commit of pgoutput, the
+    nextlsn of wal2json, or without include-lsn the LSN wal2json sent the message at,
+    which is the transaction's start for a format-version 1 transaction sent whole."""
+    lsn = msg.data_start
+
+    if message_format == "pgoutput":
+        records = consume_message_pgoutput(session, msg.payload, conn_info, decoders, time_extracted, lsn)
+    elif message_format == "1":
+        changes = session.feed(msg.payload)
+        records = consume_changes_format_1(changes, conn_info, decoders, time_extracted, lsn, commit_record_lsn(session.next_lsn))
     elif message_format == "2":
-        records = consume_message_format_2(payload, conn_info, streams_lookup, state, time_extracted, lsn)
+        payload = session.feed(msg.payload)
+        records = consume_message_format_2(payload, conn_info, decoders, time_extracted, lsn, commit_record_lsn(session.next_lsn))
     else:
         raise Exception("Unknown wal2json message format version: {}".format(message_format))
 
     for record_message in records:
-        if record_message:
-            singer.write_message(record_message)
-        # Pulled out of refactor so we send a keep-alive per-record
-        LOGGER.debug("sending feedback to server with NO flush_lsn. just a keep-alive")
-        msg.cursor.send_feedback()
-
-    LOGGER.debug("sending feedback to server. flush_lsn = %s", msg.data_start)
-    if msg.data_start > end_lsn:
-        raise Exception("incorrectly attempting to flush an lsn({}) > end_lsn({})".format(msg.data_start, end_lsn))
-
-    msg.cursor.send_feedback(flush_lsn=msg.data_start)
+        if record_message and metrics is None:
+            write_message(record_message)
+        elif record_message:
+            write_start = time.monotonic()
+            write_message(record_message)
+            metrics.record(record_message.stream, time.monotonic() - write_start)
+
+    if message_format == "pgoutput":
+        return session.commit_lsn
+    if not session.committed:
+        return None
+    return parse_lsn(session.next_lsn) if session.next_lsn else lsn
 
+def commit_record_lsn(next_lsn):
+    #wal2json's nextlsn is the end of the commit record, just past it
+    if next_lsn is None:
+        return None
+    return parse_lsn(next_lsn) - 1
 
+def write_commit_bookmarks(state, logical_streams, commit_lsn):
+    #every stream of the slot has been replicated up to the same transaction end. streams
+    #bookmarked further, by an initial copy or an earlier run, keep their bookmark
+    for s in logical_streams:
+        bookmark = get_bookmark(state, s['tap_stream_id'], 'lsn')
+        if bookmark is None or commit_lsn > bookmark:
+            state = singer.write_bookmark(state, s['tap_stream_id'], 'lsn', commit_lsn)
     return state
 
+def send_flush_feedback(cur, lsn):
+    LOGGER.debug("sending feedback to server. flush_lsn = %s", lsn)
+    cur.send_feedback(flush_lsn=lsn, force=True)
+
 def locate_replication_slot(conn_info):
+    plugin = conn_info.get('logical_decoder') or 'wal2json'
     with post_db.open_connection(conn_info, False) as conn:
         with conn.cursor() as cur:
             db_specific_slot = "stitch_{}".format(conn_info['dbname'])
-            cur.execute("SELECT * FROM pg_replication_slots WHERE slot_name = %s AND plugin = %s", (db_specific_slot, 'wal2json'))
+            cur.execute("SELECT * FROM pg_replication_slots WHERE slot_name = %s AND plugin = %s", (db_specific_slot, plugin))
             if len(cur.fetchall()) == 1:
                 LOGGER.info("using pg_replication_slot %s", db_specific_slot)
                 return db_specific_slot
 
 
-            cur.execute("SELECT * FROM pg_replication_slots WHERE slot_name = 'stitch' AND plugin = 'wal2json'")
+            cur.execute("SELECT * FROM pg_replication_slots WHERE slot_name = 'stitch' AND plugin = %s", (plugin,))
             if len(cur.fetchall()) == 1:
                 LOGGER.info("using pg_replication_slot 'stitch'")
                 return 'stitch'
 
-            raise Exception("Unable to find replication slot (stitch || {} with wal2json".format(db_specific_slot))
+            raise Exception("Unable to find replication slot (stitch || {} with {}".format(db_specific_slot, plugin))
+
+def escape_wal2json_name(name):
+    return WAL2JSON_SPECIAL_CHARACTERS.sub(r'\\\1', name)
 
+def wal2json_options(conn_info, logical_streams, message_format):
+    #wal2json only decodes and sends the changes to the replicated tables, without the
+    #column types nothing reads. wal2json_options in the config add to or override these
+    tables = []
+    for s in logical_streams:
+        schema_name = metadata.to_map(s['metadata']).get(()).get('schema-name')
+        tables.append('{}.{}'.format(escape_wal2json_name(schema_name), escape_wal2json_name(s['table_name'])))
+
+    options = {"add-tables": ','.join(sorted(tables)),
+               "include-types": False,
+               "include-lsn": True}
+    if message_format == "1":
+        #a message per change rather than per transaction, parsed by wal2json.ChangeStream
+        options["write-in-chunks"] = True
+    if message_format == "2":
+        options.update({"format-version": 2, "include-timestamp": True})
+
+    options.update(conn_info.get('wal2json_options') or {})
+    if message_format == "2":
+        #the Begin and Commit actions are what bookmarks and flushes are made at
+        options["include-transaction"] = True
+    return options
+
+def pgoutput_options(conn_info, server_version):
+    #the publication decides which tables' changes the server sends
+    options = {"proto_version": "1",
+               "publication_names": conn_info.get('publication_name') or 'stitch'}
+    if server_version >= 140000:
+        #large in-progress transactions are streamed ahead of their commit
+        options["proto_version"] = "2"
+        options["streaming"] = "on"
+    return options
+
+
+def stop_on_signals():
+    def stop(signum, _frame):
+        LOGGER.info("received signal %s. stopping logical replication after a final flush", signum)
+        STOP.set()
+
+    signal.signal(signal.SIGTERM, stop)
+
+def write_message(message):
+    #on the threads of sync_databases, messages go to the thread writing them instead
+    write = getattr(OUTPUT, 'write', None)
+    if write is None:
+        singer.write_message(message)
+    else:
+        write(message)
 
 def sync_tables(conn_info, logical_streams, state, end_lsn):
     start_lsn = min([get_bookmark(state, s['tap_stream_id'], 'lsn') for s in logical_streams])
     time_extracted = utils.now()
     slot = locate_replication_slot(conn_info)
-    last_lsn_processed = None
     poll_total_seconds = conn_info['logical_poll_total_seconds'] or 60 * 30  #we are willing to poll for a total of 30 minutes without finding a record
     keep_alive_time = 10.0
+    feedback_messages = conn_info.get('logical_feedback_messages') or FEEDBACK_MESSAGES
+    feedback_seconds = conn_info.get('logical_feedback_seconds') or FEEDBACK_SECONDS
     begin_ts = datetime.datetime.now()
 
-    for s in logical_streams:
-        sync_common.send_schema_message(s, ['lsn'])
+    #streaming runs until SIGTERM instead of up to end_lsn or the polling timeout
+    streaming = conn_info.get('logical_streaming')
+    if streaming:
+        end_lsn = None
+    checkpoint_rows = conn_info.get('logical_checkpoint_rows') or UPDATE_BOOKMARK_PERIOD
+    checkpoint_seconds = conn_info.get('logical_checkpoint_seconds') or (STREAMING_CHECKPOINT_SECONDS if streaming else CHECKPOINT_SECONDS)
+
+    if end_lsn is not None:
+        confirmed_flush_lsn = fetch_confirmed_flush_lsn(conn_info, slot)
+        if confirmed_flush_lsn is not None and confirmed_flush_lsn >= end_lsn:
+            LOGGER.info("slot %s has confirmed lsn %s, past end_lsn %s. nothing to replicate", slot, confirmed_flush_lsn, end_lsn)
+            write_message(singer.StateMessage(value=copy.deepcopy(state)))
+            return state
+
+    decoders = {s['tap_stream_id']: stream_decoder(s, state, conn_info) for s in logical_streams}
 
     with post_db.open_connection(conn_info, True) as conn:
         with conn.cursor() as cur:
             LOGGER.info("Starting Logical Replication for %s(%s): %s -> %s. poll_total_seconds: %s", list(map(lambda s: s['tap_stream_id'], logical_streams)), slot, start_lsn, end_lsn, poll_total_seconds)
 
+            #psycopg2 answers keepalive requests and sends a status update every status_interval
+            #seconds on its own, keeping the connection within wal_sender_timeout between flushes
+            #payloads are parsed as the bytes the server sent
             replication_params = {"slot_name": slot,
-                                  "decode": True,
-                                  "start_lsn": start_lsn}
-            message_format = conn_info.get("wal2json_message_format") or "1"
-            if message_format == "2":
-                LOGGER.info("Using wal2json format-version 2")
-                replication_params["options"] = {"format-version": 2, "include-timestamp": True}
+                                  "decode": False,
+                                  "start_lsn": start_lsn,
+                                  "status_interval": keep_alive_time}
+            session = None
+            if conn_info.get('logical_decoder') == 'pgoutput':
+                message_format = "pgoutput"
+                session = pgoutput.Session()
+                replication_params["options"] = pgoutput_options(conn_info, conn.server_version)
+                LOGGER.info("Using pgoutput with options %s", replication_params["options"])
+            else:
+                message_format = conn_info.get("wal2json_message_format") or "1"
+                if message_format == "1":
+                    session = wal2json.ChangeStream()
+                if message_format == "2":
+                    LOGGER.info("Using wal2json format-version 2")
+                    session = wal2json.ActionStream()
+                replication_params["options"] = wal2json_options(conn_info, logical_streams, message_format)
+                LOGGER.info("Using wal2json with options %s", replication_params["options"])
 
             try:
                 cur.start_replication(**replication_params)
             except psycopg2.ProgrammingError:
                 raise Exception("unable to start replication with logical replication slot {}".format(slot))
 
-            rows_saved = 0
+            #bookmarks and the flush position only ever move to the end of a transaction: the
+            #last one consumed, the last one written in STATE and the last one reported flushed
+            last_commit_lsn = None
+            saved_lsn = None
+            flushed_lsn = None
+            in_transaction = False
+            unsaved_messages = 0
+            saved_ts = begin_ts
+            unflushed_messages = 0
+            flushed_ts = begin_ts
+            messages = 0
+            work_seconds = 0.0
+            wait_seconds = 0.0
+            replied_ts = None
+            last_lsn = None
+            metrics = replication_metrics.ReplicationMetrics(slot, conn_info.get('logical_metrics_seconds') or METRICS_SECONDS)
             while True:
+                if STOP.is_set():
+                    LOGGER.info("stopping logical replication for %s", slot)
+                    break
+
                 poll_duration = (datetime.datetime.now() - begin_ts).total_seconds()
-                if poll_duration > poll_total_seconds:
+                if not streaming and poll_duration > poll_total_seconds:
                     LOGGER.info("breaking after %s seconds of polling with no data", poll_duration)
                     break
 
                 msg = cur.read_message()
                 if msg:
                     begin_ts = datetime.datetime.now()
-                    if msg.data_start > end_lsn:
+                    if end_lsn is not None and msg.data_start > end_lsn and not in_transaction:
                         LOGGER.info("gone past end_lsn %s for run. breaking", end_lsn)
                         break
 
-                    state = consume_message(logical_streams, state, msg, time_extracted,
-                                            conn_info, end_lsn, message_format=message_format)
+                    if streaming and not in_transaction:
+                        #a streaming run lasts for days, so every transaction is stamped when it is read
+                        time_extracted = utils.now()
+
+                    work_start = time.monotonic()
+                    commit_lsn = consume_message(decoders, msg, time_extracted, conn_info,
+                                                 message_format=message_format, session=session, metrics=metrics)
+                    work_seconds += time.monotonic() - work_start
+                    messages = messages + 1
+                    last_lsn = msg.data_start
+                    metrics.message(time.monotonic() - work_start)
+                    metrics.log_if_due(last_lsn, end_lsn, cur.wal_end)
                     #msg has been consumed. it has been processed
-                    last_lsn_processed = msg.data_start
-                    rows_saved = rows_saved + 1
-                    if rows_saved % UPDATE_BOOKMARK_PERIOD == 0:
-                        singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+                    in_transaction = session.in_transaction
+                    unsaved_messages = unsaved_messages + 1
+                    unflushed_messages = unflushed_messages + 1
+                    if commit_lsn is None:
+                        continue
+
+                    last_commit_lsn = commit_lsn
+                    if unsaved_messages >= checkpoint_rows or (begin_ts - saved_ts).total_seconds() >= checkpoint_seconds:
+                        state = write_commit_bookmarks(state, logical_streams, last_commit_lsn)
+                        write_message(singer.StateMessage(value=copy.deepcopy(state)))
+                        saved_lsn = last_commit_lsn
+                        unsaved_messages = 0
+                        saved_ts = begin_ts
+
+                    #only what STATE has been written for is reported flushed
+                    if saved_lsn != flushed_lsn and (unflushed_messages >= feedback_messages or (begin_ts - flushed_ts).total_seconds() >= feedback_seconds):
+                        send_flush_feedback(cur, saved_lsn)
+                        flushed_lsn = saved_lsn
+                        unflushed_messages = 0
+                        flushed_ts = begin_ts
                 else:
+                    #every message before the server's last keepalive has been read: once that
+                    #keepalive reports the server has decoded up to end_lsn, the run is complete
+                    if end_lsn is not None and not in_transaction and cur.wal_end >= end_lsn:
+                        LOGGER.info("caught up with end_lsn %s. server sent up to %s. breaking", end_lsn, cur.wal_end)
+                        break
+
+                    metrics.log_if_due(last_lsn, end_lsn, cur.wal_end)
                     now = datetime.datetime.now()
+                    if last_commit_lsn != saved_lsn and (now - saved_ts).total_seconds() >= checkpoint_seconds:
+                        #the last transactions of a burst are checkpointed without waiting for the next one
+                        state = write_commit_bookmarks(state, logical_streams, last_commit_lsn)
+                        write_message(singer.StateMessage(value=copy.deepcopy(state)))
+                        saved_lsn = last_commit_lsn
+                        unsaved_messages = 0
+                        saved_ts = now
+
+                    if saved_lsn != flushed_lsn and (now - flushed_ts).total_seconds() >= feedback_seconds:
+                        send_flush_feedback(cur, saved_lsn)
+                        flushed_lsn = saved_lsn
+                        unflushed_messages = 0
+                        flushed_ts = now
+
+                    if end_lsn is not None and (replied_ts is None or (now - replied_ts).total_seconds() >= REPLY_REQUEST_SECONDS):
+                        #ask for a keepalive now rather than when the server next sends one on its own
+                        cur.send_feedback(reply=True, force=True)
+                        replied_ts = now
+
                     timeout = keep_alive_time - (now - cur.io_timestamp).total_seconds()
+                    #waits are cut short to notice SIGTERM while streaming, and to ask for keepalives up to end_lsn
+                    poll_seconds = STOP_POLL_SECONDS if streaming else REPLY_REQUEST_SECONDS
                     try:
-                        sel = select([cur], [], [], max(0, timeout))
-                        if not any(sel):
-                            LOGGER.info("no data for %s seconds. sending feedback to server with NO flush_lsn. just a keep-alive", timeout)
-                            cur.send_feedback()
+                        wait_start = time.monotonic()
+                        sel = select([cur], [], [], max(0, min(timeout, poll_seconds)))
+                        wait_seconds += time.monotonic() - wait_start
+                        if timeout <= poll_seconds and not any(sel):
+                            LOGGER.info("no data for %s seconds. sending feedback to server. flush_lsn = %s", keep_alive_time, saved_lsn)
+                            send_flush_feedback(cur, saved_lsn or 0)
+                            flushed_lsn = saved_lsn
+                            unflushed_messages = 0
+                            flushed_ts = datetime.datetime.now()
 
                     except InterruptedError:
                         pass  # recalculate timeout and continue
 
-    if last_lsn_processed:
-        for s in logical_streams:
-            LOGGER.info("updating bookmark for stream %s to last_lsn_processed %s", s['tap_stream_id'], last_lsn_processed)
-            state = singer.write_bookmark(state, s['tap_stream_id'], 'lsn', last_lsn_processed)
+            metrics.log(last_lsn, end_lsn, cur.wal_end)
+            LOGGER.info("replicated %s messages from %s: %.1f seconds decoding and writing, %.1f seconds waiting for the server",
+                        messages, slot, work_seconds, wait_seconds)
+            for decoder in decoders.values():
+                if decoder.skipped:
+                    LOGGER.info("skipped %s changes to %s replicated before its bookmark %s: %s", sum(decoder.skipped.values()),
+                                decoder.tap_stream_id, decoder.start_lsn, dict(decoder.skipped))
+
+            if last_commit_lsn:
+                for s in logical_streams:
+                    LOGGER.info("updating bookmark for stream %s to the end of the last transaction %s", s['tap_stream_id'], last_commit_lsn)
+                state = write_commit_bookmarks(state, logical_streams, last_commit_lsn)
+
+            write_message(singer.StateMessage(value=copy.deepcopy(state)))
+            if last_commit_lsn and last_commit_lsn != flushed_lsn:
+                send_flush_feedback(cur, last_commit_lsn)
+
+    return state
+
+def sync_databases(conn_info, databases, state, end_lsn, workers):
+    """Replicates the logical streams of every (dbname, streams) in databases from that
+    database's slot, with up to `workers` databases at once, each on its own thread and
+    with its own copy of the state. Their records and states are written on the calling
+    thread, states merged into `state` one database's bookmarks at a time."""
+    streams_by_dbname = dict(databases)
+    #copied before any thread starts, as the calling thread goes on to update state
+    states = {dbname: copy.deepcopy(state) for dbname in streams_by_dbname}
+
+    def run_database(dbname, emit):
+        OUTPUT.write = emit
+        sync_tables(dict(conn_info, dbname=dbname), streams_by_dbname[dbname], states[dbname], end_lsn)
+
+    for dbname, message in parallel.iterate_jobs(list(streams_by_dbname), run_database, workers, name='tap-postgres-logical'):
+        if message is parallel.CHUNK_DONE:
+            LOGGER.info("finished logical replication of database %s", dbname)
+        elif isinstance(message, singer.StateMessage):
+            for s in streams_by_dbname[dbname]:
+                state['bookmarks'][s['tap_stream_id']] = message.value['bookmarks'][s['tap_stream_id']]
+            singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+        else:
+            singer.write_message(message)
 
-    singer.write_message(singer.StateMessage(value=copy.deepcopy(state)))
     return state
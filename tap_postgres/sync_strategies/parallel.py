@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# pylint: disable=missing-docstring,too-many-arguments,broad-except
+
+import functools
+import queue
+import threading
+import singer
+import tap_postgres.db as post_db
+
+LOGGER = singer.get_logger()
+
+#marker yielded once a chunk has been read to completion
+CHUNK_DONE = object()
+
+#rows buffered between the worker connections and the thread writing singer messages
+RESULT_QUEUE_SIZE = 10000
+QUEUE_POLL_SECONDS = 1.0
+
+def _put(results, item, stop):
+    while not stop.is_set():
+        try:
+            results.put(item, timeout=QUEUE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+def _pending(work, stop):
+    while not stop.is_set():
+        try:
+            yield work.get_nowait()
+        except queue.Empty:
+            return
+
+def _iterate(items, work_loop, workers, name, noun):
+    """Runs work_loop(work, results, stop) on up to `workers` threads, which take the
+    items from `work` and put (item, value) pairs on `results`, (item, CHUNK_DONE)
+    once an item is done and (None, exception) if they fail. Yields those pairs on
+    the calling thread until every item is done, and stops the threads on exit."""
+    work = queue.Queue()
+    for item in items:
+        work.put(item)
+
+    results = queue.Queue(maxsize=RESULT_QUEUE_SIZE)
+    stop = threading.Event()
+    threads = [threading.Thread(target=work_loop,
+                                args=(work, results, stop),
+                                name='{}-{}'.format(name, idx),
+                                daemon=True)
+               for idx in range(max(1, min(workers, len(items))))]
+
+    LOGGER.info("running %s %s on %s threads", len(items), noun, len(threads))
+    for thread in threads:
+        thread.start()
+
+    try:
+        pending = len(items)
+        while pending > 0:
+            try:
+                item, value = results.get(timeout=QUEUE_POLL_SECONDS)
+            except queue.Empty:
+                if not any(thread.is_alive() for thread in threads) and results.empty():
+                    raise Exception("all workers exited with {} {} still pending".format(pending, noun))
+                continue
+
+            if item is None:
+                raise Exception("worker failed: {}".format(value)) from value
+
+            if value is CHUNK_DONE:
+                pending = pending - 1
+
+            yield item, value
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+def _chunk_worker(conn_info, fetch_chunk, prepare_connection, chunks, results, stop):
+    conn = None
+    try:
+        conn = post_db.open_connection(conn_info)
+        if prepare_connection:
+            prepare_connection(conn)
+
+        for chunk in _pending(chunks, stop):
+            post_db.import_snapshot(conn, conn_info)
+            rows = fetch_chunk(conn, chunk)
+            try:
+                for row in rows:
+                    if not _put(results, (chunk, row), stop):
+                        return
+            finally:
+                rows.close()
+
+            #every chunk runs in its own short transaction
+            conn.commit()
+            _put(results, (chunk, CHUNK_DONE), stop)
+    except Exception as ex:
+        _put(results, (None, ex), stop)
+    finally:
+        if conn is not None:
+            conn.close()
+
+class JobStopped(Exception):
+    pass
+
+def _job_worker(run_job, jobs, results, stop):
+    for job in _pending(jobs, stop):
+        def emit(item, job=job):
+            if not _put(results, (job, item), stop):
+                raise JobStopped()
+
+        try:
+            run_job(job, emit)
+        except JobStopped:
+            return
+        except Exception as ex:
+            _put(results, (None, ex), stop)
+            return
+
+        _put(results, (job, CHUNK_DONE), stop)
+
+def iterate_jobs(jobs, run_job, workers, name='tap-postgres-job'):
+    """Runs every job on up to `workers` threads at once.
+
+    run_job(job, emit) runs on a worker thread and passes whatever it produces to
+    emit. This generator yields those (job, item) pairs on the calling thread,
+    followed by (job, CHUNK_DONE) once run_job returns."""
+    return _iterate(jobs, functools.partial(_job_worker, run_job), workers, name, 'jobs')
+
+def iterate_chunks(conn_info, chunks, fetch_chunk, workers, prepare_connection=None):
+    """Reads every chunk over up to `workers` connections at once.
+
+    fetch_chunk(conn, chunk) is a generator of rows for one chunk and runs on a
+    worker thread. This generator yields (chunk, row) pairs on the calling thread,
+    followed by (chunk, CHUNK_DONE) once all rows of that chunk have been yielded,
+    so all singer output stays on a single thread."""
+    return _iterate(chunks, functools.partial(_chunk_worker, conn_info, fetch_chunk, prepare_connection),
+                    workers, 'tap-postgres-worker', 'chunks')
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# pylint: disable=missing-docstring,invalid-name
+
+import datetime
+import functools
+import re
+import singer
+
+LOGGER = singer.get_logger()
+
+#an element of an array literal followed by its delimiter: a brace, a double quoted string with
+#backslash escapes or an unquoted string whose surrounding white space is not part of the value
+ARRAY_TOKEN = re.compile(r'\s*(?:(\{)|(\})|"((?:[^"\\]|\\.)*)"|((?:[^\s,{}"\\]|\\.)(?:(?:[^,{}"\\]|\\.)*(?:[^\s,{}"\\]|\\.))?))\s*,?', re.S)
+ARRAY_DIMENSIONS = re.compile(r'\s*(?:\[[^\]]*\])+\s*=', re.S)
+
+#"key"=>"value" pairs, keys and values may also be unquoted and the value may be an unquoted NULL
+HSTORE_PAIR = re.compile(r'\s*(?:"((?:[^"\\]|\\.)*)"|((?:[^\s="\\]|\\.)+))\s*=>\s*(?:"((?:[^"\\]|\\.)*)"|((?:[^\s,"\\]|\\.)+))\s*(?:,|\Z)', re.S)
+
+#the ISO DateStyle postgres writes dates, timestamps and times with time zones in, e.g.
+#2019-01-02 03:04:05.678+05:30 or 0044-03-15 BC, plus the Z offset of singer's own timestamps
+TIMESTAMP = re.compile(r'(\d{4,})-(\d\d)-(\d\d)(?:[ T](\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?)?(?:(Z)|([+-])(\d\d)(?::?(\d\d))?(?::?(\d\d))?)?( BC)?\Z')
+TIME = re.compile(r'(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?(?:(Z)|([+-])(\d\d)(?::?(\d\d))?(?::?(\d\d))?)?\Z')
+
+BACKSLASH_ESCAPE = re.compile(r'\\(.)', re.S)
+
+TRUE_LITERALS = {'t', 'tr', 'tru', 'true', 'y', 'ye', 'yes', 'on', '1'}
+
+def _parse_bool(value):
+    return value.lower() in TRUE_LITERALS
+
+#elements of the arrays logical replication used to have postgres cast to these types, which
+#psycopg2 turns into python bools, floats and ints. every other element stays a string, like
+#the elements of the text[] all other arrays were cast to
+ARRAY_ELEMENT_CASTS = {'bit[]': _parse_bool,
+                       'boolean[]': _parse_bool,
+                       'double precision[]': float,
+                       'real[]': float,
+                       'integer[]': int,
+                       'bigint[]': int,
+                       'smallint[]': int}
+
+def array_element_cast(sql_datatype):
+    return ARRAY_ELEMENT_CASTS.get(sql_datatype)
+
+def _unescape(value):
+    if '\\' not in value:
+        return value
+    return BACKSLASH_ESCAPE.sub(r'\1', value)
+
+def parse_array(text, cast=None):
+    """Parses the text representation of a postgres array, e.g. {{1,NULL},{"a \\"b\\"",c}},
+    into nested lists, applying cast to every element but the NULL's."""
+    dimensions = ARRAY_DIMENSIONS.match(text)
+    pos = dimensions.end() if dimensions else 0
+
+    stack = [[]]
+    while True:
+        match = ARRAY_TOKEN.match(text, pos)
+        if match is None or match.end() == pos or (len(stack) == 1 and match.group(1) is None):
+            raise ValueError('malformed array literal: {!r}'.format(text))
+        pos = match.end()
+
+        opening, closing, quoted, unquoted = match.groups()
+        if opening:
+            stack.append([])
+            continue
+        if closing:
+            elements = stack.pop()
+            stack[-1].append(elements)
+            if len(stack) == 1:
+                break
+            continue
+
+        if quoted is not None:
+            value = _unescape(quoted)
+        elif unquoted.upper() == 'NULL':
+            stack[-1].append(None)
+            continue
+        else:
+            value = _unescape(unquoted)
+        stack[-1].append(cast(value) if cast else value)
+
+    if text[pos:].strip():
+        raise ValueError('malformed array literal: {!r}'.format(text))
+    return stack[0][0]
+
+def parse_hstore(text):
+    """Parses the text representation of an hstore, e.g. "a"=>"1", "b"=>NULL, into a dict."""
+    hstore = {}
+    text = text.strip()
+    pos = 0
+    while pos < len(text):
+        match = HSTORE_PAIR.match(text, pos)
+        if match is None:
+            raise ValueError('malformed hstore literal: {!r}'.format(text))
+        pos = match.end()
+
+        quoted_key, key, quoted_value, value = match.groups()
+        key = _unescape(quoted_key if quoted_key is not None else key)
+        if quoted_value is not None:
+            hstore[key] = _unescape(quoted_value)
+        elif value.upper() == 'NULL':
+            hstore[key] = None
+        else:
+            hstore[key] = _unescape(value)
+    return hstore
+
+@functools.lru_cache(maxsize=None)
+def _time_zone(utc, sign, hours, minutes, seconds):
+    if utc or sign is None:
+        return datetime.timezone.utc if utc else None
+    offset = datetime.timedelta(hours=int(hours), minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return datetime.timezone(-offset if sign == '-' else offset)
+
+def _microseconds(fraction):
+    return int(fraction.ljust(6, '0')) if fraction else 0
+
+def parse_timestamp(text):
+    """Parses a date or timestamp, with or without an offset, in the ISO format postgres
+    writes them in. Like psycopg2, (-)infinity becomes datetime.max (min), as do dates
+    python can not represent: years past 9999 and BC. None when text is in another format."""
+    if text == 'infinity':
+        return datetime.datetime.max
+    if text == '-infinity':
+        return datetime.datetime.min
+
+    match = TIMESTAMP.match(text)
+    if match is None:
+        return None
+
+    year, month, day, hour, minute, second, fraction, utc, sign, offset_hours, offset_minutes, offset_seconds, bc = match.groups()
+    if bc or len(year) > 4:
+        LOGGER.warning('%s is out of the range of python datetimes, using %s instead', text, '-infinity' if bc else 'infinity')
+        return datetime.datetime.min if bc else datetime.datetime.max
+
+    try:
+        return datetime.datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+                                 _microseconds(fraction), _time_zone(utc, sign, offset_hours, offset_minutes, offset_seconds))
+    except ValueError:
+        return None
+
+def parse_time(text):
+    """Parses a time, with or without an offset, in the ISO format postgres writes them in.
+    None when text is in another format, e.g. 24:00:00 which python can not represent."""
+    match = TIME.match(text)
+    if match is None:
+        return None
+
+    hour, minute, second, fraction, utc, sign, offset_hours, offset_minutes, offset_seconds = match.groups()
+    try:
+        return datetime.time(int(hour), int(minute), int(second), _microseconds(fraction),
+                             _time_zone(utc, sign, offset_hours, offset_minutes, offset_seconds))
+    except ValueError:
+        return None
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# pylint: disable=missing-docstring,invalid-name,too-many-return-statements,too-many-instance-attributes,too-many-branches
+
+import collections
+import datetime
+import struct
+import tempfile
+import singer
+
+LOGGER = singer.get_logger()
+
+#https://www.postgresql.org/docs/current/protocol-logicalrep-message-formats.html
+POSTGRES_EPOCH = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+#in-progress transactions streamed by the server are buffered in memory up to this many bytes, then on disk
+STREAM_SPOOL_BYTES = 16 * 1024 * 1024
+
+BOOLEAN_OID = 16
+INTEGER_OIDS = {20, 21, 23, 26}
+FLOAT_OIDS = {700, 701}
+
+Relation = collections.namedtuple('Relation', ['oid', 'schema', 'table', 'columns', 'type_oids', 'key_columns'])
+
+#kind is insert, update or delete. values are the (column, value) pairs of the new row, or of the
+#old row's replica identity for deletes, leaving out unchanged TOASTed values the server did not send
+#final_lsn is the LSN of the commit record of the change's transaction
+Change = collections.namedtuple('Change', ['kind', 'schema', 'table', 'values', 'commit_ts', 'final_lsn'])
+
+def _text_value(type_oid, text):
+    #the values wal2json writes as json booleans and numbers
+    if type_oid == BOOLEAN_OID:
+        return text == 't'
+    if type_oid in INTEGER_OIDS:
+        return int(text)
+    if type_oid in FLOAT_OIDS:
+        return float(text)
+    return text
+
+def _timestamp(microseconds):
+    return POSTGRES_EPOCH + datetime.timedelta(microseconds=microseconds)
+
+class Reader():
+    def __init__(self, payload):
+        self.buf = memoryview(payload)
+        self.pos = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.buf, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def byte(self):
+        self.pos += 1
+        return chr(self.buf[self.pos - 1])
+
+    def int16(self):
+        return self.unpack('>h')[0]
+
+    def int32(self):
+        return self.unpack('>i')[0]
+
+    def string(self):
+        end = self.pos
+        while self.buf[end] != 0:
+            end += 1
+        value = bytes(self.buf[self.pos:end]).decode('utf-8')
+        self.pos = end + 1
+        return value
+
+    def tuple_data(self, relation):
+        values = []
+        for idx in range(self.int16()):
+            kind = self.byte()
+            if kind == 'n':
+                values.append((relation.columns[idx], None))
+            elif kind == 't':
+                length = self.int32()
+                text = bytes(self.buf[self.pos:self.pos + length]).decode('utf-8')
+                self.pos += length
+                values.append((relation.columns[idx], _text_value(relation.type_oids[idx], text)))
+            elif kind == 'u':
+                #unchanged TOASTed value, not sent
+                continue
+            else:
+                raise Exception("unsupported pgoutput column kind {}".format(kind))
+        return values
+
+class StreamedTransaction():
+    """The changes of an in-progress transaction the server streams ahead of its commit,
+    kept until it commits or aborts.
+
+    The server describes relations again within a streamed transaction, and only for
+    it, so those are kept in relations until the transaction ends. Every change is
+    spooled along with the Relation it was sent under."""
+    def __init__(self):
+        self.spool = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_BYTES)
+        self.aborted_subtransactions = set()
+        self.relations = {}
+        self.sent_under = []
+
+    def append(self, subxid, relation, payload):
+        if not self.sent_under or self.sent_under[-1] is not relation:
+            self.sent_under.append(relation)
+        self.spool.write(struct.pack('>iII', subxid, len(self.sent_under) - 1, len(payload)))
+        self.spool.write(payload)
+
+    def payloads(self):
+        """The (Relation, payload) of every change not rolled back by its subtransaction."""
+        self.spool.seek(0)
+        while True:
+            header = self.spool.read(12)
+            if not header:
+                break
+            subxid, relation_idx, length = struct.unpack('>iII', header)
+            payload = self.spool.read(length)
+            if subxid not in self.aborted_subtransactions:
+                yield self.sent_under[relation_idx], payload
+        self.spool.close()
+
+class Session():
+    """Decodes the messages of a pgoutput replication stream into Changes, in commit order.
+
+    Relations are cached as the server describes them, ahead of their first change in
+    every session. With streaming on (protocol version 2, PostgreSQL 14+) the changes
+    of large in-progress transactions arrive between Stream Start and Stream Stop
+    messages, and are returned once their Stream Commit arrives.
+
+    commit_lsn is the end LSN of the transaction the last message committed, if it did.
+    in_transaction tells whether the messages so far leave a Begin without its Commit.
+    Blocks of streamed changes do not, as nothing of them is returned before their
+    Stream Commit, and the server sends them again to a session stopped in between."""
+    def __init__(self):
+        self.relations = {}
+        self.commit_ts = None
+        self.final_lsn = None
+        self.commit_lsn = None
+        self.streaming_xid = None
+        self.streamed = {}
+
+    @property
+    def in_transaction(self):
+        return self.final_lsn is not None
+
+    def decode(self, payload):
+        """The Changes to emit for one message of the replication stream."""
+        reader = Reader(payload)
+        kind = reader.byte()
+        self.commit_lsn = None
+
+        if kind == 'B':
+            self.final_lsn, commit_ts, _xid = reader.unpack('>qqi')
+            self.commit_ts = _timestamp(commit_ts)
+            return []
+        if kind == 'C':
+            _flags, _commit_lsn, self.commit_lsn, _commit_ts = reader.unpack('>bqqq')
+            self.commit_ts = None
+            self.final_lsn = None
+            return []
+        if kind == 'S':
+            self.streaming_xid = reader.int32()
+            self.streamed.setdefault(self.streaming_xid, StreamedTransaction())
+            return []
+        if kind == 'E':
+            self.streaming_xid = None
+            return []
+        if kind == 'c':
+            xid, _flags, final_lsn, self.commit_lsn, commit_ts = reader.unpack('>ibqqq')
+            transaction = self.streamed.pop(xid, None)
+            if transaction is None:
+                return []
+            #once committed, the server takes the relations it described within the transaction as sent
+            self.relations.update(transaction.relations)
+            return self.replay(transaction, _timestamp(commit_ts), final_lsn)
+        if kind == 'A':
+            xid, subxid = reader.unpack('>ii')
+            if xid == subxid:
+                transaction = self.streamed.pop(xid, None)
+                if transaction:
+                    transaction.spool.close()
+            elif xid in self.streamed:
+                self.streamed[xid].aborted_subtransactions.add(subxid)
+            return []
+
+        if self.streaming_xid is not None and kind in ('R', 'Y', 'I', 'U', 'D', 'T', 'M'):
+            #every message of a streamed transaction carries the xid of its (sub)transaction
+            subxid = reader.int32()
+            transaction = self.streamed[self.streaming_xid]
+            if kind == 'R':
+                relation = self.relation(reader)
+                transaction.relations[relation.oid] = relation
+                return []
+            if kind in ('I', 'U', 'D'):
+                oid = reader.int32()
+                relation = transaction.relations.get(oid) or self.relations[oid]
+                transaction.append(subxid, relation, bytes(payload[:1]) + bytes(payload[reader.pos:]))
+                return []
+
+        if kind == 'R':
+            relation = self.relation(reader)
+            self.relations[relation.oid] = relation
+            return []
+        if kind in ('I', 'U', 'D'):
+            return [self.change(kind, reader, self.relations[reader.int32()], self.commit_ts, self.final_lsn)]
+
+        #Type, Truncate, Origin and logical decoding Messages
+        LOGGER.debug("Skipping pgoutput message of type %s", kind)
+        return []
+
+    def relation(self, reader):
+        oid = reader.int32()
+        schema = reader.string()
+        table = reader.string()
+        reader.byte() #replica identity setting
+        columns = []
+        type_oids = []
+        key_columns = set()
+        for _ in range(reader.int16()):
+            flags = reader.unpack('>b')[0]
+            name = reader.string()
+            type_oid, _type_modifier = reader.unpack('>ii')
+            columns.append(name)
+            type_oids.append(type_oid)
+            if flags & 1:
+                key_columns.add(name)
+        return Relation(oid, schema, table, columns, type_oids, key_columns)
+
+    def change(self, kind, reader, relation, commit_ts, final_lsn):
+        tuple_kind = reader.byte()
+        if kind == 'I':
+            return Change('insert', relation.schema, relation.table, reader.tuple_data(relation), commit_ts, final_lsn)
+        if kind == 'U':
+            if tuple_kind in ('K', 'O'):
+                #the old row, sent when the replica identity changed or is FULL
+                reader.tuple_data(relation)
+                reader.byte()
+            return Change('update', relation.schema, relation.table, reader.tuple_data(relation), commit_ts, final_lsn)
+
+        values = reader.tuple_data(relation)
+        if tuple_kind == 'K':
+            #the other columns of the old row are sent as NULL's
+            values = [(c, v) for c, v in values if c in relation.key_columns]
+        return Change('delete', relation.schema, relation.table, values, commit_ts, final_lsn)
+
+    def replay(self, transaction, commit_ts, final_lsn):
+        for relation, payload in transaction.payloads():
+            yield self.change(chr(payload[0]), Reader(payload[1:]), relation, commit_ts, final_lsn)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# pylint: disable=missing-docstring,too-many-instance-attributes,too-many-arguments
+
+import collections
+import time
+import singer
+import singer.metrics as metrics
+
+LOGGER = singer.get_logger()
+
+class ReplicationMetrics():
+    """Measures what sync_tables replicates from a slot, and logs it as singer metrics
+    every `interval` seconds: messages and records (by stream) with their rates, the
+    time spent decoding them and writing them, and how many bytes of WAL the last
+    message is behind end_lsn and behind the end of WAL the server last reported."""
+    def __init__(self, slot, interval=metrics.DEFAULT_LOG_INTERVAL):
+        self.tags = {'slot': slot}
+        self.interval = interval
+        self.reset(time.monotonic())
+
+    def reset(self, now):
+        self.started = now
+        self.messages = 0
+        self.records = collections.Counter()
+        self.message_seconds = 0.0
+        self.write_seconds = 0.0
+
+    def message(self, seconds):
+        self.messages += 1
+        self.message_seconds += seconds
+
+    def record(self, stream, write_seconds):
+        self.records[stream] += 1
+        self.write_seconds += write_seconds
+
+    def points(self, elapsed, lsn, end_lsn, wal_end):
+        records = sum(self.records.values())
+        yield metrics.Point('counter', 'replication_messages', self.messages, self.tags)
+        yield metrics.Point('counter', metrics.Metric.record_count, records, self.tags)
+        for stream, count in sorted(self.records.items()):
+            yield metrics.Point('counter', metrics.Metric.record_count, count, dict(self.tags, endpoint=stream))
+        if elapsed > 0:
+            yield metrics.Point('gauge', 'replication_messages_per_second', round(self.messages / elapsed, 1), self.tags)
+            yield metrics.Point('gauge', 'replication_records_per_second', round(records / elapsed, 1), self.tags)
+        #writing happens within the handling of a message, and the rest of it is decoding
+        yield metrics.Point('timer', 'replication_decode_duration', round(max(0.0, self.message_seconds - self.write_seconds), 3), self.tags)
+        yield metrics.Point('timer', 'replication_write_duration', round(self.write_seconds, 3), self.tags)
+        if lsn is not None and end_lsn is not None:
+            yield metrics.Point('gauge', 'replication_lag_bytes', max(0, end_lsn - lsn), dict(self.tags, behind='end_lsn'))
+        if lsn is not None and wal_end:
+            yield metrics.Point('gauge', 'replication_lag_bytes', max(0, wal_end - lsn), dict(self.tags, behind='wal_end'))
+
+    def log(self, lsn, end_lsn, wal_end, now=None):
+        now = time.monotonic() if now is None else now
+        for point in self.points(now - self.started, lsn, end_lsn, wal_end):
+            metrics.log(LOGGER, point)
+        self.reset(now)
+
+    def log_if_due(self, lsn, end_lsn, wal_end):
+        now = time.monotonic()
+        if now - self.started >= self.interval:
+            self.log(lsn, end_lsn, wal_end, now)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# pylint: disable=missing-docstring,too-many-arguments,too-many-return-statements
+
+import sys
+import pytz
+import simplejson as json
+import singer
+import singer.utils as u
+import tap_postgres.db as post_db
+
+LOGGER = singer.get_logger()
+
+#json_build_object takes at most 100 arguments, i.e. 50 columns
+COLUMNS_PER_OBJECT = 50
+
+#psycopg2 turns infinite dates and timestamps into date(time).max and .min
+DATE_MAX = '9999-12-31T00:00:00+00:00'
+DATE_MIN = '0001-01-01T00:00:00+00:00'
+TIMESTAMP_MAX = '9999-12-31T23:59:59.999999'
+TIMESTAMP_MIN = '0001-01-01T00:00:00'
+
+TEXT_TYPES = {'character varying', 'text', 'citext', 'uuid', 'inet', 'cidr', 'macaddr', 'money', 'json', 'jsonb'}
+NATIVE_TYPES = {'integer', 'smallint', 'bigint', 'boolean'}
+
+def row_rendering(md_map):
+    return md_map.get((), {}).get('row-rendering', 'python')
+
+def _fraction(c):
+    #datetime.isoformat() leaves the microseconds out when they are zero
+    return "CASE WHEN to_char({0}, 'US') = '000000' THEN '' ELSE to_char({0}, '.US') END".format(c)
+
+def _infinite(c, infinity, minus_infinity, finite):
+    return "CASE WHEN {0} = 'infinity' THEN '{1}' WHEN {0} = '-infinity' THEN '{2}' ELSE {3} END".format(c, infinity, minus_infinity, finite)
+
+def _numeric(c):
+    """str() of the Decimal psycopg2 returns: NaN's become NULL, as they do for the python
+    conversion, and values below 1E-6 are written in scientific notation.
+    NB> numeric infinities of postgres 14 come out as the strings "Infinity" and "-Infinity",
+    where python writes them as the bare (and invalid JSON) Infinity and -Infinity."""
+    text = '{}::text'.format(c)
+    scale = "length(split_part({}, '.', 2))".format(text)
+    digits = "ltrim(replace(ltrim({}, '-'), '.', ''), '0')".format(text)
+    scientific = ("(CASE WHEN {0} < 0 THEN '-' ELSE '' END || left({1}, 1)"
+                  " || CASE WHEN length({1}) > 1 THEN '.' || substr({1}, 2) ELSE '' END"
+                  " || 'E' || (length({1}) - 1 - {2})::text)::json").format(c, digits, scale)
+    return ("CASE WHEN {0} = 'NaN' THEN NULL"
+            " WHEN abs({0}) >= 0.000001 OR ({0} = 0 AND {1} <= 6) THEN to_json({0})"
+            " WHEN {0} = 0 THEN ('0E-' || {1})::json"
+            " ELSE {2} END").format(c, scale, scientific)
+
+def _float(c):
+    """repr() of the float psycopg2 returns: NaN's, +Inf and -Inf become NULL, integral values
+    keep a trailing .0 and only values below 1e-4 or from 1e16 on are written with an exponent,
+    where postgres switches to one from 1e15 on."""
+    text = '{}::text'.format(c)
+    plain = '{}::numeric::text'.format(text)
+    return ("CASE WHEN {0} IN ('NaN', 'Infinity', '-Infinity') THEN NULL"
+            " WHEN {0} = 0 THEN ({1} || '.0')::json"
+            " WHEN abs({1}::numeric) < 0.0001 OR abs({1}::numeric) >= 1e16 THEN {1}::json"
+            " ELSE ({2} || CASE WHEN strpos({2}, '.') = 0 THEN '.0' ELSE '' END)::json END").format(c, text, plain)
+
+def column_expression(c, sql_datatype):
+    """SQL rendering column c the way selected_value_to_singer_value would, or None
+    when the column has to be converted in python."""
+    if sql_datatype in NATIVE_TYPES:
+        return c
+    if sql_datatype in TEXT_TYPES:
+        return '{}::text'.format(c)
+    if sql_datatype == 'bit':
+        return "({}::text = '1')".format(c)
+    if sql_datatype == 'numeric':
+        return _numeric(c)
+    if sql_datatype in {'real', 'double precision'}:
+        return _float(c)
+    if sql_datatype == 'hstore':
+        return 'hstore_to_json({})'.format(c)
+    if sql_datatype == 'date':
+        return _infinite(c, DATE_MAX, DATE_MIN, "to_char({}, 'YYYY-MM-DD') || 'T00:00:00+00:00'".format(c))
+    if sql_datatype == 'timestamp without time zone':
+        return _infinite(c, TIMESTAMP_MAX + '+00:00', TIMESTAMP_MIN + '+00:00',
+                         "to_char({0}, 'YYYY-MM-DD\"T\"HH24:MI:SS') || {1} || '+00:00'".format(c, _fraction(c)))
+    if sql_datatype == 'timestamp with time zone':
+        return _infinite(c, TIMESTAMP_MAX, TIMESTAMP_MIN,
+                         "to_char({0}, 'YYYY-MM-DD\"T\"HH24:MI:SS') || {1} || to_char({0}, 'TZH:TZM')".format(c, _fraction(c)))
+    if sql_datatype == 'time without time zone':
+        return "to_char({0}, 'HH24:MI:SS') || {1}".format(c, _fraction(c))
+    if sql_datatype == 'time with time zone':
+        offset = 'abs(extract(timezone from {}))::int'.format(c)
+        return ("to_char({0}::time, 'HH24:MI:SS') || {1}"
+                " || CASE WHEN extract(timezone from {0}) < 0 THEN '-' ELSE '+' END"
+                " || lpad(({2} / 3600)::text, 2, '0') || ':' || lpad(({2} % 3600 / 60)::text, 2, '0')").format(c, _fraction('{}::time'.format(c)), offset)
+    return None
+
+def select_list(desired_columns, md_map):
+    """The select list for desired_columns and the number of values it yields. With
+    row-rendering 'server' the leading values are JSON objects rendered by postgres,
+    followed by the columns only python knows how to convert."""
+    if row_rendering(md_map) != 'server':
+        return ','.join(map(post_db.prepare_columns_sql, desired_columns)), len(desired_columns)
+
+    rendered, python_columns = rendered_columns(desired_columns, md_map)
+    objects = []
+    for idx in range(0, len(rendered), COLUMNS_PER_OBJECT):
+        pairs = ["'{}', {}".format(name.replace("'", "''"), expression) for name, expression in rendered[idx:idx + COLUMNS_PER_OBJECT]]
+        objects.append('json_build_object({})::text'.format(', '.join(pairs)))
+
+    return ','.join(objects + [post_db.prepare_columns_sql(c) for c in python_columns]), len(objects) + len(python_columns)
+
+def rendered_columns(desired_columns, md_map):
+    rendered = []
+    python_columns = []
+    for c in desired_columns:
+        expression = column_expression(post_db.prepare_columns_sql(c), md_map.get(('properties', c))['sql-datatype'])
+        if expression is None:
+            python_columns.append(c)
+        else:
+            rendered.append((c, expression))
+    return rendered, python_columns
+
+def record_json(row, python_columns, convert_row):
+    """Splices the JSON objects postgres rendered and the python conversion of the
+    remaining columns into a single JSON object."""
+    object_count = len(row) - len(python_columns)
+    #every object looks like {"a" : 1, "b" : 2}
+    members = [o[1:-1] for o in row[:object_count] if len(o) > 2]
+    for c, value in convert_row(row[object_count:]).items():
+        members.append('{}: {}'.format(json.dumps(c), json.dumps(value, use_decimal=True)))
+    return '{' + ', '.join(members) + '}'
+
+def record_writer(stream, version, time_extracted, desired_columns, md_map):
+    """A function writing a RECORD message for one row of select_list."""
+    if row_rendering(md_map) != 'server':
+        convert_row = post_db.row_converter(desired_columns, md_map)
+        def write_message(row):
+            singer.write_message(post_db.selected_row_to_singer_message(stream, row, version, desired_columns, time_extracted, md_map, convert_row))
+        return write_message
+
+    rendered, python_columns = rendered_columns(desired_columns, md_map)
+    convert_row = post_db.row_converter(python_columns, md_map)
+    LOGGER.info("postgres renders %s columns of %s as JSON, %s are converted in python: %s",
+                len(rendered), stream['tap_stream_id'], len(python_columns), python_columns)
+
+    #the envelope matches singer's RecordMessage.asdict()
+    prefix = '{{"type": "RECORD", "stream": {}, "record": '.format(json.dumps(post_db.calculate_destination_stream_name(stream, md_map)))
+    suffix = ', "version": {}, "time_extracted": {}}}\n'.format(json.dumps(version),
+                                                              json.dumps(u.strftime(time_extracted.astimezone(pytz.utc))))
+
+    def write_raw(row):
+        sys.stdout.write(prefix + record_json(row, python_columns, convert_row) + suffix)
+
+    return write_raw
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# pylint: disable=missing-docstring,too-few-public-methods
+
+import json
+import re
+import tap_postgres.sync_strategies.json_codec as json_codec
+
+CHANGE_ARRAY = re.compile(r'"change"\s*:\s*\[')
+NEXT_LSN = re.compile(r'"nextlsn"\s*:\s*"([0-9A-Fa-f]+/[0-9A-Fa-f]+)"')
+SEPARATORS = ' \t\n\r,'
+DECODER = json.JSONDecoder()
+
+class ChangeStream():
+    """Parses the changes of wal2json format-version 1 transactions one at a time,
+    instead of loading a transaction, which can be gigabytes, as a whole.
+
+    A transaction is either a single message, or, with write-in-chunks, a message
+    opening the change array, one message per change and one closing it. Changes
+    are never split across messages. committed tells whether the last message fed
+    ended a transaction, in_transaction whether it left one open, and next_lsn is
+    the end LSN of the current transaction, with include-lsn."""
+    def __init__(self):
+        self.in_changes = False
+        self.committed = False
+        self.next_lsn = None
+
+    def feed(self, payload):
+        self.committed = False
+        if self.in_changes:
+            #a chunk: a single change, or the end of the change array
+            chunk = payload.strip(SEPARATORS.encode() if isinstance(payload, bytes) else SEPARATORS)
+            if chunk[:1] in (b']', ']'):
+                self.in_changes = False
+                self.committed = True
+            elif chunk:
+                return [json_codec.loads(chunk)]
+            return []
+
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        #the header of the transaction is read ahead of its changes
+        return self.changes(payload, self.open(payload, 0))
+
+    def open(self, payload, pos):
+        match = CHANGE_ARRAY.search(payload, pos)
+        if match is None:
+            return len(payload)
+
+        next_lsn = NEXT_LSN.search(payload, pos, match.start())
+        self.next_lsn = next_lsn.group(1) if next_lsn else None
+        self.in_changes = True
+        return match.end()
+
+    def changes(self, payload, pos):
+        length = len(payload)
+        while pos < length:
+            if not self.in_changes:
+                pos = self.open(payload, pos)
+                continue
+
+            while pos < length and payload[pos] in SEPARATORS:
+                pos += 1
+            if pos == length:
+                return
+
+            if payload[pos] == ']':
+                #the end of the transaction
+                self.in_changes = False
+                self.committed = True
+                pos += 1
+                continue
+
+            change, pos = DECODER.raw_decode(payload, pos)
+            yield change
+
+    @property
+    def in_transaction(self):
+        return self.in_changes
+
+class ActionStream():
+    """Parses wal2json format-version 2 messages, an action each. next_lsn is the end
+    LSN of the current transaction from its Begin action, with include-lsn,
+    committed tells whether the last action fed was a Commit, and in_transaction
+    whether one was fed after a Begin."""
+    def __init__(self):
+        self.committed = False
+        self.in_transaction = False
+        self.next_lsn = None
+
+    def feed(self, payload):
+        action = json_codec.loads(payload)
+        self.committed = action['action'] == 'C'
+        if action['action'] == 'B':
+            self.next_lsn = action.get('nextlsn')
+            self.in_transaction = True
+        elif self.committed:
+            self.in_transaction = False
+        return action
@@ -0,0 +1,39 @@
+import decimal
+import struct
+import unittest
+import tap_postgres.sync_strategies.copy_extraction as copy_extraction
+
+def binary_numeric(weight, sign, dscale, digits):
+    return struct.pack('>hhHh', len(digits), weight, sign, dscale) + struct.pack('>{}H'.format(len(digits)), *digits)
+
+class TestCopyTextFormat(unittest.TestCase):
+    def test_escapes_and_nulls(self):
+        rows = copy_extraction.parse_text_rows('1\tab\\tc\\\\d\t\\N\n2\t\\\\N\tline\\nbreak\n', [int, None, None])
+        self.assertEqual([(1, 'ab\tc\\d', None), (2, '\\N', 'line\nbreak')], rows)
+
+    def test_octal_and_hex_escapes(self):
+        self.assertEqual('a\x01b\x7f', copy_extraction.unescape_text_field('a\\1b\\x7f'))
+
+class TestCopyBinaryFormat(unittest.TestCase):
+    def test_numeric(self):
+        self.assertEqual(decimal.Decimal('123.45'), copy_extraction._binary_numeric(binary_numeric(0, 0, 2, [123, 4500])))
+        self.assertEqual('-0.001', str(copy_extraction._binary_numeric(binary_numeric(-1, 0x4000, 3, [10]))))
+        self.assertEqual('10000', str(copy_extraction._binary_numeric(binary_numeric(1, 0, 0, [1]))))
+        self.assertEqual('0.50', str(copy_extraction._binary_numeric(binary_numeric(-1, 0, 2, [5000]))))
+        self.assertTrue(copy_extraction._binary_numeric(binary_numeric(0, 0xC000, 0, [])).is_nan())
+
+    def test_rows_split_across_writes(self):
+        int_decoder = lambda buf: struct.unpack('>i', buf)[0]
+        text_decoder = lambda buf: bytes(buf).decode('utf-8')
+        row = struct.pack('>h', 2) + struct.pack('>ii', 4, 7) + struct.pack('>i', 3) + b'cow'
+        null_row = struct.pack('>h', 2) + struct.pack('>ii', 4, 8) + struct.pack('>i', -1)
+        data = copy_extraction.BINARY_SIGNATURE + struct.pack('>ii', 0, 0) + row + null_row + struct.pack('>h', -1)
+
+        blocks = []
+        sink = copy_extraction.BinarySink([int_decoder, text_decoder], blocks.extend)
+        for idx in range(0, len(data), 3):
+            sink.write(data[idx:idx + 3])
+            sink.flush()
+
+        self.assertEqual([(7, 'cow'), (8, None)], blocks)
+        self.assertTrue(sink.finished)
@@ -0,0 +1,93 @@
+import unittest
+import singer
+from singer import metadata
+import tap_postgres
+import tap_postgres.db as post_db
+
+class FakeCursor():
+    def __init__(self, dbname):
+        self.dbname = dbname
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, sql):
+        pass
+
+    def fetchone(self):
+        return ['snapshot-of-{}'.format(self.dbname)]
+
+class FakeConnection():
+    def __init__(self, conn_config):
+        self.dbname = conn_config['dbname']
+        self.closed = False
+
+    def set_session(self, **_kwargs):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self.dbname)
+
+    def close(self):
+        self.closed = True
+
+def stream(dbname, table_name):
+    md = {(): {'database-name': dbname, 'schema-name': 'public'},
+          ('properties', 'id'): {'sql-datatype': 'integer', 'inclusion': 'automatic'}}
+    return {'tap_stream_id': '{}-public-{}'.format(dbname, table_name),
+            'table_name': table_name,
+            'stream': table_name,
+            'metadata': metadata.to_list(md),
+            'schema': {'type': 'object', 'properties': {'id': {'type': ['integer']}}}}
+
+class TestExportedSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.connections = []
+        self.snapshots_seen = []
+        self.patched = [(post_db, 'open_connection', post_db.open_connection),
+                        (tap_postgres, 'register_type_adapters', tap_postgres.register_type_adapters),
+                        (tap_postgres, 'do_sync_full_table', tap_postgres.do_sync_full_table),
+                        (tap_postgres, 'do_sync_incremental', tap_postgres.do_sync_incremental),
+                        (singer, 'write_message', singer.write_message)]
+        post_db.open_connection = self.open_connection
+        tap_postgres.register_type_adapters = lambda conn_config: None
+        tap_postgres.do_sync_full_table = self.sync
+        tap_postgres.do_sync_incremental = self.sync
+        singer.write_message = lambda message: None
+
+    def tearDown(self):
+        for module, name, value in self.patched:
+            setattr(module, name, value)
+
+    def open_connection(self, conn_config, logical_replication=False):
+        conn = FakeConnection(conn_config)
+        self.connections.append(conn)
+        return conn
+
+    def sync(self, conn_config, stream, state, desired_columns, md_map):
+        #the snapshot a stream reads with, and whether its coordinator transaction is still open
+        self.snapshots_seen.append((stream['tap_stream_id'], conn_config.get('snapshot_id'),
+                                    [c.closed for c in self.connections]))
+        return state
+
+    def test_snapshots_per_stream(self):
+        conn_config = {'use_exported_snapshot': True}
+        state = {}
+        state = tap_postgres.sync_traditional_stream(conn_config, stream('cats', 'cows'), state, 'full', None)
+        state = tap_postgres.sync_traditional_stream(conn_config, stream('dogs', 'cows'), state, 'full', None)
+
+        conn_config['use_exported_snapshot'] = False
+        state = tap_postgres.sync_traditional_stream(conn_config, stream('dogs', 'chickens'), state, 'full', None)
+
+        self.assertEqual([('cats-public-cows', 'snapshot-of-cats', [False]),
+                          ('dogs-public-cows', 'snapshot-of-dogs', [True, False]),
+                          ('dogs-public-chickens', None, [True, True])], self.snapshots_seen)
+        #every snapshot is released once its stream is done with it
+        self.assertEqual({}, post_db.exported_snapshots)
+        self.assertNotIn('snapshot_id', conn_config)
+
+if __name__ == "__main__":
+    unittest.main()
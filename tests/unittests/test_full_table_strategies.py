@@ -0,0 +1,305 @@
+import unittest
+import tap_postgres
+import tap_postgres.db as post_db
+import tap_postgres.sync_strategies.full_table as full_table
+import tap_postgres.sync_strategies.common as pg_common
+import singer
+from singer import get_logger, metadata
+
+from utils import ensure_db, get_test_connection, ensure_test_table, select_all_of_stream, set_replication_method_for_stream, insert_record, get_test_connection_config
+
+LOGGER = get_logger()
+
+CAUGHT_MESSAGES = []
+COW_RECORD_COUNT = 0
+
+def singer_write_message_no_cow(message):
+    global COW_RECORD_COUNT
+
+    if isinstance(message, singer.RecordMessage) and message.stream == 'COW':
+        COW_RECORD_COUNT = COW_RECORD_COUNT + 1
+        if COW_RECORD_COUNT > 2:
+            raise Exception("simulated exception")
+        CAUGHT_MESSAGES.append(message)
+    else:
+        CAUGHT_MESSAGES.append(message)
+
+def singer_write_message_ok(message):
+    CAUGHT_MESSAGES.append(message)
+
+def do_not_dump_catalog(catalog):
+    pass
+
+def set_full_table_strategy(stream, strategy, workers):
+    new_md = metadata.to_map(stream['metadata'])
+    new_md.get(()).update({'full-table-strategy': strategy, 'full-table-workers': workers})
+    stream['metadata'] = metadata.to_list(new_md)
+    return stream
+
+tap_postgres.dump_catalog = do_not_dump_catalog
+
+class FullTableStrategies(unittest.TestCase):
+    maxDiff = None
+
+    def setUp(self):
+        ensure_db()
+        table_spec = {"columns": [{"name": "id", "type" : "serial",       "primary_key" : True},
+                                  {"name" : 'name', "type": "character varying"},
+                                  {"name" : 'colour', "type": "character varying"}],
+                      "name" : 'COW'}
+        ensure_test_table(table_spec)
+        global COW_RECORD_COUNT
+        COW_RECORD_COUNT = 0
+        CAUGHT_MESSAGES.clear()
+        self.update_bookmark_period = full_table.UPDATE_BOOKMARK_PERIOD
+
+    def tearDown(self):
+        full_table.UPDATE_BOOKMARK_PERIOD = self.update_bookmark_period
+
+    def test_interrupted_ranges_resume(self):
+        singer.write_message = singer_write_message_no_cow
+        pg_common.write_schema_message = singer_write_message_ok
+
+        streams = tap_postgres.do_discovery(get_test_connection_config())
+        cow_stream = [s for s in streams if s['table_name'] == 'COW'][0]
+        cow_stream = select_all_of_stream(cow_stream)
+        cow_stream = set_replication_method_for_stream(cow_stream, 'FULL_TABLE')
+        cow_stream = set_full_table_strategy(cow_stream, 'ctid', 2)
+
+        with get_test_connection() as conn:
+            conn.autocommit = True
+            cur = conn.cursor()
+            for idx in range(500):
+                insert_record(cur, 'COW', {'name' : 'cow {}'.format(idx), 'colour' : 'x' * 200})
+            cur.execute('ANALYZE "COW"')
+
+        state = {}
+        blew_up_on_cow = False
+        try:
+            tap_postgres.do_sync(get_test_connection_config(), {'streams' : [cow_stream]}, None, state)
+        except Exception:
+            blew_up_on_cow = True
+
+        self.assertTrue(blew_up_on_cow)
+        old_state = [m for m in CAUGHT_MESSAGES if isinstance(m, singer.StateMessage)][-1].value
+        pending_ranges = old_state['bookmarks']['postgres-public-COW']['ctid_ranges']
+        self.assertTrue(len(pending_ranges) > 1)
+        self.assertIsNone(pending_ranges[-1][1])
+        version = old_state['bookmarks']['postgres-public-COW']['version']
+
+        singer.write_message = singer_write_message_ok
+        CAUGHT_MESSAGES.clear()
+        tap_postgres.do_sync(get_test_connection_config(), {'streams' : [cow_stream]}, None, old_state)
+
+        records = [m for m in CAUGHT_MESSAGES if isinstance(m, singer.RecordMessage)]
+        #only the unfinished ranges are read again
+        self.assertTrue(len(records) <= 500)
+        self.assertTrue(all(r.version == version for r in records))
+
+        final_state = CAUGHT_MESSAGES[-1].value
+        self.assertIsNone(final_state['bookmarks']['postgres-public-COW']['ctid_ranges'])
+        self.assertTrue(isinstance(CAUGHT_MESSAGES[-2], singer.ActivateVersionMessage))
+        self.assertEqual(CAUGHT_MESSAGES[-2].version, version)
+
+    def test_all_rows_synced(self):
+        singer.write_message = singer_write_message_ok
+        pg_common.write_schema_message = singer_write_message_ok
+
+        streams = tap_postgres.do_discovery(get_test_connection_config())
+        cow_stream = [s for s in streams if s['table_name'] == 'COW'][0]
+        cow_stream = select_all_of_stream(cow_stream)
+        cow_stream = set_replication_method_for_stream(cow_stream, 'FULL_TABLE')
+        cow_stream = set_full_table_strategy(cow_stream, 'ctid', 4)
+
+        with get_test_connection() as conn:
+            conn.autocommit = True
+            cur = conn.cursor()
+            for idx in range(500):
+                insert_record(cur, 'COW', {'name' : 'cow {}'.format(idx), 'colour' : 'x' * 200})
+
+        tap_postgres.do_sync(get_test_connection_config(), {'streams' : [cow_stream]}, None, {})
+
+        records = [m for m in CAUGHT_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(sorted(r.record['id'] for r in records), list(range(1, 501)))
+
+    def test_copy_engine_with_every_strategy(self):
+        singer.write_message = singer_write_message_ok
+        pg_common.write_schema_message = singer_write_message_ok
+
+        with get_test_connection() as conn:
+            conn.autocommit = True
+            cur = conn.cursor()
+            for idx in range(50):
+                insert_record(cur, 'COW', {'name' : 'cow {}'.format(idx), 'colour' : 'brown'})
+
+        streams = tap_postgres.do_discovery(get_test_connection_config())
+        for strategy, workers in [('ctid', 2), ('keyset', 1), ('keyset', 2), ('xmin', 1)]:
+            cow_stream = [s for s in streams if s['table_name'] == 'COW'][0]
+            cow_stream = select_all_of_stream(cow_stream)
+            cow_stream = set_replication_method_for_stream(cow_stream, 'FULL_TABLE')
+            cow_stream = set_full_table_strategy(cow_stream, strategy, workers)
+            new_md = metadata.to_map(cow_stream['metadata'])
+            new_md.get(()).update({'extraction-engine': 'copy', 'itersize': 7})
+            cow_stream['metadata'] = metadata.to_list(new_md)
+
+            CAUGHT_MESSAGES.clear()
+            tap_postgres.do_sync(get_test_connection_config(), {'streams' : [cow_stream]}, None, {})
+
+            records = [m for m in CAUGHT_MESSAGES if isinstance(m, singer.RecordMessage)]
+            self.assertEqual(list(range(1, 51)), sorted(r.record['id'] for r in records), strategy)
+
+    def test_keyset_interrupted_resume(self):
+        singer.write_message = singer_write_message_no_cow
+        pg_common.write_schema_message = singer_write_message_ok
+
+        streams = tap_postgres.do_discovery(get_test_connection_config())
+        cow_stream = [s for s in streams if s['table_name'] == 'COW'][0]
+        cow_stream = select_all_of_stream(cow_stream)
+        cow_stream = set_replication_method_for_stream(cow_stream, 'FULL_TABLE')
+        cow_stream = set_full_table_strategy(cow_stream, 'keyset', 1)
+
+        with get_test_connection() as conn:
+            conn.autocommit = True
+            cur = conn.cursor()
+            for name in ['betty', 'smelly', 'pooper', 'flossy']:
+                insert_record(cur, 'COW', {'name' : name, 'colour' : 'blue'})
+
+        full_table.UPDATE_BOOKMARK_PERIOD = 1
+        state = {}
+        blew_up_on_cow = False
+        try:
+            tap_postgres.do_sync(get_test_connection_config(), {'streams' : [cow_stream]}, None, state)
+        except Exception:
+            blew_up_on_cow = True
+
+        self.assertTrue(blew_up_on_cow)
+        old_state = [m for m in CAUGHT_MESSAGES if isinstance(m, singer.StateMessage)][-1].value
+        self.assertEqual({'id': '2'}, old_state['bookmarks']['postgres-public-COW']['last_pk_fetched'])
+
+        singer.write_message = singer_write_message_ok
+        CAUGHT_MESSAGES.clear()
+        tap_postgres.do_sync(get_test_connection_config(), {'streams' : [cow_stream]}, None, old_state)
+
+        records = [m.record['name'] for m in CAUGHT_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(['pooper', 'flossy'], records)
+        self.assertIsNone(CAUGHT_MESSAGES[-1].value['bookmarks']['postgres-public-COW']['last_pk_fetched'])
+
+    def test_single_xmin_resume_skips_emitted_rows(self):
+        singer.write_message = singer_write_message_no_cow
+        pg_common.write_schema_message = singer_write_message_ok
+
+        streams = tap_postgres.do_discovery(get_test_connection_config())
+        cow_stream = [s for s in streams if s['table_name'] == 'COW'][0]
+        cow_stream = select_all_of_stream(cow_stream)
+        cow_stream = set_replication_method_for_stream(cow_stream, 'FULL_TABLE')
+
+        #one transaction, so every row shares a single xmin
+        with get_test_connection() as conn:
+            cur = conn.cursor()
+            for name in ['betty', 'smelly', 'pooper', 'flossy']:
+                insert_record(cur, 'COW', {'name' : name, 'colour' : 'blue'})
+            conn.commit()
+
+        full_table.UPDATE_BOOKMARK_PERIOD = 1
+        blew_up_on_cow = False
+        try:
+            tap_postgres.do_sync(get_test_connection_config(), {'streams' : [cow_stream]}, None, {})
+        except Exception:
+            blew_up_on_cow = True
+
+        self.assertTrue(blew_up_on_cow)
+        old_state = [m for m in CAUGHT_MESSAGES if isinstance(m, singer.StateMessage)][-1].value
+        self.assertIsNotNone(old_state['bookmarks']['postgres-public-COW']['xmin'])
+        self.assertIsNotNone(old_state['bookmarks']['postgres-public-COW']['ctid'])
+
+        singer.write_message = singer_write_message_ok
+        CAUGHT_MESSAGES.clear()
+        tap_postgres.do_sync(get_test_connection_config(), {'streams' : [cow_stream]}, None, old_state)
+
+        records = [m.record['name'] for m in CAUGHT_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(['pooper', 'flossy'], records)
+        self.assertIsNone(CAUGHT_MESSAGES[-1].value['bookmarks']['postgres-public-COW']['ctid'])
+
+class StreamItersize(unittest.TestCase):
+    def setUp(self):
+        ensure_db()
+        table_spec = {"columns": [{"name": "id", "type" : "serial",       "primary_key" : True},
+                                  {"name" : 'name', "type": "character varying"},
+                                  {"name" : 'colour', "type": "character varying"}],
+                      "name" : 'COW'}
+        ensure_test_table(table_spec)
+        self.fetch_target_bytes = post_db.fetch_target_bytes
+        post_db.fetch_target_bytes = 16 * 1024 * 1024
+
+    def tearDown(self):
+        post_db.fetch_target_bytes = self.fetch_target_bytes
+
+    def test_wide_rows_get_smaller_fetches(self):
+        with get_test_connection() as conn:
+            conn.autocommit = True
+            cur = conn.cursor()
+            for idx in range(200):
+                insert_record(cur, 'COW', {'name' : 'cow {}'.format(idx), 'colour' : 'x' * 1000})
+            cur.execute('ANALYZE "COW"')
+
+        stream = {'tap_stream_id': 'postgres-public-COW', 'table_name': 'COW'}
+        md_map = {(): {'schema-name': 'public'}}
+        narrow = post_db.stream_itersize(get_test_connection_config(), stream, md_map, ['id'])
+        wide = post_db.stream_itersize(get_test_connection_config(), stream, md_map, ['id', 'name', 'colour'])
+        self.assertGreater(narrow, wide)
+        self.assertLess(wide, post_db.fetch_target_bytes // 1000)
+
+        md_map[()]['itersize'] = 7
+        self.assertEqual(7, post_db.stream_itersize(get_test_connection_config(), stream, md_map, ['id']))
+
+class ViewKeyset(unittest.TestCase):
+    maxDiff = None
+
+    def setUp(self):
+        ensure_db()
+        table_spec = {"columns": [{"name": "id", "type" : "serial",       "primary_key" : True},
+                                  {"name" : 'name', "type": "character varying"},
+                                  {"name" : 'colour', "type": "character varying"}],
+                      "name" : 'COW'}
+        ensure_test_table(table_spec)
+        with get_test_connection() as conn:
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute('CREATE OR REPLACE VIEW "COW_VIEW" AS SELECT id, name FROM "COW"')
+            for idx in range(100):
+                insert_record(cur, 'COW', {'name' : 'cow {}'.format(idx), 'colour' : 'blue'})
+
+        CAUGHT_MESSAGES.clear()
+        singer.write_message = singer_write_message_ok
+        pg_common.write_schema_message = singer_write_message_ok
+
+    def view_stream(self, workers):
+        streams = tap_postgres.do_discovery(get_test_connection_config())
+        view_stream = [s for s in streams if s['table_name'] == 'COW_VIEW'][0]
+        view_stream = select_all_of_stream(view_stream)
+        view_stream = set_replication_method_for_stream(view_stream, 'FULL_TABLE')
+        new_md = metadata.to_map(view_stream['metadata'])
+        new_md.get(()).update({'view-key-properties': ['id'], 'full-table-workers': workers})
+        view_stream['metadata'] = metadata.to_list(new_md)
+        return view_stream
+
+    def test_resume_from_last_key(self):
+        state = {'bookmarks': {'postgres-public-COW_VIEW': {'version': 1, 'last_replication_method': 'FULL_TABLE',
+                                                            'last_pk_fetched': {'id': '90'}}}}
+        tap_postgres.do_sync(get_test_connection_config(), {'streams' : [self.view_stream(1)]}, None, state)
+
+        records = [m for m in CAUGHT_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(list(range(91, 101)), [m.record['id'] for m in records])
+        self.assertEqual({1}, {m.version for m in records})
+        self.assertIsNone(CAUGHT_MESSAGES[-1].value['bookmarks']['postgres-public-COW_VIEW']['last_pk_fetched'])
+
+    def test_key_ranges_read_every_row(self):
+        state = {}
+        tap_postgres.do_sync(get_test_connection_config(), {'streams' : [self.view_stream(3)]}, None, state)
+
+        ids = sorted(m.record['id'] for m in CAUGHT_MESSAGES if isinstance(m, singer.RecordMessage))
+        self.assertEqual(list(range(1, 101)), ids)
+        first_ranges = [m.value['bookmarks']['postgres-public-COW_VIEW'].get('key_ranges') for m in CAUGHT_MESSAGES
+                        if isinstance(m, singer.StateMessage) and m.value['bookmarks'].get('postgres-public-COW_VIEW', {}).get('key_ranges')][0]
+        self.assertEqual(3 * full_table.KEY_RANGES_PER_WORKER, len(first_ranges))
+        self.assertIsNone(CAUGHT_MESSAGES[-1].value['bookmarks']['postgres-public-COW_VIEW']['key_ranges'])
@@ -0,0 +1,296 @@
+import collections
+import copy
+import datetime
+import json
+import os
+import signal
+import unittest
+import singer
+from singer import metadata
+import tap_postgres
+import tap_postgres.sync_strategies.logical_replication as logical_replication
+import tap_postgres.sync_strategies.wal2json as wal2json
+
+#the parts of psycopg2's ReplicationMessage the consumer reads
+ReplicationMessage = collections.namedtuple('ReplicationMessage', ['data_start', 'payload'])
+
+def cows_stream():
+    md = {(): {'schema-name': 'public'},
+          ('properties', 'id'): {'sql-datatype': 'integer', 'inclusion': 'automatic'},
+          ('properties', 'tags'): {'sql-datatype': 'text[]', 'inclusion': 'available', 'selected': True},
+          ('properties', 'secret'): {'sql-datatype': 'text', 'inclusion': 'available', 'selected': False}}
+    return {'tap_stream_id': 'postgres-public-cows',
+            'table_name': 'cows',
+            'stream': 'cows',
+            'metadata': metadata.to_list(md),
+            'schema': {'type': 'object',
+                       'properties': {'id': {'type': ['integer']},
+                                      'tags': {'type': ['null', 'array']},
+                                      'secret': {'type': ['null', 'string']},
+                                      '_sdc_deleted_at': {'type': ['null', 'string'], 'format': 'date-time'}}}}
+
+class TestStreamDecoder(unittest.TestCase):
+    def setUp(self):
+        self.conn_info = {'dbname': 'postgres'}
+        self.state = {'bookmarks': {'postgres-public-cows': {'version': 7, 'lsn': 1}}}
+        self.decoders = {'postgres-public-cows': logical_replication.stream_decoder(cows_stream(), self.state, self.conn_info)}
+
+    def test_decoder(self):
+        decoder = self.decoders['postgres-public-cows']
+        self.assertEqual(7, decoder.version)
+        self.assertEqual('cows', decoder.stream_name)
+        self.assertEqual({'id', 'tags', '_sdc_deleted_at'}, decoder.selected_columns)
+
+    def test_format_1_changes(self):
+        payload = {'change': [{'kind': 'insert', 'schema': 'public', 'table': 'cows',
+                               'columnnames': ['id', 'tags', 'secret'], 'columnvalues': [1, '{a,"b c"}', 'moo']},
+                              {'kind': 'insert', 'schema': 'public', 'table': 'chickens',
+                               'columnnames': ['id'], 'columnvalues': [2]}]}
+        time_extracted = singer.utils.now()
+        records = list(logical_replication.consume_message_format_1(payload, self.conn_info, self.decoders, time_extracted, 10))
+
+        self.assertEqual(1, len(records))
+        self.assertEqual({'id': 1, 'tags': ['a', 'b c'], '_sdc_deleted_at': None}, records[0].record)
+        self.assertEqual(7, records[0].version)
+        #bookmarks only move at the end of a transaction, in sync_tables
+        self.assertEqual(1, self.state['bookmarks']['postgres-public-cows']['lsn'])
+
+    def test_format_2_delete(self):
+        payload = {'action': 'D', 'schema': 'public', 'table': 'cows', 'timestamp': '2019-01-02 03:04:05.123+00',
+                   'identity': [{'name': 'id', 'value': 3}]}
+        records = list(logical_replication.consume_message_format_2(payload, self.conn_info, self.decoders, singer.utils.now(), 11))
+
+        self.assertEqual({'id': 3, '_sdc_deleted_at': '2019-01-02T03:04:05.123000+00:00'}, records[0].record)
+
+class TestChangeValueConverter(unittest.TestCase):
+    def test_matches_selected_value_to_singer_value(self):
+        values = {'timestamp without time zone': ['2019-01-02 03:04:05.123'],
+                  'timestamp with time zone': ['2019-01-02 03:04:05.123+01', datetime.datetime(2019, 1, 2, tzinfo=datetime.timezone.utc)],
+                  'date': ['2019-01-02', datetime.date(2019, 1, 2)],
+                  'time with time zone': ['03:04:05+01'],
+                  'time without time zone': ['03:04:05'],
+                  'bit': ['1', '0', True],
+                  'boolean': [True, False],
+                  'numeric': [1, 1.5, '123456789012345678901234567890.5'],
+                  'integer': [1],
+                  'double precision': [1.5],
+                  'text': ['moo'],
+                  'hstore': ['"a"=>"b"'],
+                  'text[]': ['{a,"b c"}'],
+                  'mood': ['happy']}
+        for sql_datatype, elems in values.items():
+            convert = logical_replication.change_value_converter(sql_datatype, {})
+            for elem in elems + [None]:
+                self.assertEqual(logical_replication.selected_value_to_singer_value(elem, sql_datatype, {}), convert(elem),
+                                 (sql_datatype, elem))
+
+class TestCommitLsn(unittest.TestCase):
+    def setUp(self):
+        self.written = []
+        self.write_message, singer.write_message = singer.write_message, self.written.append
+        self.conn_info = {'dbname': 'postgres'}
+        self.state = {'bookmarks': {'postgres-public-cows': {'version': 7, 'lsn': 1}}}
+        self.decoders = {'postgres-public-cows': logical_replication.stream_decoder(cows_stream(), self.state, self.conn_info)}
+
+    def tearDown(self):
+        singer.write_message = self.write_message
+
+    def consume(self, payloads, message_format, session=None):
+        commit_lsns = []
+        for lsn, payload in enumerate(payloads, 100):
+            msg = ReplicationMessage(data_start=lsn, payload=json.dumps(payload).encode('utf-8'))
+            commit_lsns.append(logical_replication.consume_message(self.decoders, msg, singer.utils.now(), self.conn_info,
+                                                                   message_format=message_format, session=session))
+        return commit_lsns
+
+    def test_format_2(self):
+        insert = {'action': 'I', 'schema': 'public', 'table': 'cows', 'columns': [{'name': 'id', 'value': 1}]}
+        commit_lsns = self.consume([{'action': 'B'}, insert, insert, {'action': 'C'}], "2", wal2json.ActionStream())
+        self.assertEqual([None, None, None, 103], commit_lsns)
+        self.assertEqual(2, len(self.written))
+
+    def test_format_1_next_lsn(self):
+        #a transaction sent whole comes at its start, and ends at its nextlsn
+        insert = {'kind': 'insert', 'schema': 'public', 'table': 'cows', 'columnnames': ['id'], 'columnvalues': [1]}
+        commit_lsns = self.consume([{'xid': 1, 'nextlsn': '0/200', 'change': [insert]}], "1", wal2json.ChangeStream())
+        self.assertEqual([0x200], commit_lsns)
+
+    def test_bookmarks_only_advance(self):
+        streams = [cows_stream(), dict(cows_stream(), tap_stream_id='postgres-public-calves')]
+        state = {'bookmarks': {'postgres-public-cows': {'lsn': 5}, 'postgres-public-calves': {'lsn': 20}}}
+        state = logical_replication.write_commit_bookmarks(state, streams, 10)
+        self.assertEqual({'postgres-public-cows': {'lsn': 10}, 'postgres-public-calves': {'lsn': 20}}, state['bookmarks'])
+
+    def test_format_1_chunks(self):
+        insert = {'kind': 'insert', 'schema': 'public', 'table': 'cows', 'columnnames': ['id'], 'columnvalues': [1]}
+        session = wal2json.ChangeStream()
+        commit_lsns = []
+        for lsn, payload in enumerate(['{"xid":1,"change":[', json.dumps(insert), ']}', json.dumps({'xid': 2, 'change': [insert]})], 100):
+            msg = ReplicationMessage(data_start=lsn, payload=payload.encode('utf-8'))
+            commit_lsns.append(logical_replication.consume_message(self.decoders, msg, singer.utils.now(), self.conn_info,
+                                                                   message_format="1", session=session))
+        self.assertEqual([None, None, 102, 103], commit_lsns)
+        self.assertEqual(2, len(self.written))
+
+class TestAlreadyReplicated(unittest.TestCase):
+    def setUp(self):
+        self.written = []
+        self.write_message, singer.write_message = singer.write_message, self.written.append
+        self.conn_info = {'dbname': 'postgres'}
+        self.state = {'bookmarks': {'postgres-public-cows': {'version': 7, 'lsn': 0x200}}}
+        self.decoder = logical_replication.stream_decoder(cows_stream(), self.state, self.conn_info)
+
+    def tearDown(self):
+        singer.write_message = self.write_message
+
+    def consume(self, payloads, message_format, session):
+        for lsn, payload in enumerate(payloads, 100):
+            msg = ReplicationMessage(data_start=lsn, payload=json.dumps(payload).encode('utf-8'))
+            logical_replication.consume_message({'postgres-public-cows': self.decoder}, msg, singer.utils.now(), self.conn_info,
+                                                message_format=message_format, session=session)
+        return [m.record['id'] for m in self.written]
+
+    def test_format_1(self):
+        payloads = [{'xid': xid, 'nextlsn': next_lsn,
+                     'change': [{'kind': 'insert', 'schema': 'public', 'table': 'cows', 'columnnames': ['id'], 'columnvalues': [xid]}]}
+                    for xid, next_lsn in [(1, '0/180'), (2, '0/200'), (3, '0/280')]]
+        self.assertEqual([3], self.consume(payloads, "1", wal2json.ChangeStream()))
+        self.assertEqual({'insert': 2}, self.decoder.skipped)
+
+    def test_format_2(self):
+        payloads = []
+        for xid, next_lsn in [(1, '0/200'), (2, '0/201')]:
+            payloads.extend([{'action': 'B', 'nextlsn': next_lsn},
+                             {'action': 'D', 'schema': 'public', 'table': 'cows', 'timestamp': '2019-01-02 03:04:05+00',
+                              'identity': [{'name': 'id', 'value': xid}]},
+                             {'action': 'C'}])
+        self.assertEqual([2], self.consume(payloads, "2", wal2json.ActionStream()))
+        self.assertEqual({'D': 1}, self.decoder.skipped)
+
+    def test_without_lsns(self):
+        payload = {'xid': 1, 'change': [{'kind': 'insert', 'schema': 'public', 'table': 'cows', 'columnnames': ['id'], 'columnvalues': [1]}]}
+        self.assertEqual([1], self.consume([payload], "1", wal2json.ChangeStream()))
+
+class TestParseLsn(unittest.TestCase):
+    def test_parse_lsn(self):
+        self.assertEqual(0x16B374D848, logical_replication.parse_lsn('16/B374D848'))
+        self.assertEqual(0, logical_replication.parse_lsn('0/0'))
+        self.assertEqual('16/B374D848', logical_replication.format_lsn(0x16B374D848))
+
+class TestLaggingStreams(unittest.TestCase):
+    def setUp(self):
+        self.streams = []
+        for table_name in ['cows', 'chickens']:
+            stream = cows_stream()
+            stream['tap_stream_id'] = 'postgres-public-{}'.format(table_name)
+            self.streams.append(stream)
+        self.state = {'bookmarks': {'postgres-public-cows': {'lsn': 1, 'table_changes': 100},
+                                    'postgres-public-chickens': {'lsn': 1, 'table_changes': 500}}}
+
+    def lagging(self, conn_info, slot_lag, activity):
+        return [(s['tap_stream_id'], reason) for s, reason in
+                logical_replication.lagging_streams(conn_info, self.streams, self.state, slot_lag, activity)]
+
+    def test_slot_lag(self):
+        activity = {'postgres-public-cows': (8192, 100), 'postgres-public-chickens': (8192, 500)}
+        self.assertEqual([], self.lagging({'logical_max_slot_lag_bytes': 1000}, 1000, activity))
+        self.assertEqual(['postgres-public-cows', 'postgres-public-chickens'],
+                         [stream_id for stream_id, _ in self.lagging({'logical_max_slot_lag_bytes': 1000}, 1001, activity)])
+
+    def test_table_changes(self):
+        #the chickens' statistics were reset
+        activity = {'postgres-public-cows': (8192, 1101), 'postgres-public-chickens': (8192, 20)}
+        self.assertEqual([('postgres-public-cows', '1001 rows changed since the last run')],
+                         self.lagging({'logical_max_table_changes': 1000}, None, activity))
+        self.assertEqual(1101, self.state['bookmarks']['postgres-public-cows']['table_changes'])
+
+class TestWal2jsonOptions(unittest.TestCase):
+    def test_tables_of_the_streams(self):
+        dotted_stream = cows_stream()
+        dotted_stream['table_name'] = "cows.v2, 'new'"
+        options = logical_replication.wal2json_options({}, [cows_stream(), dotted_stream], "1")
+        self.assertEqual({'add-tables': "public.cows,public.cows\\.v2\\,\\ \\'new\\'", 'include-types': False, 'include-lsn': True, 'write-in-chunks': True}, options)
+
+    def test_config_overrides(self):
+        options = logical_replication.wal2json_options({'wal2json_options': {'include-types': True, 'include-lsn': True}}, [cows_stream()], "2")
+        self.assertEqual({'add-tables': 'public.cows', 'include-types': True, 'include-lsn': True,
+                          'format-version': 2, 'include-timestamp': True, 'include-transaction': True}, options)
+
+    def test_transactions_are_always_included(self):
+        options = logical_replication.wal2json_options({'wal2json_options': {'include-transaction': False}}, [cows_stream()], "2")
+        self.assertTrue(options['include-transaction'])
+
+class TestSyncDatabases(unittest.TestCase):
+    def setUp(self):
+        self.written = []
+        self.write_message, singer.write_message = singer.write_message, self.written.append
+        self.sync_tables = logical_replication.sync_tables
+        logical_replication.sync_tables = self.fake_sync_tables
+
+    def tearDown(self):
+        singer.write_message = self.write_message
+        logical_replication.sync_tables = self.sync_tables
+
+    @staticmethod
+    def fake_sync_tables(conn_info, logical_streams, state, _end_lsn):
+        for lsn in [1, 2]:
+            for s in logical_streams:
+                logical_replication.write_message(singer.RecordMessage(stream=conn_info['dbname'], record={'lsn': lsn}))
+                state['bookmarks'][s['tap_stream_id']]['lsn'] = lsn
+            logical_replication.write_message(singer.StateMessage(value=copy.deepcopy(state)))
+        return state
+
+    def test_states_are_merged(self):
+        databases = []
+        for dbname in ['cats', 'dogs']:
+            stream = cows_stream()
+            stream['tap_stream_id'] = '{}-public-cows'.format(dbname)
+            databases.append((dbname, [stream]))
+        state = {'bookmarks': {'cats-public-cows': {'version': 1, 'lsn': 0}, 'dogs-public-cows': {'version': 2, 'lsn': 0}}}
+
+        state = logical_replication.sync_databases({}, databases, state, 10, 2)
+
+        self.assertEqual({'cats-public-cows': {'version': 1, 'lsn': 2}, 'dogs-public-cows': {'version': 2, 'lsn': 2}}, state['bookmarks'])
+        for dbname in ['cats', 'dogs']:
+            self.assertEqual([1, 2], [m.record['lsn'] for m in self.written if isinstance(m, singer.RecordMessage) and m.stream == dbname])
+        #a database's bookmarks never go back when another database's state is written
+        lsns = [(m.value['bookmarks']['cats-public-cows']['lsn'], m.value['bookmarks']['dogs-public-cows']['lsn'])
+                for m in self.written if isinstance(m, singer.StateMessage)]
+        self.assertEqual(lsns, sorted(lsns))
+        self.assertEqual((2, 2), lsns[-1])
+
+class TestSyncLogicalDatabases(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.sync_databases = logical_replication.sync_databases
+        self.prepare_logical_streams = tap_postgres.prepare_logical_streams
+        logical_replication.sync_databases = lambda conn_info, databases, state, end_lsn, workers: self.calls.append(([d for d, _ in databases], workers))
+        tap_postgres.prepare_logical_streams = lambda conn_config, streams: streams
+
+    def tearDown(self):
+        logical_replication.sync_databases = self.sync_databases
+        tap_postgres.prepare_logical_streams = self.prepare_logical_streams
+
+    def test_streaming_replicates_every_database_at_once(self):
+        streams = []
+        for dbname in ['cats', 'dogs', 'pigs']:
+            stream = cows_stream()
+            stream['metadata'] = metadata.to_list({(): {'database-name': dbname, 'schema-name': 'public'}})
+            streams.append(stream)
+
+        tap_postgres.sync_logical_databases({'logical_streaming': True}, streams, {}, None)
+        self.assertEqual([(['cats', 'dogs', 'pigs'], 3)], self.calls)
+
+class TestStopOnSignals(unittest.TestCase):
+    def test_sigterm_stops_streaming(self):
+        handler = signal.getsignal(signal.SIGTERM)
+        try:
+            logical_replication.stop_on_signals()
+            os.kill(os.getpid(), signal.SIGTERM)
+            self.assertTrue(logical_replication.STOP.is_set())
+        finally:
+            signal.signal(signal.SIGTERM, handler)
+            logical_replication.STOP.clear()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import tap_postgres
+import tap_postgres.sync_strategies.common as pg_common
+import tap_postgres.sync_strategies.incremental as incremental
+import singer
+from singer import get_logger, metadata
+
+from utils import ensure_db, get_test_connection, select_all_of_stream, set_replication_method_for_stream, get_test_connection_config
+
+LOGGER = get_logger()
+
+CAUGHT_MESSAGES = []
+
+def singer_write_message(message):
+    CAUGHT_MESSAGES.append(message)
+
+def do_not_dump_catalog(catalog):
+    pass
+
+tap_postgres.dump_catalog = do_not_dump_catalog
+
+def update_stream_metadata(stream, **kwargs):
+    new_md = metadata.to_map(stream['metadata'])
+    new_md.get(()).update(kwargs)
+    stream['metadata'] = metadata.to_list(new_md)
+    return stream
+
+class PartitionedSync(unittest.TestCase):
+    maxDiff = None
+
+    def setUp(self):
+        ensure_db()
+        with get_test_connection() as conn:
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute('DROP TABLE IF EXISTS "HERD"')
+            cur.execute('CREATE TABLE "HERD" (id integer, updated_at integer, PRIMARY KEY (id, updated_at)) PARTITION BY RANGE (updated_at)')
+            cur.execute('CREATE TABLE "HERD_1" PARTITION OF "HERD" FOR VALUES FROM (0) TO (100)')
+            cur.execute('CREATE TABLE "HERD_2" PARTITION OF "HERD" FOR VALUES FROM (100) TO (200) PARTITION BY RANGE (updated_at)')
+            cur.execute('CREATE TABLE "HERD_2a" PARTITION OF "HERD_2" FOR VALUES FROM (100) TO (150)')
+            cur.execute('CREATE TABLE "HERD_2b" PARTITION OF "HERD_2" FOR VALUES FROM (150) TO (200)')
+            cur.execute('INSERT INTO "HERD" SELECT i, i FROM generate_series(0, 199) AS i')
+
+        CAUGHT_MESSAGES.clear()
+        singer.write_message = singer_write_message
+        pg_common.write_schema_message = singer_write_message
+
+    def herd_stream(self):
+        streams = tap_postgres.do_discovery(get_test_connection_config())
+        herd_stream = [s for s in streams if s['table_name'] == 'HERD'][0]
+        return select_all_of_stream(herd_stream)
+
+    def test_leaf_partitions(self):
+        self.assertEqual([['public', 'HERD_1'], ['public', 'HERD_2a'], ['public', 'HERD_2b']],
+                         pg_common.leaf_partitions(get_test_connection_config(), 'public', 'HERD'))
+        self.assertEqual([], pg_common.leaf_partitions(get_test_connection_config(), 'public', 'HERD_1'))
+
+    def test_full_table_resume_skips_finished_partitions(self):
+        herd_stream = set_replication_method_for_stream(self.herd_stream(), 'FULL_TABLE')
+        herd_stream = update_stream_metadata(herd_stream, **{'full-table-strategy': 'partition', 'full-table-workers': 2})
+
+        state = {'bookmarks': {'postgres-public-HERD': {'version': 1, 'last_replication_method': 'FULL_TABLE',
+                                                        'pending_partitions': [['public', 'HERD_2b']]}}}
+        tap_postgres.do_sync(get_test_connection_config(), {'streams' : [herd_stream]}, None, state)
+
+        ids = sorted(m.record['id'] for m in CAUGHT_MESSAGES if isinstance(m, singer.RecordMessage))
+        self.assertEqual(list(range(150, 200)), ids)
+        self.assertEqual({1}, {m.version for m in CAUGHT_MESSAGES if isinstance(m, singer.RecordMessage)})
+        self.assertIsNone(CAUGHT_MESSAGES[-1].value['bookmarks']['postgres-public-HERD']['pending_partitions'])
+
+    def test_incremental_skips_partitions_below_bookmark(self):
+        partitions = pg_common.leaf_partitions(get_test_connection_config(), 'public', 'HERD')
+        self.assertEqual([['public', 'HERD_2b']],
+                         incremental.partitions_to_read(get_test_connection_config(), 'public', 'HERD', 'updated_at', 160, 'integer', partitions))
+
+        herd_stream = set_replication_method_for_stream(self.herd_stream(), 'INCREMENTAL')
+        herd_stream = update_stream_metadata(herd_stream, **{'replication-key': 'updated_at', 'incremental-strategy': 'partition'})
+        state = {'bookmarks': {'postgres-public-HERD': {'version': 1, 'last_replication_method': 'INCREMENTAL',
+                                                        'replication_key': 'updated_at', 'replication_key_value': 120}}}
+        tap_postgres.do_sync(get_test_connection_config(), {'streams' : [herd_stream]}, None, state)
+
+        ids = [m.record['id'] for m in CAUGHT_MESSAGES if isinstance(m, singer.RecordMessage)]
+        self.assertEqual(list(range(120, 200)), ids)
+        self.assertEqual(199, state['bookmarks']['postgres-public-HERD']['replication_key_value'])
+        self.assertIsNone(state['bookmarks']['postgres-public-HERD']['finished_partitions'])
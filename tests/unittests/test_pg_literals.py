@@ -0,0 +1,155 @@
+import datetime
+import random
+import unittest
+from dateutil.parser import parse
+import tap_postgres.sync_strategies.logical_replication as logical_replication
+import tap_postgres.sync_strategies.pg_literals as pg_literals
+
+from utils import get_test_connection
+
+SEED = 20190425
+CASES = 300
+
+TEXT_PIECES = ['a', 'B', ' ', '\t', '\n', '{', '}', ',', '"', '\\', '=>', '=', '>', "'", 'NULL', 'null', 'ü', '日本', '$stitch_quote$']
+
+def random_text(rnd):
+    return ''.join(rnd.choice(TEXT_PIECES) for _ in range(rnd.randint(0, 5)))
+
+ELEMENTS = {'text[]': random_text,
+            'character varying[]': random_text,
+            'integer[]': lambda rnd: rnd.randint(-2 ** 31, 2 ** 31 - 1),
+            'smallint[]': lambda rnd: rnd.randint(-2 ** 15, 2 ** 15 - 1),
+            'bigint[]': lambda rnd: rnd.randint(-2 ** 63, 2 ** 63 - 1),
+            'double precision[]': lambda rnd: rnd.choice([rnd.uniform(-1e300, 1e300), rnd.uniform(-1, 1), float('inf'), float('-inf')]),
+            'real[]': lambda rnd: rnd.choice([0.5, -1.25, 1e30, float('inf')]),
+            'boolean[]': lambda rnd: rnd.choice([True, False]),
+            'bit[]': lambda rnd: rnd.choice(['1', '0'])}
+
+def random_array(rnd, element):
+    #rectangular, as postgres requires of multidimensional arrays
+    dimensions = [rnd.randint(1, 3) for _ in range(rnd.randint(1, 3))]
+    def build(depth):
+        if depth == len(dimensions):
+            return None if rnd.random() < 0.1 else element(rnd)
+        return [build(depth + 1) for _ in range(dimensions[depth])]
+    return build(0)
+
+def array_literal(value):
+    """The text representation postgres gives value."""
+    if isinstance(value, list):
+        return '{' + ','.join(array_literal(v) for v in value) + '}'
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    text = str(value) if not isinstance(value, float) else repr(value).replace('inf', 'Infinity')
+    if text == '' or text.upper() == 'NULL' or any(c in text for c in '{},"\\ \t\n'):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return text
+
+def bits_to_bools(value):
+    if isinstance(value, list):
+        return [bits_to_bools(v) for v in value]
+    return None if value is None else value == '1'
+
+def hstore_literal(value):
+    quote = lambda text: '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return ', '.join('{}=>{}'.format(quote(k), 'NULL' if v is None else quote(v)) for k, v in value.items())
+
+def random_hstore(rnd):
+    return {random_text(rnd): None if rnd.random() < 0.2 else random_text(rnd) for _ in range(rnd.randint(0, 4))}
+
+class TestArrayLiterals(unittest.TestCase):
+    def test_examples(self):
+        self.assertEqual([['1', None], ['a "b"', 'c']], pg_literals.parse_array('{{1,NULL},{"a \\"b\\"",c}}'))
+        self.assertEqual(['a b', '', None, 'NULL', 'NULL'], pg_literals.parse_array('{ a b , "" ,null, "NULL",\\NULL}'))
+        self.assertEqual([[], []], pg_literals.parse_array('{{},{}}'))
+        self.assertEqual([1, 2], pg_literals.parse_array('[0:1]={1,2}', int))
+        self.assertEqual([True, False, None], pg_literals.parse_array('{1,0,NULL}', pg_literals.array_element_cast('bit[]')))
+
+    def test_malformed(self):
+        for text in ['', '1,2', '{1,2', '{1}}', '{"a}', '{1} x']:
+            with self.assertRaises(ValueError, msg=text):
+                pg_literals.parse_array(text)
+
+    def test_random_arrays_round_trip(self):
+        rnd = random.Random(SEED)
+        for _ in range(CASES):
+            sql_datatype = rnd.choice(sorted(ELEMENTS))
+            value = random_array(rnd, ELEMENTS[sql_datatype])
+            cast = pg_literals.array_element_cast(sql_datatype)
+            expected = value
+            if sql_datatype == 'bit[]':
+                expected = bits_to_bools(value)
+            self.assertEqual(expected, pg_literals.parse_array(array_literal(value), cast), msg=array_literal(value))
+
+class TestHstoreLiterals(unittest.TestCase):
+    def test_examples(self):
+        self.assertEqual({'a': '1', 'b': None, 'c': 'd', 'e"q': 'x\\y'},
+                         pg_literals.parse_hstore('"a"=>"1", "b"=>NULL, c=>d,"e\\"q"=>"x\\\\y"'))
+        self.assertEqual({}, pg_literals.parse_hstore(''))
+        self.assertEqual({'nickname': "Dave's Courtyard"}, logical_replication.create_hstore_elem(None, '"nickname"=>"Dave\'s Courtyard"'))
+
+    def test_random_hstores_round_trip(self):
+        rnd = random.Random(SEED)
+        for _ in range(CASES):
+            value = random_hstore(rnd)
+            self.assertEqual(value, pg_literals.parse_hstore(hstore_literal(value)), msg=hstore_literal(value))
+
+class TestDatetimeLiterals(unittest.TestCase):
+    def test_matches_dateutil(self):
+        for text in ['2019-01-02 03:04:05', '2019-01-02 03:04:05.04', '2019-01-02 03:04:05.123456-05', '2019-01-02 03:04:05+05:30',
+                     '2019-01-02T03:04:05.123000Z', '2019-01-02', '0099-12-31']:
+            self.assertEqual(parse(text), pg_literals.parse_timestamp(text), msg=text)
+        for text in ['12:00:00+05:30', '12:00:00.5-03', '23:59:59.999999+00']:
+            self.assertEqual(parse(text).timetz(), pg_literals.parse_time(text), msg=text)
+
+    def test_beyond_dateutil(self):
+        self.assertEqual(datetime.datetime.max, pg_literals.parse_timestamp('infinity'))
+        self.assertEqual(datetime.datetime.min, pg_literals.parse_timestamp('-infinity'))
+        self.assertEqual(datetime.datetime.min, pg_literals.parse_timestamp('0044-03-15 12:00:00+00:53:28 BC'))
+        self.assertEqual(datetime.datetime.max, pg_literals.parse_timestamp('12019-01-01'))
+        self.assertEqual('1900-01-01T00:00:00-00:53:28', pg_literals.parse_timestamp('1900-01-01 00:00:00-00:53:28').isoformat())
+
+    def test_unexpected_formats(self):
+        self.assertIsNone(pg_literals.parse_timestamp('Jan 2 2019'))
+        self.assertIsNone(pg_literals.parse_timestamp('2019-02-30'))
+        self.assertIsNone(pg_literals.parse_time('24:00:00+00'))
+        self.assertEqual('2019-01-02T00:00:00+00:00', logical_replication.selected_value_to_singer_value('Jan 2 2019', 'date', None))
+
+class TestLiteralsMatchServer(unittest.TestCase):
+    """The parsers against the text postgres hands logical replication and the values
+    its casts used to produce."""
+    def setUp(self):
+        with get_test_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(""" SELECT installed_version FROM pg_available_extensions WHERE name = 'hstore' """)
+                if cur.fetchone()[0] is None:
+                    cur.execute(""" CREATE EXTENSION hstore; """)
+
+    def test_random_arrays(self):
+        rnd = random.Random(SEED)
+        with get_test_connection() as conn:
+            with conn.cursor() as cur:
+                for _ in range(CASES):
+                    sql_datatype = rnd.choice(sorted(ELEMENTS))
+                    literal = array_literal(random_array(rnd, ELEMENTS[sql_datatype]))
+                    cur.execute('SELECT %s::{}::text'.format(sql_datatype), (literal,))
+                    text = cur.fetchone()[0]
+                    cast_datatype = 'boolean[]' if sql_datatype == 'bit[]' else sql_datatype
+                    cur.execute('SELECT %s::{}'.format(cast_datatype), (text,))
+                    self.assertEqual(cur.fetchone()[0], logical_replication.create_array_elem(text, sql_datatype, None), msg=text)
+
+    def test_random_hstores(self):
+        rnd = random.Random(SEED)
+        with get_test_connection() as conn:
+            with conn.cursor() as cur:
+                for _ in range(CASES):
+                    cur.execute('SELECT %s::hstore::text', (hstore_literal(random_hstore(rnd)),))
+                    text = cur.fetchone()[0]
+                    cur.execute(logical_replication.create_hstore_elem_query(text))
+                    pairs = cur.fetchone()[0]
+                    self.assertEqual(dict(zip(pairs[::2], pairs[1::2])), logical_replication.create_hstore_elem(None, text), msg=text)
+
+if __name__ == "__main__":
+    unittest.main()
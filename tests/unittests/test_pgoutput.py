@@ -0,0 +1,218 @@
+import datetime
+import struct
+import unittest
+import singer
+import tap_postgres.sync_strategies.logical_replication as logical_replication
+import tap_postgres.sync_strategies.pgoutput as pgoutput
+
+from test_logical_decoder import cows_stream
+
+#pgoutput messages, as the server sends them
+#https://www.postgresql.org/docs/current/protocol-logicalrep-message-formats.html
+UNCHANGED_TOAST = object()
+COWS_OID = 16385
+CHICKENS_OID = 16390
+INT4_OID = 23
+TEXT_OID = 25
+TEXT_ARRAY_OID = 1009
+BOOL_OID = 16
+
+COMMIT_TS = 600000000000000
+COMMIT_TIME = datetime.datetime(2019, 1, 5, 10, 40, tzinfo=datetime.timezone.utc)
+
+def _string(value):
+    return value.encode('utf-8') + b'\x00'
+
+def _xid(xid):
+    return b'' if xid is None else struct.pack('>i', xid)
+
+def _tuple_data(values):
+    data = struct.pack('>h', len(values))
+    for value in values:
+        if value is None:
+            data += b'n'
+        elif value is UNCHANGED_TOAST:
+            data += b'u'
+        else:
+            text = value.encode('utf-8')
+            data += b't' + struct.pack('>i', len(text)) + text
+    return data
+
+def begin(xid=1):
+    return b'B' + struct.pack('>qqi', 1000, COMMIT_TS, xid)
+
+def commit():
+    return b'C' + struct.pack('>bqqq', 0, 1000, 1010, COMMIT_TS)
+
+def relation(oid, table, columns, xid=None):
+    data = b'R' + _xid(xid) + struct.pack('>i', oid) + _string('public') + _string(table) + b'd' + struct.pack('>h', len(columns))
+    for name, type_oid, key in columns:
+        data += struct.pack('>b', 1 if key else 0) + _string(name) + struct.pack('>ii', type_oid, -1)
+    return data
+
+def insert(oid, values, xid=None):
+    return b'I' + _xid(xid) + struct.pack('>i', oid) + b'N' + _tuple_data(values)
+
+def update(oid, values, old_values=None, xid=None):
+    old = b'' if old_values is None else b'O' + _tuple_data(old_values)
+    return b'U' + _xid(xid) + struct.pack('>i', oid) + old + b'N' + _tuple_data(values)
+
+def delete(oid, values, xid=None):
+    return b'D' + _xid(xid) + struct.pack('>i', oid) + b'K' + _tuple_data(values)
+
+def stream_start(xid):
+    return b'S' + struct.pack('>ib', xid, 1)
+
+def stream_stop():
+    return b'E'
+
+def stream_commit(xid):
+    return b'c' + struct.pack('>ibqqq', xid, 0, 2000, 2010, COMMIT_TS)
+
+def stream_abort(xid, subxid):
+    return b'A' + struct.pack('>ii', xid, subxid)
+
+COWS = [('id', INT4_OID, True), ('tags', TEXT_ARRAY_OID, False), ('secret', TEXT_OID, False)]
+CHICKENS = [('id', INT4_OID, True), ('alive', BOOL_OID, False)]
+
+class TestPgoutputSession(unittest.TestCase):
+    def decode(self, session, messages):
+        changes = []
+        for message in messages:
+            changes.extend(session.decode(message))
+        return [(c.kind, c.table, c.values) for c in changes]
+
+    def test_transaction(self):
+        session = pgoutput.Session()
+        changes = self.decode(session, [begin(),
+                                        relation(COWS_OID, 'cows', COWS),
+                                        relation(CHICKENS_OID, 'chickens', CHICKENS),
+                                        insert(CHICKENS_OID, ['1', 't']),
+                                        update(COWS_OID, ['2', UNCHANGED_TOAST, None]),
+                                        update(COWS_OID, ['3', '{a}', 'moo'], old_values=['2', '{a}', None]),
+                                        delete(COWS_OID, ['3', None, None]),
+                                        commit()])
+
+        self.assertEqual([('insert', 'chickens', [('id', 1), ('alive', True)]),
+                          ('update', 'cows', [('id', 2), ('secret', None)]),
+                          ('update', 'cows', [('id', 3), ('tags', '{a}'), ('secret', 'moo')]),
+                          ('delete', 'cows', [('id', 3)])], changes)
+
+        session.decode(begin())
+        self.assertEqual(COMMIT_TIME, session.commit_ts)
+
+    def test_streamed_transactions(self):
+        pgoutput.STREAM_SPOOL_BYTES, spool_bytes = 10, pgoutput.STREAM_SPOOL_BYTES
+        try:
+            session = pgoutput.Session()
+            messages = [stream_start(7),
+                        relation(COWS_OID, 'cows', COWS, xid=7),
+                        insert(COWS_OID, ['1', None, None], xid=7),
+                        insert(COWS_OID, ['2', None, None], xid=8),
+                        stream_stop(),
+                        #transactions committing in between come through as they commit
+                        begin(),
+                        relation(COWS_OID, 'cows', COWS),
+                        insert(COWS_OID, ['100', None, None]),
+                        commit(),
+                        stream_start(9),
+                        insert(COWS_OID, ['900', None, None], xid=9),
+                        stream_stop(),
+                        stream_start(7),
+                        insert(COWS_OID, ['3', None, None], xid=7),
+                        stream_stop(),
+                        stream_abort(7, 8),
+                        stream_abort(9, 9)]
+            self.assertEqual([('insert', 'cows', [('id', 100), ('tags', None), ('secret', None)])], self.decode(session, messages))
+
+            changes = list(session.decode(stream_commit(7)))
+            self.assertEqual([[('id', 1), ('tags', None), ('secret', None)], [('id', 3), ('tags', None), ('secret', None)]],
+                             [c.values for c in changes])
+            self.assertEqual({COMMIT_TIME}, {c.commit_ts for c in changes})
+            self.assertEqual({}, session.streamed)
+        finally:
+            pgoutput.STREAM_SPOOL_BYTES = spool_bytes
+
+    def test_streamed_relations(self):
+        session = pgoutput.Session()
+        renamed = [('id', INT4_OID, True), ('name', TEXT_OID, False)]
+        messages = [begin(),
+                    relation(COWS_OID, 'cows', COWS),
+                    commit(),
+                    #the relation changes within a transaction that aborts
+                    stream_start(8),
+                    relation(COWS_OID, 'cows', renamed, xid=8),
+                    insert(COWS_OID, ['7', 'daisy'], xid=8),
+                    stream_stop(),
+                    #and within one that commits, after a change sent under the old relation
+                    stream_start(9),
+                    insert(COWS_OID, ['1', None, 'moo'], xid=9),
+                    relation(COWS_OID, 'cows', renamed, xid=9),
+                    insert(COWS_OID, ['2', 'bella'], xid=9),
+                    stream_stop(),
+                    begin(),
+                    insert(COWS_OID, ['3', None, 'baa']),
+                    commit(),
+                    stream_abort(8, 8)]
+        self.assertEqual([('insert', 'cows', [('id', 3), ('tags', None), ('secret', 'baa')])], self.decode(session, messages))
+
+        self.assertEqual([('insert', 'cows', [('id', 1), ('tags', None), ('secret', 'moo')]),
+                          ('insert', 'cows', [('id', 2), ('name', 'bella')])],
+                         self.decode(session, [stream_commit(9)]))
+        self.assertEqual([('insert', 'cows', [('id', 4), ('name', 'clara')])],
+                         self.decode(session, [begin(), insert(COWS_OID, ['4', 'clara']), commit()]))
+
+class TestPgoutputReplay(unittest.TestCase):
+    def replay(self, messages, bookmark_lsn=1):
+        """Feeds captured pgoutput messages through the consumer, as sync_tables would."""
+        conn_info = {'dbname': 'postgres'}
+        state = {'bookmarks': {'postgres-public-cows': {'version': 7, 'lsn': bookmark_lsn}}}
+        decoders = {'postgres-public-cows': logical_replication.stream_decoder(cows_stream(), state, conn_info)}
+        session = pgoutput.Session()
+        records = []
+        for lsn, message in enumerate(messages, 100):
+            records.extend(logical_replication.consume_message_pgoutput(session, message, conn_info, decoders, singer.utils.now(), lsn))
+        return records, state
+
+    def test_records(self):
+        records, state = self.replay([begin(),
+                                      relation(COWS_OID, 'cows', COWS),
+                                      relation(CHICKENS_OID, 'chickens', CHICKENS),
+                                      insert(COWS_OID, ['1', '{a,"b c"}', 'moo']),
+                                      insert(CHICKENS_OID, ['1', 'f']),
+                                      delete(COWS_OID, ['1', None, None]),
+                                      commit()])
+
+        self.assertEqual([{'id': 1, 'tags': ['a', 'b c'], '_sdc_deleted_at': None},
+                          {'id': 1, '_sdc_deleted_at': '2019-01-05T10:40:00+00:00'}],
+                         [r.record for r in records])
+        self.assertEqual({'cows'}, {r.stream for r in records})
+        self.assertEqual(1, state['bookmarks']['postgres-public-cows']['lsn'])
+
+    def test_already_replicated(self):
+        #the transactions of begin() have their commit record at 1000
+        messages = [begin(), relation(COWS_OID, 'cows', COWS), insert(COWS_OID, ['1', None, None]), commit()]
+        self.assertEqual([], self.replay(messages, bookmark_lsn=1010)[0])
+        self.assertEqual(1, len(self.replay(messages, bookmark_lsn=1000)[0]))
+
+    def test_commit_lsn(self):
+        session = pgoutput.Session()
+        commit_lsns = []
+        for message in [begin(), relation(COWS_OID, 'cows', COWS), insert(COWS_OID, ['1', None, None]), commit(),
+                        stream_start(7), insert(COWS_OID, ['2', None, None], xid=7), stream_stop(), stream_commit(7)]:
+            list(session.decode(message))
+            commit_lsns.append(session.commit_lsn)
+        self.assertEqual([None, None, None, 1010, None, None, None, 2010], commit_lsns)
+
+    def test_in_transaction(self):
+        session = pgoutput.Session()
+        in_transaction = []
+        for message in [begin(), relation(COWS_OID, 'cows', COWS), insert(COWS_OID, ['1', None, None]), commit(),
+                        stream_start(7), insert(COWS_OID, ['2', None, None], xid=7), stream_stop(), stream_commit(7)]:
+            list(session.decode(message))
+            in_transaction.append(session.in_transaction)
+        #blocks of streamed changes are not a transaction a run has to finish
+        self.assertEqual([True, True, True, False, False, False, False, False], in_transaction)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import singer.metrics as metrics
+import tap_postgres.sync_strategies.replication_metrics as replication_metrics
+
+class TestReplicationMetrics(unittest.TestCase):
+    def test_points(self):
+        replication = replication_metrics.ReplicationMetrics('stitch_postgres')
+        for stream in ['cows', 'cows', 'chickens']:
+            replication.message(0.5)
+            replication.record(stream, 0.25)
+        replication.message(0.5)
+
+        points = {(p.metric, p.tags.get('endpoint') or p.tags.get('behind')): p for p in replication.points(2.0, 1000, 5096, 9192)}
+
+        self.assertEqual(4, points[('replication_messages', None)].value)
+        self.assertEqual(3, points[('record_count', None)].value)
+        self.assertEqual(2, points[('record_count', 'cows')].value)
+        self.assertEqual(1, points[('record_count', 'chickens')].value)
+        self.assertEqual(2.0, points[('replication_messages_per_second', None)].value)
+        self.assertEqual(1.5, points[('replication_records_per_second', None)].value)
+        self.assertEqual(1.25, points[('replication_decode_duration', None)].value)
+        self.assertEqual(0.75, points[('replication_write_duration', None)].value)
+        self.assertEqual(4096, points[('replication_lag_bytes', 'end_lsn')].value)
+        self.assertEqual(8192, points[('replication_lag_bytes', 'wal_end')].value)
+        self.assertEqual('stitch_postgres', points[('replication_messages', None)].tags['slot'])
+
+    def test_log_lines_parse(self):
+        replication = replication_metrics.ReplicationMetrics('stitch_postgres')
+        replication.record('cows', 0.1)
+        with self.assertLogs(replication_metrics.LOGGER, level='INFO') as logs:
+            replication.log(None, None, None, now=replication.started + 1)
+
+        points = [metrics.parse(line.replace('INFO:{}:'.format(replication_metrics.LOGGER.name), 'INFO ', 1)) for line in logs.output]
+        self.assertIn(metrics.Point('counter', 'record_count', 1, {'slot': 'stitch_postgres', 'endpoint': 'cows'}), points)
+        self.assertEqual(0, replication.messages)
+
+if __name__ == "__main__":
+    unittest.main()
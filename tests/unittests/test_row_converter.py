@@ -0,0 +1,44 @@
+import datetime
+import decimal
+import unittest
+import pytz
+import tap_postgres.db as post_db
+
+VALUES_BY_DATATYPE = {
+    'integer': [1, -5, None],
+    'bigint': [2 ** 62],
+    'boolean': [True, False],
+    'money': ['$1.00'],
+    'character varying': ['x', ''],
+    'bit': ['1', '0'],
+    'numeric': [decimal.Decimal('1.10'), decimal.Decimal('NaN')],
+    'double precision': [1.5, float('nan'), float('inf'), float('-inf')],
+    'real': [0.25],
+    'timestamp without time zone': [datetime.datetime(1997, 2, 2, 2, 2, 2, 722184), datetime.datetime(2000, 1, 1)],
+    'timestamp with time zone': [pytz.timezone('America/New_York').localize(datetime.datetime(1997, 2, 2, 2, 2, 2))],
+    'date': [datetime.date(1998, 3, 4)],
+    'time without time zone': [datetime.time(12, 11, 10), datetime.time(1, 2, 3, 4)],
+    'hstore': [{'size': 'small', 'name': None}],
+    'alignment': ['good'],
+    'integer[]': [[1, 2, None], [[1, 2], [3, None]], [], None],
+    'timestamp without time zone[]': [[datetime.datetime(2000, 1, 1, 1), None], [[[datetime.datetime(2001, 1, 1)]]]],
+    'numeric[]': [[decimal.Decimal('NaN'), decimal.Decimal('2')]],
+    'bit[]': [['1', '0']],
+}
+
+class TestRowConverter(unittest.TestCase):
+    def test_values_match_selected_value_to_singer_value(self):
+        for sql_datatype, values in VALUES_BY_DATATYPE.items():
+            convert = post_db.value_converter(sql_datatype) or (lambda elem: elem)
+            for value in values + [None]:
+                self.assertEqual(post_db.selected_value_to_singer_value(value, sql_datatype), convert(value),
+                                 msg='{} {!r}'.format(sql_datatype, value))
+
+    def test_row(self):
+        md_map = {('properties', 'id'): {'sql-datatype': 'integer'},
+                  ('properties', 'ts'): {'sql-datatype': 'timestamp without time zone'},
+                  ('properties', 'tags'): {'sql-datatype': 'text[]'}}
+        convert_row = post_db.row_converter(['id', 'ts', 'tags'], md_map)
+        self.assertEqual({'id': 1, 'ts': '2000-01-01T00:00:00+00:00', 'tags': ['a', ['b']]},
+                         convert_row((1, datetime.datetime(2000, 1, 1), ['a', ['b']])))
+        self.assertEqual({'id': None, 'ts': None, 'tags': []}, convert_row((None, None, None)))
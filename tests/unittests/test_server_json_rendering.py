@@ -0,0 +1,152 @@
+import io
+import sys
+import unittest
+import psycopg2.extras
+import simplejson as json
+import singer
+from singer import get_logger, metadata
+import tap_postgres
+import tap_postgres.db as post_db
+import tap_postgres.sync_strategies.server_json as server_json
+
+from utils import ensure_db, get_test_connection, get_test_connection_config
+
+LOGGER = get_logger()
+
+def do_not_dump_catalog(catalog):
+    pass
+
+tap_postgres.dump_catalog = do_not_dump_catalog
+
+def literal(text):
+    return ('literal', text)
+
+def serialized(line):
+    #numbers and constants are compared as they are written, e.g. 100000 is not 100000.0,
+    #while members and strings may be ordered and escaped differently
+    return json.loads(line, parse_float=literal, parse_int=literal, parse_constant=literal)
+
+TABLE_NAME = 'CHICKEN TIMES'
+
+#every column type of tests/test_postgres_full_table_replication.py
+CREATE_TABLE_SQL = """CREATE TABLE "{}" (id            SERIAL PRIMARY KEY,
+                                         our_varchar    VARCHAR,
+                                         our_varchar_10 VARCHAR(10),
+                                         our_text       TEXT,
+                                         our_integer    INTEGER,
+                                         our_smallint   SMALLINT,
+                                         our_bigint     BIGINT,
+                                         our_decimal    NUMERIC(12,2),
+                                         "OUR TS"       TIMESTAMP WITHOUT TIME ZONE,
+                                         "OUR TS TZ"    TIMESTAMP WITH TIME ZONE,
+                                         "OUR TIME"     TIME WITHOUT TIME ZONE,
+                                         "OUR TIME TZ"  TIME WITH TIME ZONE,
+                                         "OUR DATE"     DATE,
+                                         our_double     DOUBLE PRECISION,
+                                         our_real       REAL,
+                                         our_boolean    BOOLEAN,
+                                         our_bit        BIT(1),
+                                         our_json       JSON,
+                                         our_jsonb      JSONB,
+                                         our_uuid       UUID,
+                                         our_store      HSTORE,
+                                         our_citext     CITEXT,
+                                         our_inet       inet,
+                                         our_cidr       cidr,
+                                         our_mac        macaddr,
+                                         our_alignment_enum ALIGNMENT,
+                                         our_money          money,
+                                         our_int_array      INTEGER[],
+                                         our_numeric        NUMERIC)""".format(TABLE_NAME)
+
+ROWS = ["""('our_varchar', 'varchar_10', 'some "text" \\ here', 44100, 1, 1000000, .01,
+            '1997-02-02 02:02:02.722184', '1997-02-02 02:02:02.722184-05', '12:11:10', '12:11:10.5-04:00', '1998-03-04',
+            1.1, 1.1, true, B'1', '{"secret": 55}', '{"burgers": "good"}', '97b6e7a6-2b50-4b7e-9a3b-5e6c1ba4a0c1',
+            'size=>small,name=>NULL', 'maGICKal', '192.168.100.128/25', '192.168.100.128/25', '08:00:2b:01:02:03',
+            'bad', '$1,445.5678', '{1,2,3}', 0.0000001230)""",
+        """('ünïcode', '', '', -2147483648, -32768, -9223372036854775808, 'NaN',
+            '2000-01-01 00:00:00', '2000-01-01 00:00:00+00', '00:00:00', '23:59:59.999999+05:30', '0999-12-31',
+            'NaN', 'Infinity', false, B'0', '[]', '{}', '00000000-0000-0000-0000-000000000000',
+            '', 'CITEXT', '::1', '::/0', '00:00:00:00:00:00',
+            'good', '-$0.01', '{}', 0.00000000)""",
+        """('x', 'y', 'z', 0, 0, 0, 123456789.12,
+            'infinity', '-infinity', '23:59:59', '01:02:03-00:30', 'infinity',
+            1e300, -1.5e-30, true, B'1', 'null', '[1, "2", {"3": null}]', 'ffffffff-ffff-ffff-ffff-ffffffffffff',
+            'a=>"b c"', 'x', '10.0.0.1', '10.0.0.0/8', 'ff:ff:ff:ff:ff:ff',
+            'ugly', '$0.00', '{NULL,4}', -12345678901234567890.5)""",
+        """(NULL, NULL, NULL, 7, NULL, NULL, 100000,
+            NULL, NULL, NULL, NULL, NULL,
+            100000, 1.5e15, NULL, NULL, NULL, NULL, NULL,
+            NULL, NULL, NULL, NULL, NULL,
+            NULL, NULL, NULL, 0.000001)""",
+        """(NULL, NULL, NULL, NULL, NULL, NULL, -0.5,
+            NULL, NULL, NULL, NULL, NULL,
+            1234567890123456.5, '-0', NULL, NULL, NULL, NULL, NULL,
+            NULL, NULL, NULL, NULL, NULL,
+            NULL, NULL, NULL, 1e20)""",
+        """(NULL, NULL, NULL, NULL, NULL, NULL, NULL,
+            NULL, NULL, NULL, NULL, NULL,
+            NULL, NULL, NULL, NULL, NULL, NULL, NULL,
+            NULL, NULL, NULL, NULL, NULL,
+            NULL, NULL, NULL, NULL)"""]
+
+class TestServerJsonRendering(unittest.TestCase):
+    maxDiff = None
+
+    def setUp(self):
+        ensure_db()
+        with get_test_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(""" SELECT installed_version FROM pg_available_extensions WHERE name = 'hstore' """)
+            if cur.fetchone()[0] is None:
+                cur.execute(""" CREATE EXTENSION hstore; """)
+            cur.execute(""" CREATE EXTENSION IF NOT EXISTS citext WITH SCHEMA public;""")
+            cur.execute('DROP TABLE IF EXISTS "{}"'.format(TABLE_NAME))
+            cur.execute(""" DROP TYPE IF EXISTS ALIGNMENT CASCADE """)
+            cur.execute(""" CREATE TYPE ALIGNMENT AS ENUM ('good', 'bad', 'ugly') """)
+            cur.execute(CREATE_TABLE_SQL)
+            columns = ['our_varchar', 'our_varchar_10', 'our_text', 'our_integer', 'our_smallint', 'our_bigint', 'our_decimal',
+                       '"OUR TS"', '"OUR TS TZ"', '"OUR TIME"', '"OUR TIME TZ"', '"OUR DATE"',
+                       'our_double', 'our_real', 'our_boolean', 'our_bit', 'our_json', 'our_jsonb', 'our_uuid',
+                       'our_store', 'our_citext', 'our_inet', 'our_cidr', 'our_mac',
+                       'our_alignment_enum', 'our_money', 'our_int_array', 'our_numeric']
+            for row in ROWS:
+                cur.execute('INSERT INTO "{}" ({}) VALUES {}'.format(TABLE_NAME, ','.join(columns), row))
+
+    def test_matches_python_conversion(self):
+        conn_config = get_test_connection_config()
+        streams = tap_postgres.do_discovery(conn_config)
+        stream = [s for s in streams if s['table_name'] == TABLE_NAME][0]
+        md_map = metadata.to_map(stream['metadata'])
+        desired_columns = sorted(stream['schema']['properties'].keys())
+        tap_postgres.register_type_adapters(conn_config)
+
+        time_extracted = singer.utils.now()
+        written = {}
+        for rendering in ['python', 'server']:
+            md_map[()]['row-rendering'] = rendering
+            columns_sql, column_count = server_json.select_list(desired_columns, md_map)
+            #one json object plus the enum and array columns, which are converted in python
+            self.assertEqual(len(desired_columns) if rendering == 'python' else 3, column_count)
+            write_record = server_json.record_writer(stream, 1, time_extracted, desired_columns, md_map)
+            with post_db.open_connection(conn_config) as conn:
+                psycopg2.extras.register_hstore(conn)
+                with conn.cursor() as cur:
+                    #offsets of timestamptz values are rendered in the session time zone
+                    cur.execute("SET TimeZone = 'America/New_York'")
+                    cur.execute('SELECT {} FROM "{}" ORDER BY id'.format(columns_sql, TABLE_NAME))
+                    stdout, sys.stdout = sys.stdout, io.StringIO()
+                    try:
+                        for row in cur.fetchall():
+                            write_record(row)
+                        written[rendering] = sys.stdout.getvalue().splitlines()
+                    finally:
+                        sys.stdout = stdout
+
+        self.assertEqual(['our_alignment_enum', 'our_int_array'], server_json.rendered_columns(desired_columns, md_map)[1])
+        self.assertEqual(len(ROWS), len(written['server']))
+        for python_line, server_line in zip(written['python'], written['server']):
+            self.assertEqual(serialized(python_line), serialized(server_line))
+
+if __name__ == "__main__":
+    unittest.main()
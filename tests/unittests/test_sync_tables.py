@@ -0,0 +1,151 @@
+import datetime
+import struct
+import unittest
+import singer
+import tap_postgres.db as post_db
+import tap_postgres.sync_strategies.logical_replication as logical_replication
+
+from test_logical_decoder import ReplicationMessage, cows_stream
+from test_pgoutput import COWS, COWS_OID, COMMIT_TS, relation, insert, stream_start, stream_stop
+
+END_LSN = 3010
+
+def begin(final_lsn):
+    return b'B' + struct.pack('>qqi', final_lsn, COMMIT_TS, 1)
+
+def commit(commit_lsn):
+    #the end of a commit record is 10 past its start here
+    return b'C' + struct.pack('>bqqq', 0, commit_lsn, commit_lsn + 10, COMMIT_TS)
+
+def transaction(final_lsn, cow_id, first_lsn, with_relation=False):
+    messages = [(first_lsn, begin(final_lsn))]
+    if with_relation:
+        messages.append((first_lsn + 1, relation(COWS_OID, 'cows', COWS)))
+    messages.append((first_lsn + 2, insert(COWS_OID, [str(cow_id), None, None])))
+    messages.append((final_lsn, commit(final_lsn)))
+    return [(lsn, ReplicationMessage(data_start=lsn, payload=payload)) for lsn, payload in messages]
+
+def keepalive(wal_end):
+    return [(wal_end, None)]
+
+class FakeReplicationCursor():
+    """Plays back (wal_end, message) pairs as a replication cursor would, where a None
+    message is a keepalive telling how far the server has decoded."""
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.wal_end = 0
+        self.flushes = []
+        self.replies = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    @property
+    def io_timestamp(self):
+        return datetime.datetime.now()
+
+    def start_replication(self, **_kwargs):
+        pass
+
+    def read_message(self):
+        if not self.messages:
+            return None
+        self.wal_end, message = self.messages.pop(0)
+        return message
+
+    def send_feedback(self, flush_lsn=None, reply=False, force=False):
+        if flush_lsn is not None:
+            self.flushes.append(flush_lsn)
+        if reply:
+            self.replies += 1
+
+class FakeReplicationConnection():
+    server_version = 140000
+
+    def __init__(self, cur):
+        self.cur = cur
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def cursor(self):
+        return self.cur
+
+class TestSyncTables(unittest.TestCase):
+    def setUp(self):
+        self.written = []
+        self.write_message, singer.write_message = singer.write_message, self.written.append
+        self.patched = [(post_db, 'open_connection', post_db.open_connection),
+                        (logical_replication, 'locate_replication_slot', logical_replication.locate_replication_slot),
+                        (logical_replication, 'fetch_confirmed_flush_lsn', logical_replication.fetch_confirmed_flush_lsn),
+                        (logical_replication, 'select', logical_replication.select)]
+        logical_replication.locate_replication_slot = lambda conn_info: 'stitch'
+        logical_replication.fetch_confirmed_flush_lsn = lambda conn_info, slot: None
+        logical_replication.select = lambda rlist, wlist, xlist, timeout: ([], [], [])
+
+    def tearDown(self):
+        singer.write_message = self.write_message
+        for module, name, value in self.patched:
+            setattr(module, name, value)
+
+    def sync(self, messages, **config):
+        cur = FakeReplicationCursor(messages)
+        post_db.open_connection = lambda conn_info, logical=False: FakeReplicationConnection(cur)
+        conn_info = dict({'dbname': 'postgres', 'logical_decoder': 'pgoutput', 'logical_poll_total_seconds': 60}, **config)
+        state = {'bookmarks': {'postgres-public-cows': {'version': 7, 'lsn': 1}}}
+        state = logical_replication.sync_tables(conn_info, [cows_stream()], state, END_LSN)
+        return cur, state
+
+    def written_lsns(self):
+        #the id of every record, and the bookmark of every STATE
+        return [m.record['id'] if isinstance(m, singer.RecordMessage) else m.value['bookmarks']['postgres-public-cows']['lsn']
+                for m in self.written]
+
+    def test_checkpoints_and_flushes(self):
+        messages = (transaction(1000, 1, 900, with_relation=True) + keepalive(1010) +
+                    transaction(2000, 2, 1500) + keepalive(2010) +
+                    transaction(3000, 3, 2500) + keepalive(END_LSN) +
+                    transaction(4000, 4, 3500))
+        cur, state = self.sync(messages, logical_checkpoint_rows=4, logical_feedback_messages=8)
+
+        #STATE is written at the end of the transactions that reach 4 messages, and once more at the end
+        self.assertEqual([1, 1010, 2, 3, 3010, 3010], self.written_lsns())
+        #and only a position STATE has been written for is reported flushed
+        self.assertEqual([3010], cur.flushes)
+        self.assertEqual(3010, state['bookmarks']['postgres-public-cows']['lsn'])
+        #the run ends at the keepalive reporting end_lsn, without reading on
+        self.assertEqual(transaction(4000, 4, 3500), cur.messages)
+
+    def test_caught_up_within_a_transaction(self):
+        messages = (transaction(1000, 1, 900, with_relation=True) +
+                    transaction(3000, 3, 2500)[:2] + keepalive(END_LSN) + transaction(3000, 3, 2500)[2:] +
+                    keepalive(END_LSN))
+        cur, state = self.sync(messages)
+
+        #a keepalive at end_lsn in the middle of a transaction does not end the run before its commit
+        self.assertEqual([1, 3, 3010], self.written_lsns())
+        self.assertEqual([3010], cur.flushes)
+        self.assertEqual([], cur.messages)
+        self.assertEqual(3010, state['bookmarks']['postgres-public-cows']['lsn'])
+
+    def test_caught_up_between_streamed_blocks(self):
+        streamed = [(2500, ReplicationMessage(data_start=2500, payload=stream_start(9))),
+                    (2501, ReplicationMessage(data_start=2501, payload=insert(COWS_OID, ['9', None, None], xid=9))),
+                    (2502, ReplicationMessage(data_start=2502, payload=stream_stop()))]
+        messages = transaction(1000, 1, 900, with_relation=True) + streamed + keepalive(END_LSN) + keepalive(END_LSN + 100)
+        cur, state = self.sync(messages)
+
+        #the streamed transaction has not committed, so nothing of it is written or bookmarked
+        self.assertEqual([1, 1010], self.written_lsns())
+        self.assertEqual([1010], cur.flushes)
+        self.assertEqual(keepalive(END_LSN + 100), cur.messages)
+        self.assertEqual(1010, state['bookmarks']['postgres-public-cows']['lsn'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import math
+import unittest
+import tap_postgres.sync_strategies.json_codec as json_codec
+import tap_postgres.sync_strategies.wal2json as wal2json
+
+INSERT = {'kind': 'insert', 'schema': 'public', 'table': 'cows', 'columnnames': ['id', 'name'], 'columnvalues': [1, '"change":[']}
+DELETE = {'kind': 'delete', 'schema': 'public', 'table': 'cows', 'oldkeys': {'keynames': ['id'], 'keyvalues': [1]}}
+
+class TestChangeStream(unittest.TestCase):
+    def feed(self, stream, payloads):
+        changes = []
+        for payload in payloads:
+            changes.extend(stream.feed(payload))
+        return changes
+
+    def test_whole_transactions(self):
+        stream = wal2json.ChangeStream()
+        payloads = [json.dumps({'xid': 1, 'nextlsn': '0/16B2470', 'change': [INSERT, DELETE]}),
+                    json.dumps({'xid': 2, 'change': []}),
+                    json.dumps({'xid': 3, 'change': [DELETE]}, indent=4)]
+        self.assertEqual([INSERT, DELETE, DELETE], self.feed(stream, payloads))
+
+    def test_chunks(self):
+        #as wal2json writes them with write-in-chunks
+        stream = wal2json.ChangeStream()
+        payloads = ['{"xid":1,"timestamp":"2019-01-01 00:00:00+00","change":[', json.dumps(INSERT), ',' + json.dumps(DELETE), ']}',
+                    '{"xid":2,"change":[', ']}',
+                    '{"xid":3,"change":[', json.dumps(DELETE), ']}']
+        self.assertEqual([INSERT, DELETE, DELETE], self.feed(stream, payloads))
+
+    def test_in_transaction(self):
+        stream = wal2json.ChangeStream()
+        in_transaction = []
+        for payload in ['{"xid":1,"change":[', json.dumps(INSERT), ']}', json.dumps({'xid': 2, 'change': [INSERT]})]:
+            list(stream.feed(payload))
+            in_transaction.append(stream.in_transaction)
+        self.assertEqual([True, True, False, False], in_transaction)
+
+    def test_bytes(self):
+        stream = wal2json.ChangeStream()
+        payloads = [p.encode('utf-8') for p in ['{"xid":1,"change":[', json.dumps(INSERT), ',' + json.dumps(DELETE), ']}',
+                                                json.dumps({'xid': 2, 'change': [INSERT]})]]
+        self.assertEqual([INSERT, DELETE, INSERT], self.feed(stream, payloads))
+
+    def test_changes_are_parsed_one_at_a_time(self):
+        changes = wal2json.ChangeStream().feed('{"xid":1,"change":[' + json.dumps(INSERT) + ',{"kind": "trunc')
+        self.assertEqual(INSERT, next(changes))
+        with self.assertRaises(ValueError):
+            next(changes)
+
+class TestJsonCodec(unittest.TestCase):
+    def test_values_beyond_orjson(self):
+        self.assertEqual({'id': 2 ** 70, 'double': 1.5}, json_codec.loads(b'{"id": 1180591620717411303424, "double": 1.5}'))
+        self.assertTrue(math.isnan(json_codec.loads('[NaN]')[0]))
+        with self.assertRaises(ValueError):
+            json_codec.loads(b'{"truncated": ')
+
+if __name__ == "__main__":
+    unittest.main()